@@ -0,0 +1,242 @@
+"""Admission control for chunk and file transfer routes.
+
+Two checks run before a guarded handler:
+
+- Bandwidth per owner and per agreement, enforced with token buckets
+  refilled at a fixed number of bytes per second. Both come from the
+  `X-Owner` and `X-Agreement-Id` headers unless the route passes its own
+  `identity` function. Identity never comes from the body, which would
+  have to be received before the request could be turned away. Uploads are
+  charged their Content-Length up front; downloads are charged the size of
+  the response afterwards, so a bucket in debt holds back that owner's next
+  request. A request over its budget gets `429` with `Retry-After`.
+- A bounded number of requests in flight. Past it requests wait in a short
+  queue ordered by priority class (`X-Priority`: interactive, normal or
+  bulk), and when the queue is full or the wait runs out they are shed at
+  once with `503` and `Retry-After` instead of piling up behind the disk.
+  Bulk traffic (backups, repair, verification) may only use part of the
+  slots, so interactive reads always find room.
+"""
+import math
+import heapq
+import time
+import itertools
+import threading
+import functools
+
+from flask import request, jsonify, make_response
+
+INTERACTIVE = 'interactive'
+NORMAL = 'normal'
+BULK = 'bulk'
+PRIORITIES = {INTERACTIVE: 0, NORMAL: 1, BULK: 2}
+
+
+def header_identity(**view_args):
+    """(owner, agreement_id) of a request from its headers"""
+    return request.headers.get('X-Owner'), request.headers.get('X-Agreement-Id')
+
+
+def query_identity(**view_args):
+    """(owner, agreement_id) from the headers, else from the query string"""
+    owner, agreement_id = header_identity()
+    return (owner or request.args.get('owner'),
+            agreement_id or request.args.get('agreement_id'))
+
+
+class TokenBuckets:
+    """Token buckets by key, refilled at `rate` units per second up to `burst`"""
+
+    def __init__(self, rate, burst=None, max_keys=10000):
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _refill(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self, key, amount):
+        """Charge `amount` if the bucket allows it; return 0, or the seconds until it would.
+
+        Requests larger than the burst pass on a full bucket and leave it in
+        debt, so the long-run rate still holds.
+        """
+        if not self.enabled or not key:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            need = min(amount, self.burst)
+            if tokens < need:
+                self._buckets[key] = (tokens, now)
+                return (need - tokens) / self.rate
+            self._buckets[key] = (tokens - amount, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def charge(self, key, amount):
+        """Charge `amount` unconditionally, possibly going into debt; negative refunds"""
+        if not self.enabled or not key or not amount:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (self._refill(key, now) - amount, now)
+
+    def _prune(self, now):
+        # Full buckets carry no state worth keeping
+        for key in [key for key in self._buckets if self._refill(key, now) >= self.burst]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class InFlightLimiter:
+    """At most `max_in_flight` holders, with a bounded priority queue of waiters"""
+
+    def __init__(self, max_in_flight, max_queue=128, queue_timeout=5.0, bulk_share=0.75):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limits = {priority: max_in_flight for priority in PRIORITIES.values()}
+        self.limits[PRIORITIES[BULK]] = max(1, int(max_in_flight * bulk_share))
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []  # heap of [priority, seq, state]
+        self._seq = itertools.count()
+
+    def acquire(self, priority):
+        """Take a slot, waiting in the queue if needed; False when the request is shed"""
+        if self.max_in_flight <= 0:
+            return True
+        rank = PRIORITIES[priority]
+        with self._cond:
+            if not self._waiting and self._in_flight < self.limits[rank]:
+                self._in_flight += 1
+                return True
+            if len(self._waiting) >= self.max_queue:
+                # A full queue sheds its least important waiter, or the newcomer
+                worst = max(self._waiting)
+                if worst[0] <= rank:
+                    return False
+                worst[2]['shed'] = True
+                self._waiting.remove(worst)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            entry = [rank, next(self._seq), {'shed': False}]
+            heapq.heappush(self._waiting, entry)
+            deadline = time.monotonic() + self.queue_timeout
+            while True:
+                if entry[2]['shed']:
+                    return False
+                if self._waiting[0] is entry and self._in_flight < self.limits[rank]:
+                    heapq.heappop(self._waiting)
+                    self._in_flight += 1
+                    self._cond.notify_all()
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+
+    def release(self):
+        if self.max_in_flight <= 0:
+            return
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {'in_flight': self._in_flight, 'queued': len(self._waiting), 'max_in_flight': self.max_in_flight}
+
+
+class Admission:
+    """Rate limits per owner and agreement plus the in-flight limit, applied with `guard()`"""
+
+    def __init__(self, max_in_flight=64, max_queue=128, queue_timeout=5.0, bulk_share=0.75,
+                 owner_rate=0, owner_burst=None, agreement_rate=0, agreement_burst=None,
+                 retry_after=1, rejected_counter=None):
+        self.slots = InFlightLimiter(max_in_flight, max_queue, queue_timeout, bulk_share)
+        self.owners = TokenBuckets(owner_rate, owner_burst)
+        self.agreements = TokenBuckets(agreement_rate, agreement_burst)
+        self.retry_after = retry_after
+        self.rejected_counter = rejected_counter
+        self._lock = threading.Lock()
+        self._rejected = {'rate_limited': 0, 'shed': 0}
+
+    @staticmethod
+    def priority(value, default=NORMAL):
+        value = (value or '').lower()
+        return value if value in PRIORITIES else default
+
+    def _reject(self, reason, priority, status_code, message, retry_after):
+        with self._lock:
+            self._rejected[reason] += 1
+        if self.rejected_counter:
+            self.rejected_counter.labels(reason, priority).inc()
+        response = make_response(jsonify({'error': message, 'retry_after': retry_after}), status_code)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def guard(self, default_priority=NORMAL, charge_response=False, identity=header_identity):
+        """Decorator for a Flask route.
+
+        Requests are charged their Content-Length, or with `charge_response`
+        the size of a successful response once it is built. `identity` is
+        called with the route's arguments and returns (owner, agreement_id);
+        requests without an owner are limited by client address.
+        """
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                priority = self.priority(request.headers.get('X-Priority'), default_priority)
+                owner, agreement_id = identity(**kwargs)
+                owner = owner or request.remote_addr
+                upfront = 0 if charge_response else (request.content_length or 0)
+
+                wait = self.owners.take(owner, upfront)
+                if not wait:
+                    wait = self.agreements.take(agreement_id, upfront)
+                    if wait:
+                        self.owners.charge(owner, -upfront)
+                if wait:
+                    return self._reject('rate_limited', priority, 429, 'Bandwidth limit reached, retry later',
+                                        max(1, math.ceil(wait)))
+
+                if not self.slots.acquire(priority):
+                    self.owners.charge(owner, -upfront)
+                    self.agreements.charge(agreement_id, -upfront)
+                    return self._reject('shed', priority, 503, 'Too many requests in flight, retry later',
+                                        self.retry_after)
+                try:
+                    response = make_response(handler(*args, **kwargs))
+                finally:
+                    self.slots.release()
+
+                if charge_response and response.status_code == 200:
+                    size = response.content_length or 0
+                    self.owners.charge(owner, size)
+                    self.agreements.charge(agreement_id, size)
+                return response
+            return wrapper
+        return decorator
+
+    def status(self):
+        status = self.slots.status()
+        with self._lock:
+            status['rejected'] = dict(self._rejected)
+        status['owner_buckets'] = len(self.owners)
+        status['agreement_buckets'] = len(self.agreements)
+        return status
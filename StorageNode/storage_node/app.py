@@ -5,18 +5,46 @@ import requests
 import json
 import time
 import hashlib
+import errno
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import base64
 import shutil
 import stat
-from web3 import Web3
 import atexit
 import signal
 import sys
+import threading
+from tx_manager import TransactionManager
+from chain import ChainClient, checksum_address
+from merkle import SEGMENT_SIZE, segment_hashes, tree_levels, merkle_root, merkle_proof
+from scrubber import Scrubber
+from reservations import ReservationLedger
+from tiering import TieredStore, open_chunk
+from admission import Admission, INTERACTIVE, header_identity
+import transfer_token
+from transfer_token import TokenError
+from telemetry import REGISTRY, StartupTimer, instrument_app, install_profiling, inject_headers
+
+startup = StartupTimer('storage_node')
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app, 'storage_node')
+install_profiling(app)
+
+# Chunk I/O latencies and volumes
+chunk_io_latency = REGISTRY.histogram(
+    'storage_chunk_io_duration_seconds', 'Disk time per chunk operation', ('operation',))
+chunk_bytes = REGISTRY.counter(
+    'storage_chunk_bytes_total', 'Chunk bytes written and read', ('direction',))
+CHUNK_WRITE = chunk_io_latency.labels('write')
+CHUNK_READ = chunk_io_latency.labels('read')
+CHUNK_METADATA_SAVE = chunk_io_latency.labels('metadata_save')
+admission_rejected = REGISTRY.counter(
+    'admission_rejected_total', 'Requests turned away by rate limits or load shedding', ('reason', 'priority'))
+transfer_tokens = REGISTRY.counter(
+    'storage_transfer_tokens_total', 'Chunk transfers presenting a token, by outcome', ('operation', 'result'))
 
 WALLET_ADDRESS = os.getenv('WALLET_ADDRESS', '')
 NODE_ID = os.getenv('NODE_ID', 'node_default')
@@ -27,49 +55,85 @@ port = os.getenv('PORT', '6000')
 
 
 
-COORDINATOR_URL ='http://10.6.0.63:5001'
-BLOCKCHAIN_URL = 'http://10.6.0.63:8545'
-STORAGE_PATH = './storage'
+COORDINATOR_URL = os.getenv('COORDINATOR_URL', 'http://10.6.0.63:5001')
+BLOCKCHAIN_URL = os.getenv('BLOCKCHAIN_URL', 'http://10.6.0.63:8545')
+STORAGE_PATH = os.getenv('FAST_TIER_PATH', './storage')  # Fast tier (e.g. SSD) for regular chunks
+CAPACITY_TIER_PATH = os.getenv('CAPACITY_TIER_PATH', '')  # Capacity tier (e.g. HDD), empty disables tiering
 LOCKED_STORAGE_PATH = './locked_storage'  # Directory for storage that is locked for rental
+SEGMENTS_PATH = './segments'  # Segment hashes of each chunk, for storage challenges
+MAX_CHALLENGE_SEGMENTS = int(os.getenv('MAX_CHALLENGE_SEGMENTS', '64'))
+QUARANTINE_PATH = './quarantine'  # Chunks that failed a scrub, kept for inspection
+SCRUB_BYTES_PER_SEC = int(os.getenv('SCRUB_BYTES_PER_SEC', str(8 * 1024 * 1024)))  # 0 disables scrubbing
+SCRUB_PASS_INTERVAL = float(os.getenv('SCRUB_PASS_INTERVAL', '86400'))  # seconds between full passes
+STORAGE_PREALLOCATE = os.getenv('STORAGE_PREALLOCATE', 'false').lower() == 'true'  # back reservations with fallocate
+FAST_TIER_LIMIT_MB = int(os.getenv('FAST_TIER_LIMIT_MB', str(STORAGE_LIMIT_MB)))
+CAPACITY_TIER_LIMIT_MB = int(os.getenv('CAPACITY_TIER_LIMIT_MB', str(STORAGE_LIMIT_MB)))
+CAPACITY_TIER_COMPRESS = os.getenv('CAPACITY_TIER_COMPRESS', 'false').lower() == 'true'
+TIER_HALF_LIFE = float(os.getenv('TIER_HALF_LIFE', '3600'))  # seconds for a chunk's read score to halve
+TIER_PROMOTE_SCORE = float(os.getenv('TIER_PROMOTE_SCORE', '3'))  # decayed reads before promotion
+TIER_MOVE_INTERVAL = float(os.getenv('TIER_MOVE_INTERVAL', '60'))  # seconds between mover cycles, 0 disables
+TIER_MOVE_MAX_MB = int(os.getenv('TIER_MOVE_MAX_MB', '256'))  # bytes moved per cycle
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', '30'))  # seconds between re-registrations, 0 disables
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '32'))  # concurrent /store and /retrieve requests, 0 disables
+MAX_QUEUED = int(os.getenv('MAX_QUEUED', '64'))  # requests waiting for a slot before new ones are shed
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', '2'))  # seconds a queued request waits before a 503
+BULK_SHARE = float(os.getenv('BULK_SHARE', '0.75'))  # share of the slots X-Priority: bulk may use
+OWNER_RATE_MB_PER_SEC = float(os.getenv('OWNER_RATE_MB_PER_SEC', '0'))  # per X-Owner, 0 disables
+OWNER_BURST_MB = float(os.getenv('OWNER_BURST_MB', '0'))  # defaults to one second of the rate
+AGREEMENT_RATE_MB_PER_SEC = float(os.getenv('AGREEMENT_RATE_MB_PER_SEC', '0'))  # per X-Agreement-Id, 0 disables
+AGREEMENT_BURST_MB = float(os.getenv('AGREEMENT_BURST_MB', '0'))
+TRANSFER_TOKEN_SECRET = os.getenv('TRANSFER_TOKEN_SECRET', '')  # shared with the client API, empty disables direct transfers
+REQUIRE_TRANSFER_TOKEN = os.getenv('REQUIRE_TRANSFER_TOKEN', 'false').lower() == 'true'  # refuse /store and /retrieve without one
 
 # Create storage directories if they don't exist
-if not os.path.exists(STORAGE_PATH):
-    os.makedirs(STORAGE_PATH)
-
 if not os.path.exists(LOCKED_STORAGE_PATH):
     os.makedirs(LOCKED_STORAGE_PATH)
 
+if not os.path.exists(SEGMENTS_PATH):
+    os.makedirs(SEGMENTS_PATH)
+
 
 # WALLET_PRIVATE_KEY = os.getenv('WALLET_PRIVATE_KEY', '')
 
-# Initialize Web3
-w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
+# Bandwidth per owner and agreement, and a bounded number of chunk transfers in flight
+admission = Admission(
+    max_in_flight=MAX_IN_FLIGHT,
+    max_queue=MAX_QUEUED,
+    queue_timeout=QUEUE_TIMEOUT,
+    bulk_share=BULK_SHARE,
+    owner_rate=OWNER_RATE_MB_PER_SEC * 1024 * 1024,
+    owner_burst=OWNER_BURST_MB * 1024 * 1024,
+    agreement_rate=AGREEMENT_RATE_MB_PER_SEC * 1024 * 1024,
+    agreement_burst=AGREEMENT_BURST_MB * 1024 * 1024,
+    rejected_counter=admission_rejected
+)
+REGISTRY.gauge_callback(
+    'admission_requests', 'Chunk requests in flight and queued',
+    lambda: {(state,): value for state, value in admission.slots.status().items() if state != 'max_in_flight'},
+    ('state',))
+
+startup.mark('config')
 
 # Convert wallet address to checksum format if provided
 if WALLET_ADDRESS:
-    WALLET_ADDRESS = Web3.to_checksum_address(WALLET_ADDRESS)
+    WALLET_ADDRESS = checksum_address(WALLET_ADDRESS)
     print(f"Using wallet address: {WALLET_ADDRESS}")
 
-# Load contract if ABI is available
+# Contract ABI and address written by the deployer
 CONTRACT_ABI_PATH = os.path.join(os.path.dirname(__file__), 'data', 'contract_abi.json')
 CONTRACT_ADDRESS_FILE = os.getenv('CONTRACT_ADDRESS_FILE', '/app/data/contract_address.txt')
-contract = None
-CONTRACT_ADDRESS = ''
+CHAIN_TIMEOUT = float(os.getenv('CHAIN_TIMEOUT', '10'))
+CHAIN_CHECK_INTERVAL = float(os.getenv('CHAIN_CHECK_INTERVAL', '30'))  # 0 disables connection checks
 
 # Create data directory if it doesn't exist
 os.makedirs(os.path.dirname(CONTRACT_ABI_PATH), exist_ok=True)
 
-# Read contract address from file if it exists
-if os.path.exists(CONTRACT_ADDRESS_FILE):
-    try:
-        with open(CONTRACT_ADDRESS_FILE, 'r') as f:
-            CONTRACT_ADDRESS = f.read().strip()
-        print(f"Loaded contract address: {CONTRACT_ADDRESS}")
-    except Exception as e:
-        print(f"Error reading contract address: {e}")
+# Chain client and contract are created on first use, so serving chunks never waits on the chain
+chain = ChainClient(BLOCKCHAIN_URL, abi_path=CONTRACT_ABI_PATH, address_file=CONTRACT_ADDRESS_FILE,
+                    timeout=CHAIN_TIMEOUT)
 
 # Copy contract ABI from coordinator if not available
-if not os.path.exists(CONTRACT_ABI_PATH) and CONTRACT_ADDRESS:
+if not os.path.exists(CONTRACT_ABI_PATH) and chain.address:
     try:
         coordinator_abi_path = '/app/data/contract_abi.json'
         if os.path.exists(coordinator_abi_path):
@@ -78,15 +142,11 @@ if not os.path.exists(CONTRACT_ABI_PATH) and CONTRACT_ADDRESS:
     except Exception as e:
         print(f"Error copying contract ABI: {e}")
 
-# Load contract ABI if available
-if os.path.exists(CONTRACT_ABI_PATH) and CONTRACT_ADDRESS:
-    try:
-        with open(CONTRACT_ABI_PATH, 'r') as f:
-            contract_abi = json.load(f)
-        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-        print(f"Contract loaded successfully at address {CONTRACT_ADDRESS}")
-    except Exception as e:
-        print(f"Error loading contract: {e}")
+# Contract transactions are confirmed in the background, not inside HTTP handlers
+TX_RECEIPT_TIMEOUT = int(os.getenv('TX_RECEIPT_TIMEOUT', '120'))
+tx_manager = TransactionManager(lambda: chain.web3, max_workers=2, receipt_timeout=TX_RECEIPT_TIMEOUT)
+
+startup.mark('chain')
 
 # Store file chunk metadata
 CHUNKS_METADATA_FILE = 'chunks_metadata.json'
@@ -105,19 +165,168 @@ def save_chunks_metadata(metadata):
     with open(CHUNKS_METADATA_FILE, 'w') as f:
         json.dump(metadata, f)
 
-# Get used storage in MB
+REGISTRY.gauge_callback(
+    'storage_space_mb', 'Used and locked space on this node in MB',
+    lambda: {('used',): get_used_space_mb(), ('locked',): get_locked_space_mb(), ('limit',): STORAGE_LIMIT_MB},
+    ('kind',))
+
+# Regular chunks, placed on the fast or capacity tier by how often they are read
+tiers = TieredStore(
+    STORAGE_PATH,
+    CAPACITY_TIER_PATH or None,
+    fast_limit=FAST_TIER_LIMIT_MB * 1024 * 1024,
+    capacity_limit=CAPACITY_TIER_LIMIT_MB * 1024 * 1024,
+    compress_capacity=CAPACITY_TIER_COMPRESS,
+    half_life=TIER_HALF_LIFE,
+    promote_score=TIER_PROMOTE_SCORE,
+    move_bytes=TIER_MOVE_MAX_MB * 1024 * 1024,
+    state_file='tier_access.json'
+)
+
+# Get used storage in MB, from the running totals of the tiers
 def get_used_space_mb():
-    total = 0
-    for f in os.listdir(STORAGE_PATH):
-        total += os.path.getsize(os.path.join(STORAGE_PATH, f))
-    return total / (1024 * 1024)
-
-# Get locked storage space in MB
+    return tiers.used_bytes() / (1024 * 1024)
+
+# Reserved and consumed space per agreement, replacing the .space placeholder files
+reservations = ReservationLedger(
+    'reservations.json',
+    preallocate_dir=os.path.join(LOCKED_STORAGE_PATH, '.reserve'),
+    preallocate=STORAGE_PREALLOCATE
+)
+migrated = reservations.migrate_space_files(LOCKED_STORAGE_PATH, load_chunks_metadata())
+if migrated:
+    print(f"Migrated {migrated} locked storage placeholders to reservations")
+
+# Get locked storage space in MB, reserved or already used by agreements
 def get_locked_space_mb():
-    total = 0
-    for f in os.listdir(LOCKED_STORAGE_PATH):
-        total += os.path.getsize(os.path.join(LOCKED_STORAGE_PATH, f))
-    return total / (1024 * 1024)
+    return reservations.held_bytes() / (1024 * 1024)
+
+def transfer_grant(operation, chunk_id):
+    """Return (claims, None) for a valid transfer token, (None, None) without one, or (None, error response)"""
+    token = request.headers.get('X-Transfer-Token') or request.args.get('token')
+    if not token:
+        if REQUIRE_TRANSFER_TOKEN:
+            return None, (jsonify({'error': 'Transfer token required'}), 401)
+        return None, None
+    if not TRANSFER_TOKEN_SECRET:
+        return None, (jsonify({'error': 'Transfer tokens are not enabled on this node'}), 403)
+    try:
+        claims = transfer_token.verify(TRANSFER_TOKEN_SECRET, token, operation, chunk_id, NODE_ID)
+    except TokenError as e:
+        transfer_tokens.labels(operation, 'rejected').inc()
+        return None, (jsonify({'error': str(e)}), 403)
+    transfer_tokens.labels(operation, 'accepted').inc()
+    return claims, None
+
+def transfer_identity(chunk_id, **view_args):
+    """Owner and agreement for admission, from a valid transfer token or else the headers"""
+    token = request.headers.get('X-Transfer-Token') or request.args.get('token')
+    if token and TRANSFER_TOKEN_SECRET:
+        operation = transfer_token.STORE if request.method == 'POST' else transfer_token.RETRIEVE
+        try:
+            claims = transfer_token.verify(TRANSFER_TOKEN_SECRET, token, operation, chunk_id, NODE_ID)
+            return claims.get('owner'), claims.get('agreement_id')
+        except TokenError:
+            pass  # refused by the route itself
+    return header_identity()
+
+def save_segment_hashes(chunk_id, data):
+    hashes = segment_hashes(data)
+    with open(os.path.join(SEGMENTS_PATH, chunk_id), 'wb') as f:
+        f.write(b''.join(hashes))
+    return hashes
+
+def load_segment_hashes(chunk_id, filepath):
+    """Segment hashes of a stored chunk, computed once for chunks stored before the sidecar existed"""
+    try:
+        with open(os.path.join(SEGMENTS_PATH, chunk_id), 'rb') as f:
+            raw = f.read()
+        return [raw[i:i + 32] for i in range(0, len(raw), 32)]
+    except FileNotFoundError:
+        with open_chunk(filepath) as f:
+            return save_segment_hashes(chunk_id, f.read())
+
+def locate_chunk(chunk_id):
+    """Path of a stored chunk on either tier or in locked storage, or None"""
+    _, filepath = tiers.locate(chunk_id)
+    if filepath:
+        return filepath
+    filepath = os.path.join(LOCKED_STORAGE_PATH, chunk_id)
+    return filepath if os.path.exists(filepath) else None
+
+def check_read_access(chunk_id, metadata, grant=None):
+    """Error response if the requester, or the holder of a transfer token, may not read this chunk, else None"""
+    if chunk_id in metadata and metadata[chunk_id].get('in_locked_storage', False):
+        # Require owner verification or agreement verification
+        owner = grant.get('owner') if grant else request.headers.get('X-Owner')
+        agreement_id = grant.get('agreement_id') if grant else request.headers.get('X-Agreement-Id')
+        
+        if not owner and not agreement_id:
+            return jsonify({'error': 'Authorization required for this chunk'}), 403
+        
+        # If using agreement_id, verify with blockchain
+        if agreement_id and chain.configured:
+            try:
+                # Verify access is allowed - this would be a call to the contract
+                # to check if the requester is the owner of the agreement
+                pass  # Additional blockchain verification would go here
+            except:
+                return jsonify({'error': 'Blockchain verification failed'}), 403
+        
+        # If using owner, check against metadata
+        if owner and metadata[chunk_id].get('owner') != owner:
+            return jsonify({'error': 'Owner mismatch'}), 403
+    return None
+
+def report_corruption():
+    """Send quarantined chunks the coordinator has not heard about yet"""
+    metadata = load_chunks_metadata()
+    pending = [entry for entry in metadata.values()
+               if entry.get('quarantined_at') and not entry.get('corruption_reported')]
+    if not pending:
+        return
+    res = requests.post(f'{COORDINATOR_URL}/report_corruption', headers=inject_headers(), json={
+        'node_id': NODE_ID,
+        'chunks': [{
+            'chunk_id': entry['chunk_id'],
+            'file_id': entry.get('file_id'),
+            'owner': entry.get('owner'),
+            'agreement_id': entry.get('agreement_id'),
+            'bad_segments': entry.get('bad_segments', []),
+            'detected_at': entry['quarantined_at']
+        } for entry in pending]
+    }, timeout=10)
+    res.raise_for_status()
+    metadata = load_chunks_metadata()
+    for entry in pending:
+        if entry['chunk_id'] in metadata:
+            metadata[entry['chunk_id']]['corruption_reported'] = True
+    save_chunks_metadata(metadata)
+
+def chunk_corrupted(chunk_id, bad_segments):
+    """Scrubber callback for a chunk that was moved to quarantine"""
+    metadata = load_chunks_metadata()
+    entry = metadata.setdefault(chunk_id, {'chunk_id': chunk_id})
+    entry.update({'quarantined_at': time.time(), 'bad_segments': bad_segments, 'corruption_reported': False})
+    save_chunks_metadata(metadata)
+    tiers.detach(chunk_id)
+    try:
+        report_corruption()
+    except Exception as e:
+        print(f"Corruption report failed, retrying with the next heartbeat: {e}")
+
+# Re-hashes stored chunks in the background, pausing while chunks are being served
+scrubber = Scrubber(
+    list(tiers.dirs.values()) + [LOCKED_STORAGE_PATH],
+    QUARANTINE_PATH,
+    'scrub_state.json',
+    segments_dir=SEGMENTS_PATH,
+    bytes_per_sec=SCRUB_BYTES_PER_SEC,
+    pass_interval=SCRUB_PASS_INTERVAL,
+    on_corrupt=chunk_corrupted
+)
+
+startup.mark('storage')
 
 # Lock storage space for client usage
 @app.route('/lock_storage', methods=['POST'])
@@ -132,28 +341,20 @@ def lock_storage():
     if available < size_mb:
         return jsonify({'error': f'Not enough free space. Available: {available}MB, Requested: {size_mb}MB'}), 400
     
-    # Create a dedicated space file of specified size (sparse file)
-    lock_file = os.path.join(LOCKED_STORAGE_PATH, f"{NODE_ID}_{size_mb}MB.space")
-    
-    # Create a sparse file of the specified size
-    with open(lock_file, 'wb') as f:
-        f.seek(size_mb * 1024 * 1024 - 1)  # Convert MB to bytes
-        f.write(b'\0')
-    
-    # Set file permissions to prevent modification (readonly except for owner)
-    os.chmod(lock_file, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    # Reserve the space for the agreement the client will create for it (node_id-size_mb)
+    try:
+        reservation = reservations.reserve(f"{NODE_ID}-{size_mb}", size_mb * 1024 * 1024)
+    except OSError as e:
+        return jsonify({'error': f'Failed to preallocate space: {str(e)}'}), 507
     
     # Register the locked storage with the blockchain
-    if contract:
-        try:
-            tx_hash = contract.functions.lockStorage(
-                NODE_ID,
-                size_mb
-            ).transact({'from': WALLET_ADDRESS})
-            tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-            tx_success = tx_receipt.status == 1
-        except Exception as e:
-            return jsonify({'error': f'Blockchain transaction failed: {str(e)}'}), 500
+    job_id = None
+    if chain.configured:
+        job_id = tx_manager.submit([{
+            'name': 'lockStorage',
+            'call': lambda: chain.contract.functions.lockStorage(NODE_ID, size_mb),
+            'tx': {'from': WALLET_ADDRESS}
+        }], description=f'lock {size_mb}MB on {NODE_ID}')
     
     # Update coordinator
     try:
@@ -165,30 +366,103 @@ def lock_storage():
         'status': 'locked',
         'node_id': NODE_ID,
         'size_mb': size_mb,
-        'lock_file': lock_file
-    }), 200
+        'reservation': reservation,
+        'job_id': job_id
+    }), 202 if job_id else 200
+
+@app.route('/release_storage', methods=['POST'])
+def release_storage():
+    """Give back the unused part of an agreement's reservation"""
+    agreement_id = (request.json or {}).get('agreement_id')
+    if not agreement_id:
+        return jsonify({'error': 'agreement_id required'}), 400
+    if request.headers.get('X-Owner', '').lower() != WALLET_ADDRESS.lower():
+        return jsonify({'error': 'Only the node owner can release storage'}), 403
+    
+    reservation = reservations.release(agreement_id)
+    if reservation is None:
+        return jsonify({'error': 'Reservation not found'}), 404
+    try:
+        update_used_space()
+    except Exception as e:
+        print(f"Failed to update coordinator: {e}")
+    return jsonify({'status': 'released', 'reservation': reservation}), 200
+
+@app.route('/reservations', methods=['GET'])
+def list_reservations():
+    return jsonify(reservations.all()), 200
+
+@app.route('/tx_jobs/<job_id>', methods=['GET'])
+def tx_job_status(job_id):
+    """Status of a background blockchain transaction job"""
+    job = tx_manager.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
 
 @app.route('/store/<chunk_id>', methods=['POST'])
+@admission.guard(identity=transfer_identity)
 def store_chunk(chunk_id):
-    used = get_used_space_mb()
-    if used >= STORAGE_LIMIT_MB:
-        return jsonify({'error': 'Storage full'}), 507
-
-    # Get optional metadata
+    grant, denied = transfer_grant(transfer_token.STORE, chunk_id)
+    if denied:
+        return denied
+    
+    # Get optional metadata, from the token when the client API signed one
     owner = request.headers.get('X-Owner', 'anonymous')
     file_id = request.headers.get('X-File-Id', '')
     encryption = request.headers.get('X-Encryption', 'none')
     agreement_id = request.headers.get('X-Agreement-Id', '')
+    if grant:
+        owner = grant.get('owner') or 'anonymous'
+        file_id = grant.get('file_id', '')
+        encryption = grant.get('encryption', 'none')
+        agreement_id = grant.get('agreement_id') or ''
+        if len(request.data) > grant.get('max_size', len(request.data)):
+            return jsonify({'error': 'Chunk is larger than the transfer token allows'}), 413
+        # Bytes sent straight by a user never went through the client API's hashing
+        if grant.get('check_hash') and hashlib.sha256(request.data).hexdigest() != chunk_id:
+            return jsonify({'error': 'Chunk content does not match its id'}), 400
     
-    # If this is for a locked storage, store it in the appropriate directory
-    target_dir = STORAGE_PATH
+    # Locked storage chunks have their own directory, regular ones go to a tier
     if agreement_id:
-        target_dir = LOCKED_STORAGE_PATH
+        filepath = os.path.join(LOCKED_STORAGE_PATH, chunk_id)
+        exists = os.path.exists(filepath)
+    else:
+        exists = tiers.locate(chunk_id)[1] is not None
+    size_mb = len(request.data) / (1024 * 1024)  # Size in MB
+    
+    # Rewriting a stored chunk (same content, same id) takes no new space
+    charged = False
+    if not exists:
+        if agreement_id and reservations.has_reservation(agreement_id):
+            if not reservations.consume(agreement_id, len(request.data)):
+                return jsonify({'error': f'Reservation for agreement {agreement_id} is full'}), 507
+            charged = True
+        else:
+            # Unreserved writes must fit in the space no agreement holds
+            if get_used_space_mb() + get_locked_space_mb() + size_mb > STORAGE_LIMIT_MB:
+                return jsonify({'error': 'Storage full'}), 507
+            if agreement_id:
+                charged = reservations.consume(agreement_id, len(request.data))
     
-    # Store the chunk
-    filepath = os.path.join(target_dir, chunk_id)
-    with open(filepath, 'wb') as f:
-        f.write(request.data)
+    # Store the chunk, optionally on the tier the client asked for (X-Tier: fast or capacity)
+    try:
+        with CHUNK_WRITE.time():
+            if agreement_id:
+                with open(filepath, 'wb') as f:
+                    f.write(request.data)
+            else:
+                tiers.put(chunk_id, request.data, tier=request.headers.get('X-Tier'))
+    except OSError as e:
+        # Space is charged before the write so concurrent stores cannot overbook; give it back
+        if charged:
+            reservations.free(agreement_id, len(request.data))
+        if agreement_id and not exists and os.path.exists(filepath):
+            os.remove(filepath)
+        print(f"Failed to store chunk {chunk_id}: {e}")
+        return jsonify({'error': f'Failed to store chunk: {e}'}), 507 if e.errno == errno.ENOSPC else 500
+    chunk_bytes.labels('in').inc(len(request.data))
+    hashes = save_segment_hashes(chunk_id, request.data)
     
     # Set permissions so it's secure and immutable by seller
     if agreement_id:
@@ -196,19 +470,19 @@ def store_chunk(chunk_id):
         os.chmod(filepath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
     
     # Update metadata
-    chunk_size = len(request.data) / (1024 * 1024)  # Size in MB
     metadata = load_chunks_metadata()
     metadata[chunk_id] = {
         'chunk_id': chunk_id,
         'file_id': file_id,
         'owner': owner,
-        'size_mb': chunk_size,
+        'size_mb': size_mb,
         'created_at': time.time(),
         'encryption': encryption,
         'agreement_id': agreement_id,
         'in_locked_storage': bool(agreement_id)
     }
-    save_chunks_metadata(metadata)
+    with CHUNK_METADATA_SAVE.time():
+        save_chunks_metadata(metadata)
     
     # Register the updated space usage with coordinator
     try:
@@ -216,49 +490,89 @@ def store_chunk(chunk_id):
     except:
         pass  # Silent failure if coordinator is unavailable
     
-    return jsonify({
+    result = {
         'status': 'stored', 
         'chunk_id': chunk_id,
         'node_id': NODE_ID
-    })
+    }
+    if grant and grant.get('check_hash'):
+        # Proof for the client API of what was stored where, without asking this node
+        result['receipt'] = transfer_token.sign(
+            TRANSFER_TOKEN_SECRET, transfer_token.STORED, chunk_id, NODE_ID,
+            file_id=file_id, owner=owner, size=len(request.data), segment_root=merkle_root(hashes).hex())
+    return jsonify(result)
 
 @app.route('/retrieve/<chunk_id>', methods=['GET'])
+@admission.guard(default_priority=INTERACTIVE, charge_response=True, identity=transfer_identity)
 def retrieve_chunk(chunk_id):
-    # Check main storage path
-    filepath = os.path.join(STORAGE_PATH, chunk_id)
+    grant, denied = transfer_grant(transfer_token.RETRIEVE, chunk_id)
+    if denied:
+        return denied
     
-    # If not in main storage, check locked storage
-    if not os.path.exists(filepath):
-        filepath = os.path.join(LOCKED_STORAGE_PATH, chunk_id)
+    # Check both tiers, then locked storage
+    filepath = locate_chunk(chunk_id)
     
-    if os.path.exists(filepath):
+    if filepath:
         # Check if this requires authorization (for locked storage)
-        metadata = load_chunks_metadata()
-        if chunk_id in metadata and metadata[chunk_id].get('in_locked_storage', False):
-            # Require owner verification or agreement verification
-            owner = request.headers.get('X-Owner')
-            agreement_id = request.headers.get('X-Agreement-Id')
-            
-            if not owner and not agreement_id:
-                return jsonify({'error': 'Authorization required for this chunk'}), 403
-            
-            # If using agreement_id, verify with blockchain
-            if agreement_id and contract:
-                try:
-                    # Verify access is allowed - this would be a call to the contract
-                    # to check if the requester is the owner of the agreement
-                    pass  # Additional blockchain verification would go here
-                except:
-                    return jsonify({'error': 'Blockchain verification failed'}), 403
-            
-            # If using owner, check against metadata
-            if owner and metadata[chunk_id].get('owner') != owner:
-                return jsonify({'error': 'Owner mismatch'}), 403
+        denied = check_read_access(chunk_id, load_chunks_metadata(), grant)
+        if denied:
+            return denied
         
-        return open(filepath, 'rb').read()
+        with scrubber.foreground(), CHUNK_READ.time():
+            f = tiers.open(chunk_id) or open_chunk(filepath)
+            with f:
+                data = f.read()
+        tiers.record_access(chunk_id)
+        chunk_bytes.labels('out').inc(len(data))
+        return data
     else:
         return jsonify({'error': 'Chunk not found'}), 404
 
+@app.route('/challenge/<chunk_id>', methods=['GET'])
+def challenge_chunk(chunk_id):
+    """Return the requested 4KB segments of a chunk with Merkle proofs to its segment root"""
+    filepath = locate_chunk(chunk_id)
+    if not filepath:
+        return jsonify({'error': 'Chunk not found'}), 404
+    
+    denied = check_read_access(chunk_id, load_chunks_metadata())
+    if denied:
+        return denied
+    
+    try:
+        indexes = [int(i) for i in request.args.get('segments', '0').split(',') if i != '']
+    except ValueError:
+        return jsonify({'error': 'segments must be a comma separated list of indexes'}), 400
+    if len(indexes) > MAX_CHALLENGE_SEGMENTS:
+        return jsonify({'error': f'At most {MAX_CHALLENGE_SEGMENTS} segments per challenge'}), 400
+    
+    levels = tree_levels(load_segment_hashes(chunk_id, filepath))
+    segment_count = len(levels[0])
+    if any(i < 0 or i >= segment_count for i in indexes):
+        return jsonify({'error': f'Segment index out of range, chunk has {segment_count} segments'}), 400
+    
+    # Only the challenged segments are read from disk
+    segments = []
+    with scrubber.foreground(), CHUNK_READ.time():
+        with tiers.open(chunk_id) or open_chunk(filepath) as f:
+            for index in indexes:
+                f.seek(index * SEGMENT_SIZE)
+                data = f.read(SEGMENT_SIZE)
+                segments.append({
+                    'index': index,
+                    'data': base64.b64encode(data).decode('ascii'),
+                    'proof': merkle_proof(levels, index)
+                })
+                chunk_bytes.labels('out').inc(len(data))
+    
+    return jsonify({
+        'chunk_id': chunk_id,
+        'segment_size': SEGMENT_SIZE,
+        'segment_count': segment_count,
+        'segment_root': levels[-1][0].hex(),
+        'segments': segments
+    }), 200
+
 @app.route('/list_chunks', methods=['GET'])
 def list_chunks():
     metadata = load_chunks_metadata()
@@ -291,20 +605,26 @@ def status():
         'total_used_mb': round(used_mb + locked_mb, 2),
         'limit_mb': STORAGE_LIMIT_MB,
         'available_mb': round(STORAGE_LIMIT_MB - used_mb - locked_mb, 2),
+        'reservations': len(reservations.all()),
+        'tiers': tiers.status(),
+        'tier_moves': tiers.moves(),
         'price_per_mb': PRICE_PER_MB,
-        'wallet_address': WALLET_ADDRESS
+        'wallet_address': WALLET_ADDRESS,
+        'scrubber': scrubber.status(),
+        'chain': chain.status(),
+        'admission': admission.status()
     })
 
 @app.route('/delete/<chunk_id>', methods=['DELETE'])
 def delete_chunk(chunk_id):
-    # Check main storage path
-    filepath = os.path.join(STORAGE_PATH, chunk_id)
+    # Check both tiers, then locked storage
+    filepath = locate_chunk(chunk_id)
     
-    # If not in main storage, check locked storage
-    if not os.path.exists(filepath):
-        filepath = os.path.join(LOCKED_STORAGE_PATH, chunk_id)
+    # Quarantined chunks can still be deleted by their owner
+    if not filepath and os.path.exists(os.path.join(QUARANTINE_PATH, chunk_id)):
+        filepath = os.path.join(QUARANTINE_PATH, chunk_id)
     
-    if os.path.exists(filepath):
+    if filepath:
         # Check authorization
         metadata = load_chunks_metadata()
         if chunk_id in metadata:
@@ -331,7 +651,17 @@ def delete_chunk(chunk_id):
                     return jsonify({'error': 'Unauthorized'}), 403
             
             # Delete the file
-            os.remove(filepath)
+            if tiers.locate(chunk_id)[1]:
+                size = tiers.delete(chunk_id)
+            else:
+                size = os.path.getsize(filepath)
+                os.remove(filepath)
+            chunk_agreement = metadata[chunk_id].get('agreement_id')
+            if chunk_agreement:
+                reservations.free(chunk_agreement, size)
+            sidecar = os.path.join(SEGMENTS_PATH, chunk_id)
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
             
             # Update metadata
             del metadata[chunk_id]
@@ -357,12 +687,13 @@ def update_used_space():
     # Get the host IP from environment variable or use localhost
 
     
-    res = requests.post(f'{COORDINATOR_URL}/register', json={
+    res = requests.post(f'{COORDINATOR_URL}/register', headers=inject_headers(), json={
         'node_id': NODE_ID,
         'url': f'http://{host_ip}:{port}',
         'limit_mb': STORAGE_LIMIT_MB,
         'used_mb': used,
         'locked_mb': locked,
+        'tiers': tiers.status(),
         'price_per_mb': PRICE_PER_MB,
         'wallet_address': WALLET_ADDRESS
     })
@@ -388,6 +719,23 @@ def register_with_coordinator():
     except Exception as e:
         print('Coordinator registration failed:', e)
 
+def start_heartbeat():
+    """Register, then re-register periodically so the coordinator knows this node is alive.
+
+    Runs in the background so a slow coordinator does not hold up serving chunks.
+    """
+    def run():
+        register_with_coordinator()
+        while HEARTBEAT_INTERVAL > 0:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                update_used_space()
+                report_corruption()
+            except Exception as e:
+                print('Coordinator heartbeat failed:', e)
+
+    threading.Thread(target=run, daemon=True).start()
+
 # Register a shutdown hook to deregister when the container stops
 def shutdown_handler(signum=None, frame=None):
     """Handle graceful shutdown and deregister from coordinator"""
@@ -401,5 +749,10 @@ signal.signal(signal.SIGTERM, shutdown_handler)
 signal.signal(signal.SIGINT, shutdown_handler)
 
 if __name__ == '__main__':
-    register_with_coordinator()
+    start_heartbeat()
+    chain.start_monitor(CHAIN_CHECK_INTERVAL)
+    scrubber.start()
+    tiers.start(TIER_MOVE_INTERVAL)
+    startup.mark('background')
+    startup.report()
     app.run(host='0.0.0.0', port=6000)
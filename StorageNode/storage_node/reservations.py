@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import threading
+import time
+
+MB = 1024 * 1024
+SPACE_FILE = re.compile(r'^(?P<node>.+)_(?P<size>\d+)MB\.space$')
+
+
+class ReservationLedger:
+    """Reserved and consumed bytes per storage agreement.
+
+    A reservation sets aside capacity for one agreement; chunks stored under
+    that agreement consume it and deleting them gives it back, so quota
+    checks and the node's locked total are O(1). Agreements that store
+    chunks without a reservation are tracked with nothing reserved. The
+    space an agreement holds is max(reserved, consumed), so rented chunks
+    are never counted twice. With `preallocate`, each reservation's unused
+    part is backed by a file allocated with fallocate, shrunk as chunks
+    consume it.
+    """
+
+    def __init__(self, path, preallocate_dir=None, preallocate=False):
+        self.path = path
+        self.preallocate_dir = preallocate_dir
+        self.preallocate = preallocate and hasattr(os, 'posix_fallocate')
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._held = 0
+        if preallocate_dir:
+            os.makedirs(preallocate_dir, exist_ok=True)
+        try:
+            with open(path, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self._held = sum(self._holds(entry) for entry in self._entries.values())
+
+    @staticmethod
+    def _holds(entry):
+        return max(entry['reserved'], entry['consumed'])
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.path)
+
+    def _update(self, agreement_id, reserved=None, consumed_delta=0):
+        entry = self._entries.get(agreement_id) or {
+            'agreement_id': agreement_id, 'reserved': 0, 'consumed': 0, 'chunks': 0, 'created_at': time.time()}
+        before = self._holds(entry) if agreement_id in self._entries else 0
+        if reserved is not None:
+            entry['reserved'] = reserved
+        entry['consumed'] = max(0, entry['consumed'] + consumed_delta)
+        if consumed_delta:
+            entry['chunks'] = max(0, entry['chunks'] + (1 if consumed_delta > 0 else -1))
+        self._held += self._holds(entry) - before
+        if entry['reserved'] or entry['consumed']:
+            self._entries[agreement_id] = entry
+        else:
+            self._entries.pop(agreement_id, None)
+        self._save()
+        self._resize_backing(agreement_id, entry)
+        return entry
+
+    # Preallocated backing files
+
+    def _backing_path(self, agreement_id):
+        return os.path.join(self.preallocate_dir, f'{agreement_id}.reserve')
+
+    def _resize_backing(self, agreement_id, entry):
+        if not self.preallocate or not self.preallocate_dir:
+            return
+        path = self._backing_path(agreement_id)
+        remaining = max(0, entry['reserved'] - entry['consumed'])
+        if remaining == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            if remaining > size:
+                os.posix_fallocate(fd, size, remaining - size)
+            elif remaining < size:
+                os.ftruncate(fd, remaining)
+        finally:
+            os.close(fd)
+
+    # Reservations
+
+    def reserve(self, agreement_id, size_bytes):
+        """Reserve capacity for an agreement, growing an existing reservation if needed"""
+        with self._lock:
+            entry = self._entries.get(agreement_id)
+            if entry and entry['reserved'] >= size_bytes:
+                return dict(entry)
+            return dict(self._update(agreement_id, reserved=size_bytes))
+
+    def release(self, agreement_id):
+        """Drop a reservation; chunks already stored stay counted until deleted"""
+        with self._lock:
+            if agreement_id not in self._entries:
+                return None
+            return dict(self._update(agreement_id, reserved=0))
+
+    def consume(self, agreement_id, size_bytes):
+        """Charge a stored chunk to an agreement, False if it would exceed the reservation"""
+        with self._lock:
+            entry = self._entries.get(agreement_id)
+            if entry and entry['reserved'] and entry['consumed'] + size_bytes > entry['reserved']:
+                return False
+            self._update(agreement_id, consumed_delta=size_bytes)
+            return True
+
+    def free(self, agreement_id, size_bytes):
+        with self._lock:
+            if agreement_id in self._entries:
+                self._update(agreement_id, consumed_delta=-size_bytes)
+
+    def has_reservation(self, agreement_id):
+        entry = self._entries.get(agreement_id)
+        return bool(entry and entry['reserved'])
+
+    def get(self, agreement_id):
+        entry = self._entries.get(agreement_id)
+        return dict(entry) if entry else None
+
+    def all(self):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def held_bytes(self):
+        """Space held by all agreements, reserved or already consumed"""
+        return self._held
+
+    def migrate_space_files(self, locked_dir, chunk_metadata):
+        """Turn the sparse `<node>_<size>MB.space` placeholders into reservations.
+
+        Each placeholder becomes a reservation for agreement `<node>-<size>`,
+        the id the client gives agreements, and the chunks already stored
+        under each agreement are charged to it. Returns the number of
+        placeholders migrated.
+        """
+        with self._lock:
+            if self._entries:
+                return 0
+        migrated = 0
+        for name in os.listdir(locked_dir):
+            match = SPACE_FILE.match(name)
+            if not match:
+                continue
+            self.reserve(f"{match['node']}-{match['size']}", int(match['size']) * MB)
+            os.remove(os.path.join(locked_dir, name))
+            migrated += 1
+        for chunk_id, entry in chunk_metadata.items():
+            filepath = os.path.join(locked_dir, chunk_id)
+            if entry.get('agreement_id') and os.path.exists(filepath):
+                with self._lock:
+                    self._update(entry['agreement_id'], consumed_delta=os.path.getsize(filepath))
+        return migrated
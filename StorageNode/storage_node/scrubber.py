@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from merkle import SEGMENT_SIZE
+from tiering import COMPRESSED_SUFFIX, chunk_name, open_chunk
+
+
+class Scrubber:
+    """Background re-hashing of stored chunks to find silent disk corruption.
+
+    Chunks are walked in chunk_id order across the storage directories and
+    re-hashed in blocks, sleeping between blocks so disk reads stay under
+    `bytes_per_sec`. While foreground reads are in flight the scrubber
+    waits. A chunk whose SHA-256 no longer matches its id is moved to the
+    quarantine directory and handed to `on_corrupt`; when its segment
+    hashes are known, the damaged 4KB segments are reported too. The
+    position of the walk survives restarts through `state_file`.
+    """
+
+    def __init__(self, storage_dirs, quarantine_dir, state_file, segments_dir=None,
+                 bytes_per_sec=8 * 1024 * 1024, pass_interval=3600, block_size=256 * 1024,
+                 min_age=60, on_corrupt=None):
+        self.storage_dirs = storage_dirs
+        self.quarantine_dir = quarantine_dir
+        self.state_file = state_file
+        self.segments_dir = segments_dir
+        self.bytes_per_sec = bytes_per_sec
+        self.pass_interval = pass_interval
+        # Multiple of the segment size so segment hashes can be taken per block
+        self.block_size = max(SEGMENT_SIZE, block_size - block_size % SEGMENT_SIZE)
+        self.min_age = min_age
+        self.on_corrupt = on_corrupt
+        self._lock = threading.Lock()
+        self._foreground = 0
+        self._stats = {'chunks_scanned': 0, 'bytes_scanned': 0, 'corrupt': 0, 'throttled_seconds': 0.0}
+        self._state = {'cursor': '', 'passes': 0, 'last_pass_at': None}
+        os.makedirs(quarantine_dir, exist_ok=True)
+        try:
+            with open(state_file, 'r') as f:
+                self._state.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    @contextmanager
+    def foreground(self):
+        """Mark a foreground read in flight for the duration of the block"""
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+
+    def _save_state(self):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp, self.state_file)
+
+    def _wait_for_idle(self):
+        waited = 0.0
+        while self._foreground:
+            time.sleep(0.05)
+            waited += 0.05
+        return waited
+
+    def _locate(self, chunk_id):
+        for directory in self.storage_dirs:
+            for name in (chunk_id, chunk_id + COMPRESSED_SUFFIX):
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    return path
+        return None
+
+    def _chunk_ids(self):
+        ids = set()
+        for directory in self.storage_dirs:
+            ids.update(chunk_name(name) for name in os.listdir(directory) if not name.startswith('.'))
+        return sorted(ids)
+
+    def _expected_segments(self, chunk_id):
+        if not self.segments_dir:
+            return None
+        try:
+            with open(os.path.join(self.segments_dir, chunk_id), 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return None
+        return [raw[i:i + 32] for i in range(0, len(raw), 32)]
+
+    def check_chunk(self, chunk_id, path):
+        """Re-hash one chunk at the configured rate, return the damaged segments or None if intact"""
+        digest = hashlib.sha256()
+        segments = []
+        start = time.monotonic()
+        read = 0
+        throttled = 0.0
+        with open_chunk(path) as f:
+            while True:
+                throttled += self._wait_for_idle()
+                block = f.read(self.block_size)
+                if not block:
+                    break
+                digest.update(block)
+                view = memoryview(block)
+                segments.extend(hashlib.sha256(view[i:i + SEGMENT_SIZE]).digest()
+                                for i in range(0, len(block), SEGMENT_SIZE))
+                read += len(block)
+                # Sleep off any lead over the bandwidth budget
+                ahead = read / self.bytes_per_sec - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+                    throttled += ahead
+        with self._lock:
+            self._stats['chunks_scanned'] += 1
+            self._stats['bytes_scanned'] += read
+            self._stats['throttled_seconds'] += throttled
+        if digest.hexdigest() == chunk_id:
+            return None
+        expected = self._expected_segments(chunk_id)
+        if expected is None:
+            return []
+        if not segments:
+            segments = [hashlib.sha256(b'').digest()]
+        return [i for i in range(max(len(expected), len(segments)))
+                if i >= len(expected) or i >= len(segments) or expected[i] != segments[i]]
+
+    def quarantine(self, chunk_id, path):
+        target = os.path.join(self.quarantine_dir, os.path.basename(path))
+        os.replace(path, target)
+        return target
+
+    def scrub_pass(self):
+        """Walk every chunk after the saved cursor, return the number of corrupt chunks found"""
+        corrupt = 0
+        for chunk_id in self._chunk_ids():
+            if chunk_id <= self._state['cursor']:
+                continue
+            path = self._locate(chunk_id)
+            try:
+                # Skip chunks that were deleted, moved or are still being written
+                if not path or time.time() - os.path.getmtime(path) < self.min_age:
+                    continue
+                bad_segments = self.check_chunk(chunk_id, path)
+            except zlib.error:
+                # A compressed chunk that no longer inflates
+                bad_segments = []
+            except OSError as e:
+                print(f"Scrubber could not read chunk {chunk_id}: {e}")
+                bad_segments = None
+            if bad_segments is not None:
+                try:
+                    self.quarantine(chunk_id, path)
+                except OSError as e:
+                    # Deleted or moved to another tier since it was read; the next pass checks it again
+                    print(f"Scrubber could not quarantine chunk {chunk_id}: {e}")
+                    bad_segments = None
+            if bad_segments is not None:
+                corrupt += 1
+                with self._lock:
+                    self._stats['corrupt'] += 1
+                print(f"Chunk {chunk_id} failed its scrub, quarantined")
+                if self.on_corrupt:
+                    try:
+                        self.on_corrupt(chunk_id, bad_segments)
+                    except Exception as e:
+                        print(f"Corruption handler failed for {chunk_id}: {e}")
+            self._state['cursor'] = chunk_id
+            self._save_state()
+        self._state.update({'cursor': '', 'passes': self._state['passes'] + 1, 'last_pass_at': time.time()})
+        self._save_state()
+        return corrupt
+
+    def start(self):
+        if self.bytes_per_sec <= 0:
+            return
+
+        def run():
+            while True:
+                # Resume an interrupted pass at once, otherwise wait out the interval
+                last = self._state['last_pass_at']
+                if not self._state['cursor'] and last:
+                    time.sleep(max(0.0, last + self.pass_interval - time.time()))
+                try:
+                    found = self.scrub_pass()
+                    print(f"Scrub pass {self._state['passes']} done, {found} corrupt chunks")
+                except Exception as e:
+                    print(f"Scrub pass failed: {e}")
+                    time.sleep(60)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            status = dict(self._stats)
+        status.update(self._state)
+        status['bytes_per_sec'] = self.bytes_per_sec
+        return status
@@ -0,0 +1,336 @@
+import io
+import json
+import errno
+import os
+import threading
+import time
+import zlib
+
+FAST = 'fast'
+CAPACITY = 'capacity'
+COMPRESSED_SUFFIX = '.z'
+
+
+def chunk_name(filename):
+    """Chunk id of a file in a tier directory"""
+    return filename[:-len(COMPRESSED_SUFFIX)] if filename.endswith(COMPRESSED_SUFFIX) else filename
+
+
+def open_chunk(path):
+    """Readable, seekable file object with a chunk's stored bytes, whatever its encoding on disk"""
+    if path.endswith(COMPRESSED_SUFFIX):
+        with open(path, 'rb') as f:
+            return io.BytesIO(zlib.decompress(f.read()))
+    return open(path, 'rb')
+
+
+class TieredStore:
+    """Chunk files spread over a fast tier and an optional capacity tier.
+
+    New chunks go to the fast tier while it has room. Reads are counted per
+    chunk with an exponentially decaying score (`half_life` seconds), and a
+    mover thread promotes chunks whose score reaches `promote_score` and
+    demotes the coldest ones when the fast tier passes its high watermark,
+    moving at most `move_bytes` per cycle. Neither tier grows past its
+    limit: demotion stops when the capacity tier is full, and a write that
+    fits in no tier fails with ENOSPC. Chunks in the capacity tier can
+    be stored zlib-compressed. Byte and chunk counts per tier are kept as
+    running totals so space checks need no directory scans. Without a
+    capacity directory there is a single tier and nothing moves.
+    """
+
+    def __init__(self, fast_dir, capacity_dir=None, fast_limit=None, capacity_limit=None,
+                 compress_capacity=False, half_life=3600.0, promote_score=3.0,
+                 high_watermark=0.9, low_watermark=0.8, move_bytes=256 * 1024 * 1024, state_file=None):
+        self.dirs = {FAST: fast_dir}
+        if capacity_dir:
+            self.dirs[CAPACITY] = capacity_dir
+        self.limits = {FAST: fast_limit, CAPACITY: capacity_limit}
+        self.compress_capacity = compress_capacity
+        self.half_life = half_life
+        self.promote_score = promote_score
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.move_bytes = move_bytes
+        self.state_file = state_file
+        self._lock = threading.RLock()
+        self._usage = {}
+        # chunk_id -> [score, time of last update]
+        self._access = {}
+        self._moves = {'promoted': 0, 'demoted': 0, 'bytes_moved': 0}
+        for directory in self.dirs.values():
+            os.makedirs(directory, exist_ok=True)
+        if state_file:
+            try:
+                with open(state_file, 'r') as f:
+                    self._access = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self.rescan()
+
+    @property
+    def tiered(self):
+        return CAPACITY in self.dirs
+
+    def rescan(self):
+        """Recount the bytes and chunks in each tier from disk"""
+        usage = {}
+        for tier, directory in self.dirs.items():
+            total, count = 0, 0
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if not name.startswith('.') and os.path.isfile(path):
+                    total += os.path.getsize(path)
+                    count += 1
+            usage[tier] = {'bytes': total, 'chunks': count}
+        with self._lock:
+            self._usage = usage
+
+    def _account(self, tier, size, count):
+        self._usage[tier]['bytes'] += size
+        self._usage[tier]['chunks'] += count
+
+    def used_bytes(self):
+        with self._lock:
+            return sum(usage['bytes'] for usage in self._usage.values())
+
+    def locate(self, chunk_id):
+        """(tier, path) of a stored chunk, or (None, None)"""
+        for tier, directory in self.dirs.items():
+            for name in (chunk_id, chunk_id + COMPRESSED_SUFFIX):
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    return tier, path
+        return None, None
+
+    def chunk_ids(self):
+        ids = set()
+        for directory in self.dirs.values():
+            ids.update(chunk_name(name) for name in os.listdir(directory) if not name.startswith('.'))
+        return ids
+
+    def _has_room(self, tier, size):
+        limit = self.limits.get(tier)
+        return not limit or self._usage[tier]['bytes'] + size <= limit
+
+    def _fits(self, chunk_id, tier):
+        """Whether a stored chunk would fit in `tier`; one that vanished is left to _move"""
+        _, path = self.locate(chunk_id)
+        try:
+            return not path or self._has_room(tier, os.path.getsize(path))
+        except OSError:
+            return True
+
+    def _write(self, tier, chunk_id, data):
+        name = chunk_id
+        if tier == CAPACITY and self.compress_capacity:
+            data = zlib.compress(data, 6)
+            name += COMPRESSED_SUFFIX
+        path = os.path.join(self.dirs[tier], name)
+        tmp = os.path.join(self.dirs[tier], f'.{name}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._account(tier, len(data), 1)
+        return path
+
+    def put(self, chunk_id, data, tier=None):
+        """Store a chunk, in the requested tier when it has room and else wherever there is room"""
+        with self._lock:
+            # The old copy goes only once the new one is written, a failed rewrite keeps it
+            old_tier, old_path = self.locate(chunk_id)
+            old_size = os.path.getsize(old_path) if old_path else 0
+            tiers = [tier] if tier in self.dirs else []
+            tiers += [t for t in (FAST, CAPACITY) if t in self.dirs and t not in tiers]
+            room = [t for t in tiers if self._has_room(t, len(data) - (old_size if t == old_tier else 0))]
+            if not room and self.tiered:
+                raise OSError(errno.ENOSPC, 'No storage tier has room for the chunk')
+            target = room[0] if room else FAST
+            path = self._write(target, chunk_id, data)
+            if old_path:
+                if old_path != path:
+                    os.remove(old_path)
+                self._account(old_tier, -old_size, -1)
+            return path
+
+    def _remove(self, chunk_id):
+        tier, path = self.locate(chunk_id)
+        if not path:
+            return 0
+        size = os.path.getsize(path)
+        os.remove(path)
+        self._account(tier, -size, -1)
+        return size
+
+    def delete(self, chunk_id):
+        """Remove a chunk, return the bytes freed"""
+        with self._lock:
+            self._access.pop(chunk_id, None)
+            return self._remove(chunk_id)
+
+    def detach(self, chunk_id):
+        """Forget a chunk whose file was moved away by someone else (e.g. quarantine)"""
+        with self._lock:
+            self._access.pop(chunk_id, None)
+        self.rescan()
+
+    def open(self, chunk_id):
+        """File object of a chunk's stored bytes, retried once if the mover relocated it"""
+        for _ in range(2):
+            _, path = self.locate(chunk_id)
+            if not path:
+                return None
+            try:
+                return open_chunk(path)
+            except FileNotFoundError:
+                continue
+        return None
+
+    # Access tracking
+
+    def _score(self, chunk_id, now):
+        entry = self._access.get(chunk_id)
+        if not entry:
+            return 0.0
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def record_access(self, chunk_id):
+        now = time.time()
+        with self._lock:
+            self._access[chunk_id] = [self._score(chunk_id, now) + 1.0, now]
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        now = time.time()
+        with self._lock:
+            # Scores that decayed to nothing are not worth keeping
+            self._access = {chunk_id: entry for chunk_id, entry in self._access.items()
+                            if self._score(chunk_id, now) >= 0.01}
+            snapshot = json.dumps(self._access)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(snapshot)
+        os.replace(tmp, self.state_file)
+
+    # Mover
+
+    def _move(self, chunk_id, target):
+        with self._lock:
+            tier, path = self.locate(chunk_id)
+            if not path or tier == target:
+                return 0
+            try:
+                if not self._has_room(target, os.path.getsize(path)):
+                    return 0
+                with open_chunk(path) as f:
+                    data = f.read()
+                self._write(target, chunk_id, data)
+            except OSError as e:
+                # Gone since it was listed, or no room on the target; nothing moved
+                print(f"Could not move chunk {chunk_id} to {target}: {e}")
+                return 0
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._account(tier, -size, -1)
+            self._moves['promoted' if target == FAST else 'demoted'] += 1
+            self._moves['bytes_moved'] += len(data)
+            return len(data)
+
+    def _fast_chunks_by_heat(self, now):
+        chunks = []
+        directory = self.dirs[FAST]
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            # Never-read chunks rank by age, oldest first
+            chunks.append((self._score(name, now), os.path.getmtime(path), name))
+        chunks.sort()
+        return chunks
+
+    def rebalance(self):
+        """One mover cycle, return the number of chunks moved"""
+        if not self.tiered:
+            return 0
+        now = time.time()
+        budget = self.move_bytes
+        moved = 0
+        coldest = self._fast_chunks_by_heat(now)
+        fast_limit = self.limits[FAST]
+
+        # Demote the coldest chunks once the fast tier passes its high watermark
+        if fast_limit and self._usage[FAST]['bytes'] > fast_limit * self.high_watermark:
+            while coldest and budget > 0 and self._usage[FAST]['bytes'] > fast_limit * self.low_watermark:
+                _, _, chunk_id = coldest.pop(0)
+                if not self._fits(chunk_id, CAPACITY):
+                    break  # the capacity tier is full too
+                moved_bytes = self._move(chunk_id, CAPACITY)
+                budget -= moved_bytes
+                moved += bool(moved_bytes)
+
+        # Promote hot capacity chunks, displacing colder fast chunks when there is no room
+        with self._lock:
+            hot = sorted(((self._score(chunk_id, now), chunk_id) for chunk_id in self._access), reverse=True)
+        for score, chunk_id in hot:
+            if score < self.promote_score or budget <= 0:
+                break
+            tier, path = self.locate(chunk_id)
+            if tier != CAPACITY:
+                continue
+            size = os.path.getsize(path)
+            while not self._has_room(FAST, size) and coldest and coldest[0][0] < score and budget > 0:
+                if not self._fits(coldest[0][2], CAPACITY):
+                    break
+                _, _, victim = coldest.pop(0)
+                moved_bytes = self._move(victim, CAPACITY)
+                budget -= moved_bytes
+                moved += bool(moved_bytes)
+            if not self._has_room(FAST, size):
+                break
+            moved_bytes = self._move(chunk_id, FAST)
+            budget -= moved_bytes
+            moved += bool(moved_bytes)
+        return moved
+
+    def start(self, interval):
+        if interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    moved = self.rebalance()
+                    if moved:
+                        print(f"Tier mover relocated {moved} chunks")
+                    self.save_state()
+                except Exception as e:
+                    print(f"Tier mover failed: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            tiers = {}
+            for tier in self.dirs:
+                limit = self.limits.get(tier)
+                used = self._usage[tier]['bytes']
+                tiers[tier] = {
+                    'path': self.dirs[tier],
+                    'chunks': self._usage[tier]['chunks'],
+                    'used_mb': round(used / (1024 * 1024), 2),
+                    'limit_mb': round(limit / (1024 * 1024), 2) if limit is not None else None,
+                    'free_mb': round((limit - used) / (1024 * 1024), 2) if limit is not None else None,
+                    'compressed': tier == CAPACITY and self.compress_capacity
+                }
+            return tiers
+
+    def moves(self):
+        with self._lock:
+            return dict(self._moves)
@@ -0,0 +1,65 @@
+"""Signed, short-lived grants for chunk transfers that bypass the client API.
+
+The client API decides who may store or read which chunk and signs a
+token naming the operation, the chunk, the node, the owner and an expiry.
+Storage nodes hold the same TRANSFER_TOKEN_SECRET and check tokens with a
+single HMAC, so browsers and SDK clients can send chunk bytes straight to
+the nodes while the client API only handles metadata and keys. After a
+direct store the node answers with a receipt, signed the same way, which
+the client API checks before it records the file.
+"""
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+STORE = 'store'
+RETRIEVE = 'retrieve'
+STORED = 'stored'  # receipt of a direct store, issued by the node
+
+
+class TokenError(Exception):
+    """A token that is malformed, forged, expired or for another transfer"""
+
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _mac(secret, body):
+    return hmac.new(secret.encode('utf-8'), body.encode('ascii'), hashlib.sha256).digest()
+
+
+def sign(secret, op, chunk_id, node_id, ttl=None, **claims):
+    """Token for one operation on one chunk at one node, valid for `ttl` seconds if given"""
+    claims.update({'op': op, 'chunk_id': chunk_id, 'node_id': node_id})
+    if ttl is not None:
+        claims['exp'] = int(time.time() + ttl)
+    body = _encode(json.dumps(claims, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+    return f'{body}.{_encode(_mac(secret, body))}'
+
+
+def verify(secret, token, op, chunk_id=None, node_id=None):
+    """Claims of a token valid for this transfer, TokenError otherwise"""
+    try:
+        body, mac = token.split('.')
+        valid = hmac.compare_digest(_decode(mac), _mac(secret, body))
+        claims = json.loads(_decode(body)) if valid else None
+    except (ValueError, AttributeError, UnicodeError):
+        raise TokenError('Malformed transfer token')
+    if not valid:
+        raise TokenError('Invalid transfer token signature')
+    if claims.get('op') != op:
+        raise TokenError(f'Transfer token is not valid for {op}')
+    if chunk_id is not None and claims.get('chunk_id') != chunk_id:
+        raise TokenError('Transfer token is for another chunk')
+    if node_id is not None and claims.get('node_id') != node_id:
+        raise TokenError('Transfer token is for another node')
+    if 'exp' in claims and time.time() > claims['exp']:
+        raise TokenError('Transfer token expired')
+    return claims
@@ -0,0 +1,155 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TransactionManager:
+    """Submits contract transactions and tracks their receipts off the request thread.
+
+    A job is an ordered list of steps. Each step is a dict with:
+      - 'name': label reported in the job status
+      - 'call': callable returning the contract function to transact
+      - 'tx': transaction parameters ('from', 'value', ...)
+      - 'gas': optional gas limit; a step with an explicit limit does not
+        need gas estimation and is pipelined behind the previous step
+        instead of waiting for its receipt
+
+    Nonces are assigned locally per sender so that pipelined transactions of
+    one job, and concurrent jobs from the same wallet, never collide.
+    """
+
+    def __init__(self, web3, max_workers=4, receipt_timeout=120, max_jobs=1000):
+        # A Web3 instance, or a callable returning one so the connection can be made on first use
+        self._web3 = web3
+        self.receipt_timeout = receipt_timeout
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._events = {}
+        self._nonces = {}
+        self._nonce_lock = threading.Lock()
+
+    @property
+    def web3(self):
+        return self._web3() if callable(self._web3) else self._web3
+
+    def _next_nonce(self, address):
+        with self._nonce_lock:
+            if address not in self._nonces:
+                self._nonces[address] = self.web3.eth.get_transaction_count(address, 'pending')
+            nonce = self._nonces[address]
+            self._nonces[address] += 1
+            return nonce
+
+    def _reset_nonce(self, address):
+        with self._nonce_lock:
+            self._nonces.pop(address, None)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job['updated_at'] = time.time()
+
+    def submit(self, steps, description='', on_success=None):
+        """Queue a job and return its ID immediately"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'description': description,
+                'status': 'queued',
+                'created_at': time.time(),
+                'updated_at': time.time(),
+                'steps': [{'name': step['name'], 'status': 'queued', 'tx_hash': None} for step in steps],
+                'error': None
+            }
+            self._events[job_id] = threading.Event()
+            self._trim()
+        self._executor.submit(self._run, job_id, steps, on_success)
+        return job_id
+
+    def _trim(self):
+        # Forget the oldest finished jobs once over the retention limit
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id]['status'] in ('confirmed', 'failed'):
+                del self._jobs[job_id]
+                self._events.pop(job_id, None)
+
+    def _set_step(self, job_id, index, **fields):
+        with self._lock:
+            self._jobs[job_id]['steps'][index].update(fields)
+            self._jobs[job_id]['updated_at'] = time.time()
+
+    def _wait_receipt(self, job_id, index, tx_hash):
+        receipt = self.web3.eth.wait_for_transaction_receipt(tx_hash, timeout=self.receipt_timeout)
+        ok = receipt.status == 1
+        self._set_step(job_id, index, status='confirmed' if ok else 'failed', block_number=receipt.blockNumber)
+        return ok
+
+    def _run(self, job_id, steps, on_success):
+        pending = []  # (index, tx_hash) sent but not yet confirmed
+        try:
+            self._update(job_id, status='submitted')
+            for index, step in enumerate(steps):
+                if pending and step.get('gas') is None:
+                    # Gas estimation needs the state left by the previous steps
+                    for pending_index, tx_hash in pending:
+                        if not self._wait_receipt(job_id, pending_index, tx_hash):
+                            raise RuntimeError(f"Transaction '{steps[pending_index]['name']}' failed")
+                    pending = []
+
+                tx = dict(step.get('tx', {}))
+                sender = tx.get('from')
+                if sender:
+                    tx['nonce'] = self._next_nonce(sender)
+                if step.get('gas') is not None:
+                    tx['gas'] = step['gas']
+                try:
+                    tx_hash = step['call']().transact(tx)
+                except Exception:
+                    if sender:
+                        self._reset_nonce(sender)
+                    raise
+                self._set_step(job_id, index, status='submitted', tx_hash=tx_hash.hex())
+                pending.append((index, tx_hash))
+
+            for pending_index, tx_hash in pending:
+                if not self._wait_receipt(job_id, pending_index, tx_hash):
+                    raise RuntimeError(f"Transaction '{steps[pending_index]['name']}' failed")
+
+            self._update(job_id, status='confirmed')
+            if on_success:
+                try:
+                    on_success()
+                except Exception as e:
+                    print(f"Post-confirmation hook for job {job_id} failed: {e}")
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                event = self._events.get(job_id)
+            if event:
+                event.set()
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            job['steps'] = [dict(step) for step in job['steps']]
+            return job
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes and return its status"""
+        with self._lock:
+            event = self._events.get(job_id)
+        if event:
+            event.wait(timeout)
+        return self.job(job_id)
@@ -0,0 +1,250 @@
+"""End-to-end upload/download benchmark.
+
+Starts a coordinator, the client API and N storage nodes as local processes
+(no blockchain: the services run without a contract, which is the regular
+storage path), then drives /upload and /download over a matrix of file
+sizes, chunk sizes, node counts and concurrency levels.
+
+    python benchmarks/bench_e2e.py --output bench_e2e.json
+    python benchmarks/bench_e2e.py --file-sizes 1048576 --nodes 1 3 --baseline old.json
+
+Results are JSON and include the commit they were measured on, so runs of
+different commits with the same matrix can be compared with --baseline.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (  # noqa: E402
+    COORDINATOR_DIR, CLIENT_DIR, STORAGE_NODE_DIR, NO_CHAIN_URL,
+    environment_info, latency_summary, free_port, start_service, wait_until,
+    stop_processes, peak_rss_kb, write_results, compare_results
+)
+sys.path.insert(0, COORDINATOR_DIR)
+from metadata_codec import chunk_sizes  # noqa: E402
+
+
+class Cluster:
+    """Coordinator, client API and storage nodes running as local processes"""
+
+    def __init__(self, workdir, node_count, chunk_size, chunk_cache_mb, logs):
+        self.workdir = workdir
+        self.processes = {}
+        self.coordinator_url = None
+        self.client_url = None
+        self._start(node_count, chunk_size, chunk_cache_mb, logs)
+
+    def _log(self, logs, name):
+        return os.path.join(self.workdir, f'{name}.log') if logs else None
+
+    def _start(self, node_count, chunk_size, chunk_cache_mb, logs):
+        coordinator_port = free_port()
+        self.coordinator_url = f'http://127.0.0.1:{coordinator_port}'
+        coordinator_cwd = os.path.join(self.workdir, 'coordinator')
+        os.makedirs(os.path.join(coordinator_cwd, 'data'), exist_ok=True)
+        self.processes['coordinator'] = start_service(
+            COORDINATOR_DIR, coordinator_cwd, coordinator_port,
+            env={'BLOCKCHAIN_URL': NO_CHAIN_URL},
+            log_path=self._log(logs, 'coordinator')
+        )
+        if not wait_until(lambda: requests.get(f'{self.coordinator_url}/all_nodes').ok):
+            raise RuntimeError('Coordinator did not start')
+
+        for i in range(node_count):
+            node_port = free_port()
+            node_id = f'bench_node_{i}'
+            self.processes[node_id] = start_service(
+                STORAGE_NODE_DIR, os.path.join(self.workdir, node_id), node_port,
+                env={
+                    'NODE_ID': node_id,
+                    'STORAGE_LIMIT_MB': str(1024 * 1024),
+                    'HOST_IP': '127.0.0.1',
+                    'PORT': str(node_port),
+                    'COORDINATOR_URL': self.coordinator_url,
+                    'BLOCKCHAIN_URL': NO_CHAIN_URL
+                },
+                register=True,
+                log_path=self._log(logs, node_id)
+            )
+
+        def all_registered():
+            return len(requests.get(f'{self.coordinator_url}/all_nodes').json()) == node_count
+
+        if not wait_until(all_registered):
+            raise RuntimeError('Storage nodes did not register')
+
+        client_port = free_port()
+        self.client_url = f'http://127.0.0.1:{client_port}'
+        self.processes['client'] = start_service(
+            CLIENT_DIR, os.path.join(self.workdir, 'client'), client_port,
+            env={
+                'COORDINATOR_URL': self.coordinator_url,
+                'BLOCKCHAIN_URL': NO_CHAIN_URL,
+                'CHUNK_SIZE_BYTES': str(chunk_size),
+                'CHUNK_CACHE_MB': str(chunk_cache_mb),
+                'CHUNK_CACHE_DISK_MB': '0'
+            },
+            log_path=self._log(logs, 'client')
+        )
+        if not wait_until(lambda: requests.get(f'{self.client_url}/list_files').ok):
+            raise RuntimeError('Client API did not start')
+
+    def chunk_bytes(self, file_id):
+        """Bytes exchanged between the gateway and the nodes for one transfer of a file"""
+        response = requests.get(f'{self.coordinator_url}/get_file_metadata/{file_id}')
+        if not response.ok:
+            return 0
+        return sum(chunk_sizes(response.json()))
+
+    def peak_rss(self):
+        rss = {name: peak_rss_kb(proc.pid) for name, proc in self.processes.items()}
+        total = sum(v for v in rss.values() if v)
+        return {
+            'total_kb': total,
+            'coordinator_kb': rss.get('coordinator'),
+            'client_kb': rss.get('client'),
+            'max_node_kb': max((v or 0) for k, v in rss.items() if k.startswith('bench_node_'))
+        }
+
+    def stop(self):
+        stop_processes(list(self.processes.values()))
+
+
+def run_transfers(fn, items, concurrency):
+    """Run fn over items with a thread pool, return (results, latencies, wall time)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(item):
+        start = time.perf_counter()
+        result = fn(item)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, items))
+    return results, latencies, time.perf_counter() - start
+
+
+def bench_case(cluster, file_size, concurrency, operations, seed):
+    rng = random.Random(seed)
+    payloads = [rng.randbytes(file_size) for _ in range(min(operations, 4))]
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def upload(i):
+        filename = f'bench_{uuid.uuid4().hex}.bin'
+        response = session.post(
+            f'{cluster.client_url}/upload',
+            files={'file': (filename, payloads[i % len(payloads)])},
+            data={'owner': 'bench'}
+        )
+        response.raise_for_status()
+        return response.json()['file_id'], len(response.request.body or b'') + len(response.content)
+
+    uploads, upload_latencies, upload_wall = run_transfers(upload, range(operations), concurrency)
+    file_ids = [file_id for file_id, _ in uploads]
+
+    def download(file_id):
+        response = session.get(f'{cluster.client_url}/download/{file_id}', headers={'X-Owner': 'bench'})
+        response.raise_for_status()
+        if len(response.content) != file_size:
+            raise RuntimeError(f'Downloaded {len(response.content)} bytes, expected {file_size}')
+        return len(response.content)
+
+    downloads, download_latencies, download_wall = run_transfers(download, file_ids, concurrency)
+
+    node_bytes = sum(cluster.chunk_bytes(file_id) for file_id in file_ids)
+    for file_id in file_ids:
+        session.delete(f'{cluster.client_url}/delete/{file_id}', headers={'X-Owner': 'bench'})
+
+    payload_bytes = file_size * operations
+    return {
+        'upload': dict(
+            latency_summary(upload_latencies),
+            throughput_mb_s=round(payload_bytes / upload_wall / 2**20, 3),
+            wire_bytes_client=sum(size for _, size in uploads),
+            wire_bytes_nodes=node_bytes
+        ),
+        'download': dict(
+            latency_summary(download_latencies),
+            throughput_mb_s=round(payload_bytes / download_wall / 2**20, 3),
+            wire_bytes_client=sum(downloads),
+            wire_bytes_nodes=node_bytes
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--file-sizes', type=int, nargs='+', default=[64 * 1024, 4 * 2**20, 32 * 2**20])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[256 * 1024, 2**20])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--operations', type=int, default=8, help='uploads (and downloads) per case')
+    parser.add_argument('--chunk-cache-mb', type=int, default=0, help='client chunk cache size, 0 measures the uncached path')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='previous results file to compare against')
+    parser.add_argument('--keep-logs', action='store_true', help='keep service logs in the work directory')
+    args = parser.parse_args()
+
+    results = []
+    for node_count in args.nodes:
+        for chunk_size in args.chunk_sizes:
+            workdir = tempfile.mkdtemp(prefix='dstorage-bench-')
+            cluster = Cluster(workdir, node_count, chunk_size, args.chunk_cache_mb, args.keep_logs)
+            try:
+                for file_size in args.file_sizes:
+                    for concurrency in args.concurrency:
+                        print(f'nodes={node_count} chunk={chunk_size} size={file_size} '
+                              f'concurrency={concurrency}', file=sys.stderr)
+                        case = bench_case(cluster, file_size, concurrency, args.operations, args.seed)
+                        case.update({
+                            'nodes': node_count,
+                            'chunk_size': chunk_size,
+                            'file_size': file_size,
+                            'concurrency': concurrency
+                        })
+                        results.append(case)
+                peak = cluster.peak_rss()
+                for case in results:
+                    if case['nodes'] == node_count and case['chunk_size'] == chunk_size:
+                        case['peak_rss'] = peak
+            finally:
+                cluster.stop()
+                if args.keep_logs:
+                    print(f'Logs kept in {workdir}', file=sys.stderr)
+                else:
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'e2e',
+        'environment': environment_info(),
+        'parameters': {'operations': args.operations, 'chunk_cache_mb': args.chunk_cache_mb, 'seed': args.seed},
+        'results': results
+    }
+    write_results(report, args.output)
+    if args.baseline:
+        compare_results(
+            report, args.baseline,
+            key_fields=['nodes', 'chunk_size', 'file_size', 'concurrency'],
+            metric_fields=['upload.throughput_mb_s', 'upload.p99_ms', 'download.throughput_mb_s', 'download.p99_ms']
+        )
+
+
+if __name__ == '__main__':
+    main()
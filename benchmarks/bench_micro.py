@@ -0,0 +1,292 @@
+"""Offline micro-benchmarks of the per-chunk and per-file hot spots.
+
+Covers chunking, compression, AES encryption/decryption and SHA-256 chunk
+IDs in the client API, coordinator metadata writes and listings at growing
+file counts, the size and parse time of a file's chunk list in each metadata encoding,
+and storage node metadata loading and space accounting at growing chunk
+counts. No network or blockchain is needed; each service module is imported
+in a scratch directory and its functions or routes are called directly.
+
+    python benchmarks/bench_micro.py --output micro.json
+    python benchmarks/bench_micro.py --groups coordinator --file-counts 1000 100000 1000000
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import random
+import shutil
+import signal
+import hashlib
+import argparse
+import tempfile
+import statistics
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (  # noqa: E402
+    COORDINATOR_DIR, CLIENT_DIR, STORAGE_NODE_DIR, NO_CHAIN_URL,
+    environment_info, write_results, compare_results
+)
+
+
+def load_service(service_dir, name, workdir):
+    """Import a service's app.py under a unique module name with workdir as cwd"""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ.setdefault('BLOCKCHAIN_URL', NO_CHAIN_URL)
+    os.environ['COORDINATOR_URL'] = NO_CHAIN_URL
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    sys.path.insert(0, service_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(service_dir, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(service_dir)
+        # The storage node deregisters from the coordinator on exit and on signals
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    if hasattr(module, 'deregister_from_coordinator'):
+        atexit.unregister(module.deregister_from_coordinator)
+    return module
+
+
+def measure(fn, repeat, setup=None):
+    """Run fn `repeat` times and summarise the durations in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(samples), 4),
+        'median_ms': round(statistics.median(samples), 4),
+        'mean_ms': round(statistics.fmean(samples), 4)
+    }
+
+
+def bench_client(workdir, args, rng):
+    client = load_service(CLIENT_DIR, 'bench_client_app', os.path.join(workdir, 'client'))
+    results = []
+
+    path = os.path.join(workdir, 'chunking.bin')
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(args.file_size))
+    for chunk_size in args.chunk_sizes:
+        stats = measure(lambda: client.split_file_into_chunks(path, chunk_size), args.repeat)
+        stats['mb_s'] = round(args.file_size / 2**20 / (stats['median_ms'] / 1000), 2)
+        results.append(dict(stats, name='split_file_into_chunks', file_size=args.file_size, chunk_size=chunk_size))
+
+    key = client.generate_encryption_key()
+    for chunk_size in args.chunk_sizes:
+        chunk = rng.randbytes(chunk_size)
+        encrypted = client.encrypt_data(chunk, key)
+        for name, fn in [
+            ('encrypt_data', lambda: client.encrypt_data(chunk, key)),
+            ('decrypt_data', lambda: client.decrypt_data(encrypted, key)),
+            ('sha256_chunk_id', lambda: hashlib.sha256(encrypted.encode('utf-8')).hexdigest())
+        ]:
+            stats = measure(fn, args.repeat)
+            stats['mb_s'] = round(chunk_size / 2**20 / (stats['median_ms'] / 1000), 2)
+            results.append(dict(stats, name=name, chunk_size=chunk_size))
+
+    # Compression stage on CSV-like text and on random (already compressed) data
+    codec = client.compression.choose_codec('bench.csv', client.COMPRESSION)
+    for chunk_size in args.chunk_sizes:
+        rows = b''.join(f'{i},{rng.randrange(10**6)},node_{i % 7},ok\n'.encode() for i in range(chunk_size // 16))
+        for data_kind, chunk in [('text', rows[:chunk_size]), ('random', rng.randbytes(chunk_size))]:
+            used, payload = client.compression.compress(chunk, codec, client.COMPRESSION_LEVEL)
+            stats = measure(lambda: client.compression.compress(chunk, codec, client.COMPRESSION_LEVEL), args.repeat)
+            stats['mb_s'] = round(chunk_size / 2**20 / (stats['median_ms'] / 1000), 2)
+            results.append(dict(stats, name='compress', codec=used, data=data_kind, chunk_size=chunk_size,
+                                ratio=round(len(payload) / len(chunk), 4)))
+            if used != 'none':
+                stats = measure(lambda: client.compression.decompress(payload, used), args.repeat)
+                stats['mb_s'] = round(chunk_size / 2**20 / (stats['median_ms'] / 1000), 2)
+                results.append(dict(stats, name='decompress', codec=used, data=data_kind, chunk_size=chunk_size))
+    return results
+
+
+def fake_file_record(rng, chunks_per_file):
+    file_id = str(uuid.uuid4())
+    return file_id, {
+        'file_id': file_id,
+        'filename': f'{file_id[:8]}.bin',
+        'size': chunks_per_file * 2**20,
+        'owner': f'0x{rng.randrange(16**40):040x}',
+        'chunks': [{
+            'chunk_id': f'{rng.getrandbits(256):064x}',
+            'node_id': f'node{i % 3}',
+            'node_url': f'http://10.0.0.{i % 3}:6000',
+            'size': 2**20,
+            'index': i,
+            'encryption': 'aes',
+            'agreement_id': None
+        } for i in range(chunks_per_file)],
+        'created_at': time.time(),
+        'encryption': 'aes',
+        'agreement_id': None,
+        'key': 'AAAAAAAAAAAAAAAAAAAAAA=='
+    }
+
+
+def bench_coordinator(workdir, args, rng):
+    coordinator_dir = os.path.join(workdir, 'coordinator')
+    os.makedirs(os.path.join(coordinator_dir, 'data'), exist_ok=True)
+    coordinator = load_service(COORDINATOR_DIR, 'bench_coordinator_app', coordinator_dir)
+    client = coordinator.app.test_client()
+    results = []
+
+    for count in args.file_counts:
+        records = dict(fake_file_record(rng, args.chunks_per_file) for _ in range(count))
+        owner = next(iter(records.values()))['owner']
+        with open(coordinator.METADATA_FILE, 'w') as f:
+            json.dump(records, f)
+        del records
+
+        # Reload the store so it starts from the file just written
+        coordinator.file_metadata = type(coordinator.file_metadata)(coordinator.METADATA_FILE)
+
+        def store():
+            _, record = fake_file_record(rng, args.chunks_per_file)
+            response = client.post('/store_file_metadata', json=record)
+            assert response.status_code == 200, response.data
+
+        results.append(dict(measure(store, args.repeat), name='store_file_metadata', files=count))
+        results.append(dict(
+            measure(lambda: client.get('/list_files', query_string={'owner': owner}), args.repeat),
+            name='list_files_by_owner', files=count
+        ))
+        results.append(dict(
+            measure(lambda: client.get('/list_files'), max(1, args.repeat // 4)),
+            name='list_files_all', files=count
+        ))
+    return results
+
+
+def bench_metadata_codec(workdir, args, rng):
+    sys.path.insert(0, COORDINATOR_DIR)
+    try:
+        import metadata_codec
+    finally:
+        sys.path.remove(COORDINATOR_DIR)
+    results = []
+
+    for count in args.file_chunk_counts:
+        _, legacy = fake_file_record(rng, count)
+        compact = metadata_codec.encode_record(legacy)
+        encodings = [
+            ('legacy_json', json.dumps(legacy).encode('utf-8'), json.loads),
+            ('compact_json', json.dumps(compact).encode('utf-8'), json.loads)
+        ]
+        if metadata_codec.msgpack is not None:
+            encodings.append(('compact_msgpack', metadata_codec.pack(compact), metadata_codec.unpack))
+        for name, body, parse in encodings:
+            # Parse and rebuild the chunk dicts, which is what a download does
+            stats = measure(lambda: metadata_codec.decode_chunks(parse(body)), args.repeat)
+            results.append(dict(stats, name=f'parse_{name}', chunks=count, bytes=len(body)))
+        results.append(dict(measure(lambda: metadata_codec.encode_record(legacy), args.repeat),
+                            name='encode_compact', chunks=count))
+    return results
+
+
+def bench_storage_node(workdir, args, rng):
+    node = load_service(STORAGE_NODE_DIR, 'bench_storage_node_app', os.path.join(workdir, 'node'))
+    results = []
+
+    for count in args.chunk_counts:
+        shutil.rmtree(node.STORAGE_PATH, ignore_errors=True)
+        os.makedirs(node.STORAGE_PATH)
+        metadata = {}
+        for _ in range(count):
+            chunk_id = f'{rng.getrandbits(256):064x}'
+            with open(os.path.join(node.STORAGE_PATH, chunk_id), 'wb') as f:
+                f.write(b'\0' * args.node_chunk_bytes)
+            metadata[chunk_id] = {
+                'chunk_id': chunk_id,
+                'file_id': str(uuid.uuid4()),
+                'owner': 'bench',
+                'size_mb': args.node_chunk_bytes / 2**20,
+                'created_at': time.time(),
+                'encryption': 'aes',
+                'agreement_id': '',
+                'in_locked_storage': False
+            }
+        node.save_chunks_metadata(metadata)
+        del metadata
+        # Chunks were written behind the tier store's back, recount them
+        results.append(dict(measure(node.tiers.rescan, args.repeat), name='tiers_rescan', chunks=count))
+
+        results.append(dict(measure(node.load_chunks_metadata, args.repeat), name='load_chunks_metadata', chunks=count))
+        results.append(dict(measure(node.get_used_space_mb, args.repeat), name='get_used_space_mb', chunks=count))
+        results.append(dict(measure(node.get_locked_space_mb, args.repeat), name='get_locked_space_mb', chunks=count))
+    return results
+
+
+GROUPS = {
+    'client': bench_client,
+    'coordinator': bench_coordinator,
+    'metadata_codec': bench_metadata_codec,
+    'storage_node': bench_storage_node
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--groups', nargs='+', choices=sorted(GROUPS), default=sorted(GROUPS))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--file-size', type=int, default=64 * 2**20, help='file size for the chunking benchmark')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[256 * 1024, 2**20, 4 * 2**20])
+    parser.add_argument('--file-counts', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--chunks-per-file', type=int, default=4)
+    parser.add_argument('--file-chunk-counts', type=int, nargs='+', default=[4, 460, 4096],
+                        help='chunks per file for the metadata encoding benchmark')
+    parser.add_argument('--chunk-counts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--node-chunk-bytes', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='previous results file to compare against')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+
+    # Service modules log with print; stdout is kept for the results
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='dstorage-micro-')
+    results = []
+    try:
+        for group in args.groups:
+            print(f'Running {group} benchmarks', file=sys.stderr)
+            for result in GROUPS[group](workdir, args, random.Random(args.seed)):
+                result['group'] = group
+                results.append(result)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'micro',
+        'environment': environment_info(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'results': results
+    }
+    write_results(report, args.output, stream=stdout)
+    if args.baseline:
+        compare_results(
+            report, args.baseline,
+            key_fields=['group', 'name', 'chunk_size', 'files', 'chunks'],
+            metric_fields=['median_ms']
+        )
+
+
+if __name__ == '__main__':
+    main()
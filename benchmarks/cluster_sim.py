@@ -0,0 +1,625 @@
+"""Large-cluster simulation of the coordinator's registry and placement.
+
+Starts a real coordinator (no blockchain) and a single HTTP server that
+plays every storage node: each virtual node answers the storage node API
+(/status, /store, /retrieve, /delete) under its own URL prefix, with its
+own capacity, price and latency profile. Nodes register through /register,
+re-register after every store and delete and on a heartbeat like real
+nodes, and the workload drives the coordinator the way the client API
+does: /available_nodes, chunks placed in the same order as /upload, then
+/store_file_metadata; deletes go through /get_file_metadata and
+/delete_file_metadata. Random node failures stop a node answering and
+heartbeating until it recovers. Chunk bodies are not sent; nodes account
+the size announced in a header, so thousands of nodes fit on one machine.
+
+    python benchmarks/cluster_sim.py --output sim.json
+    python benchmarks/cluster_sim.py --nodes 5000 --operations 20000 --failure-rate 0.01
+    python benchmarks/cluster_sim.py --nodes 1000 --baseline sim.json
+
+Reports coordinator CPU time and peak RSS, latency of each coordinator
+endpoint, how long failed nodes stayed on offer, and how evenly the
+stored bytes ended up spread over the nodes.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import statistics
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (  # noqa: E402
+    COORDINATOR_DIR, NO_CHAIN_URL, environment_info, latency_summary, free_port,
+    start_service, wait_until, stop_processes, peak_rss_kb, cpu_seconds,
+    write_results, compare_results
+)
+
+MB = 1024 * 1024
+
+# Latency profiles: (share of nodes, median seconds per request)
+PROFILES = {
+    'lan': (0.5, 0.002),
+    'wan': (0.35, 0.03),
+    'slow': (0.15, 0.15)
+}
+CAPACITIES_MB = [512, 2048, 8192, 32768, 131072]
+OWNERS = 50
+
+
+class VirtualNode:
+    """One simulated storage node: capacity, price, latency and the chunks it holds"""
+
+    def __init__(self, node_id, url, limit_mb, price_per_mb, profile, latency, seed):
+        self.node_id = node_id
+        self.url = url
+        self.limit_mb = limit_mb
+        self.price_per_mb = price_per_mb
+        self.profile = profile
+        self.latency = latency
+        self.failed = False
+        self.chunks = {}
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def delay(self):
+        with self.lock:
+            jitter = self._rng.lognormvariate(0, 0.5)
+        time.sleep(self.latency * jitter)
+
+    def store(self, chunk_id, size):
+        with self.lock:
+            self.used_bytes += size - self.chunks.get(chunk_id, 0)
+            self.chunks[chunk_id] = size
+
+    def delete(self, chunk_id):
+        with self.lock:
+            size = self.chunks.pop(chunk_id, None)
+            if size is not None:
+                self.used_bytes -= size
+            return size is not None
+
+    def registration(self):
+        return {
+            'node_id': self.node_id,
+            'url': self.url,
+            'limit_mb': self.limit_mb,
+            'used_mb': self.used_bytes / MB,
+            'locked_mb': 0,
+            'price_per_mb': self.price_per_mb
+        }
+
+    def status(self):
+        used_mb = round(self.used_bytes / MB, 2)
+        return {
+            'node_id': self.node_id,
+            'used_mb': used_mb,
+            'locked_mb': 0,
+            'total_used_mb': used_mb,
+            'limit_mb': self.limit_mb,
+            'available_mb': round(self.limit_mb - used_mb, 2),
+            'price_per_mb': self.price_per_mb
+        }
+
+
+class FakeNodeHandler(BaseHTTPRequestHandler):
+    """Storage node API for every virtual node, under /n/<node_id>/"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, payload=None, body=None, content_type='application/json'):
+        body = json.dumps(payload).encode() if body is None else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        node = self.server.nodes.get(parts[1]) if len(parts) >= 3 and parts[0] == 'n' else None
+        if node is None:
+            return self._reply(404, {'error': 'Not found'})
+        if node.failed:
+            # A crashed node: drop the connection without an answer
+            self.close_connection = True
+            return
+        node.delay()
+
+        action, chunk_id = parts[2], parts[3] if len(parts) > 3 else None
+        if method == 'GET' and action == 'status':
+            return self._reply(200, node.status())
+        if method == 'POST' and action == 'store' and chunk_id:
+            node.store(chunk_id, int(self.headers.get('X-Simulated-Size') or length))
+            self.server.simulation.heartbeat(node)
+            return self._reply(200, {'status': 'stored', 'chunk_id': chunk_id, 'node_id': node.node_id})
+        if method == 'GET' and action == 'retrieve' and chunk_id:
+            size = node.chunks.get(chunk_id)
+            if size is None:
+                return self._reply(404, {'error': 'Chunk not found'})
+            return self._reply(200, body=bytes(size), content_type='application/octet-stream')
+        if method == 'DELETE' and action == 'delete' and chunk_id:
+            if not node.delete(chunk_id):
+                return self._reply(404, {'error': 'Chunk not found'})
+            self.server.simulation.heartbeat(node)
+            return self._reply(200, {'status': 'deleted'})
+        return self._reply(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeNodeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The coordinator probes every node back to back
+    request_queue_size = 1024
+
+
+class Simulation:
+    """A coordinator process plus N virtual nodes served from this process"""
+
+    def __init__(self, workdir, node_count, args):
+        self.workdir = workdir
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.nodes = {}
+        self.files = {}
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.counts = Counter()
+        self.reports = defaultdict(lambda: {'latencies': [], 'errors': []})
+        self.failures = {}  # node_id -> {'failed_at', 'detected_at', 'recover_after'}
+        self.detection = []
+        self.stopping = threading.Event()
+        self._local = threading.local()
+        self._threads = []
+
+        self.server = FakeNodeServer(('127.0.0.1', free_port()), FakeNodeHandler)
+        self.server.nodes = self.nodes
+        self.server.simulation = self
+        self._spawn(self.server.serve_forever)
+        nodes_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+        profiles = list(PROFILES)
+        weights = [PROFILES[name][0] for name in profiles]
+        for i in range(node_count):
+            node_id = f'sim_node_{i}'
+            profile = self.rng.choices(profiles, weights)[0]
+            self.nodes[node_id] = VirtualNode(
+                node_id, f'{nodes_url}/n/{node_id}',
+                limit_mb=self.rng.choice(CAPACITIES_MB),
+                price_per_mb=round(self.rng.uniform(0.5, 3.0), 2),
+                profile=profile,
+                latency=PROFILES[profile][1],
+                seed=self.rng.random()
+            )
+
+        port = free_port()
+        self.coordinator_url = f'http://127.0.0.1:{port}'
+        coordinator_cwd = os.path.join(workdir, 'coordinator')
+        os.makedirs(os.path.join(coordinator_cwd, 'data'), exist_ok=True)
+        self.coordinator = start_service(
+            COORDINATOR_DIR, coordinator_cwd, port,
+            env={
+                'BLOCKCHAIN_URL': NO_CHAIN_URL,
+                'NODE_PROBE_INTERVAL': str(args.probe_interval),
+                'NODE_HEARTBEAT_TIMEOUT': str(3 * args.heartbeat_interval)
+            },
+            log_path=os.path.join(workdir, 'coordinator.log') if args.keep_logs else None
+        )
+        if not wait_until(lambda: requests.get(f'{self.coordinator_url}/all_nodes').ok):
+            raise RuntimeError('Coordinator did not start')
+
+    def _spawn(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    @property
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def call(self, endpoint, method, path, **kwargs):
+        """Request against the coordinator, timed under `endpoint`"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.coordinator_url}{path}', timeout=30, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.errors[f'{endpoint}:connection'] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if response.status_code >= 400:
+                self.errors[f'{endpoint}:{response.status_code}'] += 1
+        return response
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def heartbeat(self, node):
+        try:
+            self.call('register', 'POST', '/register', json=node.registration())
+        except requests.RequestException:
+            pass
+
+    def register_all(self):
+        """Register every node at once, return the wall time"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(self.heartbeat, self.nodes.values()))
+        return time.perf_counter() - start
+
+    def _heartbeats(self):
+        # Spread the re-registrations of all nodes evenly over the interval
+        nodes = list(self.nodes.values())
+        spacing = self.args.heartbeat_interval / len(nodes)
+        while not self.stopping.is_set():
+            for node in nodes:
+                if self.stopping.wait(spacing):
+                    return
+                if not node.failed:
+                    self.heartbeat(node)
+
+    def _control(self):
+        """Flush transfer reports like the client API and watch failed nodes being marked down"""
+        last_report = time.monotonic()
+        while not self.stopping.wait(1.0):
+            if time.monotonic() - last_report >= self.args.report_interval:
+                self.flush_reports()
+                last_report = time.monotonic()
+            self.check_detection()
+
+    def flush_reports(self):
+        with self.lock:
+            reports = [dict(report, node_id=node_id) for node_id, report in self.reports.items()]
+            self.reports.clear()
+        if reports:
+            try:
+                self.call('report_node_stats', 'POST', '/report_node_stats', json={'reports': reports})
+            except requests.RequestException:
+                pass
+
+    def check_detection(self):
+        with self.lock:
+            pending = [node_id for node_id, failure in self.failures.items() if failure['detected_at'] is None]
+        if not pending:
+            return
+        try:
+            states = {node['node_id']: node['state'] for node in self.call('all_nodes', 'GET', '/all_nodes').json()}
+        except (requests.RequestException, ValueError):
+            return
+        now = time.monotonic()
+        with self.lock:
+            for node_id in pending:
+                failure = self.failures.get(node_id)
+                if failure and failure['detected_at'] is None and states.get(node_id, 'down') == 'down':
+                    failure['detected_at'] = now
+                    self.detection.append(now - failure['failed_at'])
+
+    def node_request(self, method, node, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{node.url}{path}', timeout=10, **kwargs)
+            ok, error = response.status_code < 500, f'HTTP {response.status_code}'
+        except requests.RequestException as e:
+            response, ok, error = None, False, str(e)
+        with self.lock:
+            if ok:
+                self.reports[node.node_id]['latencies'].append(time.perf_counter() - start)
+            else:
+                self.reports[node.node_id]['errors'].append(error)
+        return response if ok else None
+
+    def file_size(self):
+        with self.lock:
+            size = self.rng.lognormvariate(math.log(self.args.median_file_mb * MB), 1.0)
+        return max(1, min(int(size), self.args.max_file_mb * MB))
+
+    def upload(self):
+        nodes = self.call('available_nodes', 'GET', '/available_nodes').json()
+        if not nodes:
+            return self.count('upload_no_nodes')
+        file_id = str(uuid.uuid4())
+        with self.lock:
+            owner = f'sim_owner_{self.rng.randrange(OWNERS)}'
+            if self.args.placement == 'random':
+                nodes = self.rng.sample(nodes, len(nodes))
+        size = self.file_size()
+        chunk_size = self.args.chunk_size
+        chunks = []
+        for i in range(max(1, math.ceil(size / chunk_size))):
+            # Same order as the client API's /upload: chunk i on available node i
+            entry = nodes[i % len(nodes)]
+            node = self.nodes[entry['node_id']]
+            length = min(chunk_size, size - i * chunk_size)
+            chunk_id = hashlib.sha256(f'{file_id}:{i}'.encode()).hexdigest()
+            response = self.node_request('POST', node, f'/store/{chunk_id}', headers={
+                'X-Owner': owner, 'X-File-Id': file_id, 'X-Simulated-Size': str(length)
+            })
+            if response is None:
+                # The client API gives up on the file and cleans up what it stored
+                for chunk in chunks:
+                    self.node_request('DELETE', self.nodes[chunk['node_id']], f"/delete/{chunk['chunk_id']}",
+                                      headers={'X-Owner': owner})
+                return self.count('upload_failed')
+            chunks.append({'chunk_id': chunk_id, 'node_id': entry['node_id'], 'node_url': entry['url'],
+                           'size': length, 'index': i})
+        self.call('store_file_metadata', 'POST', '/store_file_metadata', json={
+            'file_id': file_id,
+            'filename': f'{file_id}.bin',
+            'size': size,
+            'owner': owner,
+            'created_at': time.time(),
+            'chunks': chunks
+        })
+        with self.lock:
+            self.files[file_id] = (owner, chunks)
+        self.count('uploaded')
+
+    def delete(self):
+        with self.lock:
+            file_id = self.rng.choice(list(self.files)) if self.files else None
+            if file_id:
+                owner, chunks = self.files.pop(file_id)
+        if not file_id:
+            # Nothing stored yet
+            return self.upload()
+        self.call('get_file_metadata', 'GET', f'/get_file_metadata/{file_id}')
+        for chunk in chunks:
+            self.node_request('DELETE', self.nodes[chunk['node_id']], f"/delete/{chunk['chunk_id']}",
+                              headers={'X-Owner': owner})
+        self.call('delete_file_metadata', 'DELETE', f'/delete_file_metadata/{file_id}', headers={'X-Owner': owner})
+        self.count('deleted')
+
+    def list_files(self):
+        with self.lock:
+            owner = f'sim_owner_{self.rng.randrange(OWNERS)}'
+        self.call('list_files', 'GET', '/list_files', params={'owner': owner})
+        self.count('listed')
+
+    def churn(self):
+        """Fail a random node now and then, and bring failed ones back when their time is up"""
+        with self.lock:
+            self.counts['ops'] += 1
+            ops = self.counts['ops']
+            recovering = [node_id for node_id, failure in self.failures.items() if failure['recover_after'] <= ops]
+            for node_id in recovering:
+                del self.failures[node_id]
+            victim = None
+            if self.rng.random() < self.args.failure_rate:
+                live = [node for node in self.nodes.values() if not node.failed]
+                victim = self.rng.choice(live) if live else None
+        for node_id in recovering:
+            self.nodes[node_id].failed = False
+            self.heartbeat(self.nodes[node_id])
+            self.count('recovered')
+        if victim:
+            victim.failed = True
+            with self.lock:
+                self.failures[victim.node_id] = {
+                    'failed_at': time.monotonic(),
+                    'detected_at': None,
+                    'recover_after': ops + self.args.recovery_ops if self.args.recovery_ops else float('inf')
+                }
+            self.count('failed')
+
+    def run(self):
+        """Replay the workload, return the wall time"""
+        kinds = list(self.args.mix)
+        weights = [self.args.mix[kind] for kind in kinds]
+        operations = self.rng.choices(kinds, weights, k=self.args.operations)
+        handlers = {'upload': self.upload, 'delete': self.delete, 'list': self.list_files}
+
+        def step(kind):
+            self.churn()
+            try:
+                handlers[kind]()
+            except (requests.RequestException, ValueError) as e:
+                with self.lock:
+                    self.errors[f'{kind}:{type(e).__name__}'] += 1
+
+        self._spawn(self._heartbeats)
+        self._spawn(self._control)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(step, operations))
+        wall = time.perf_counter() - start
+        self.flush_reports()
+        return wall
+
+    def settle(self, timeout):
+        """Wait for the coordinator to mark the still failed nodes down"""
+        def detected():
+            self.check_detection()
+            with self.lock:
+                return all(failure['detected_at'] is not None for failure in self.failures.values())
+        wait_until(detected, timeout=timeout, interval=1.0)
+
+    def offered_failed(self):
+        """Failed nodes /available_nodes still hands out"""
+        offered = {node['node_id'] for node in self.call('available_nodes', 'GET', '/available_nodes').json()}
+        return sum(1 for node in self.nodes.values() if node.failed and node.node_id in offered)
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+        stop_processes([self.coordinator])
+
+
+def gini(values):
+    """Gini coefficient, 0 for a perfectly even spread and close to 1 when one holds everything"""
+    ordered = sorted(values)
+    total = sum(ordered)
+    if not total:
+        return 0.0
+    weighted = sum((i + 1) * value for i, value in enumerate(ordered))
+    return 2.0 * weighted / (len(ordered) * total) - (len(ordered) + 1.0) / len(ordered)
+
+
+def balance(nodes):
+    """How evenly stored bytes are spread over the nodes"""
+    used = [node.used_bytes for node in nodes]
+    fractions = [node.used_bytes / (node.limit_mb * MB) for node in nodes]
+    ranked = sorted(used, reverse=True)
+    top = max(1, len(ranked) // 100)
+    return {
+        'stored_mb': round(sum(used) / MB, 1),
+        'nodes_with_data': sum(1 for value in used if value),
+        'gini': round(gini(used), 4),
+        'top_1pct_share': round(sum(ranked[:top]) / sum(used), 4) if sum(used) else None,
+        'fill_mean': round(statistics.mean(fractions), 4),
+        'fill_stdev': round(statistics.pstdev(fractions), 4),
+        'fill_max': round(max(fractions), 4),
+        'over_capacity': sum(1 for value in fractions if value > 1.0),
+        'fill_by_profile': {
+            profile: round(statistics.mean([f for f, node in zip(fractions, nodes) if node.profile == profile]), 4)
+            for profile in PROFILES if any(node.profile == profile for node in nodes)
+        }
+    }
+
+
+def simulate(node_count, args):
+    workdir = tempfile.mkdtemp(prefix='dstorage-sim-')
+    sim = Simulation(workdir, node_count, args)
+    pid = sim.coordinator.pid
+    try:
+        cpu_start = cpu_seconds(pid)
+        register_wall = sim.register_all()
+        cpu_registered = cpu_seconds(pid)
+        registered = len(sim.call('all_nodes', 'GET', '/all_nodes').json())
+
+        workload_wall = sim.run()
+        cpu_workload = cpu_seconds(pid)
+        sim.settle(args.settle)
+        cpu_end = cpu_seconds(pid)
+
+        with sim.lock:
+            latencies = {endpoint: latency_summary(samples) for endpoint, samples in sim.latencies.items()}
+            still_failed = len(sim.failures)
+        return {
+            'nodes': node_count,
+            'placement': args.placement,
+            'registered': registered,
+            'register_wall_s': round(register_wall, 3),
+            'workload_wall_s': round(workload_wall, 3),
+            'ops_per_s': round(args.operations / workload_wall, 2),
+            'coordinator': {
+                'cpu_register_s': round(cpu_registered - cpu_start, 3),
+                'cpu_workload_s': round(cpu_workload - cpu_registered, 3),
+                'cpu_total_s': round(cpu_end - cpu_start, 3),
+                'cpu_ms_per_op': round(1000 * (cpu_workload - cpu_registered) / args.operations, 3),
+                'peak_rss_kb': peak_rss_kb(pid)
+            },
+            'latency': latencies,
+            'operations': dict(sim.counts),
+            'errors': dict(sim.errors),
+            'failures': {
+                'injected': sim.counts['failed'],
+                'still_failed': still_failed,
+                'detected': len(sim.detection),
+                'detection_s': latency_summary(sim.detection),
+                'offered_while_failed': sim.offered_failed()
+            },
+            'balance': balance(list(sim.nodes.values()))
+        }
+    finally:
+        sim.stop()
+        if args.keep_logs:
+            print(f'Logs kept in {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_mix(values):
+    mix = {}
+    for value in values:
+        kind, _, weight = value.partition('=')
+        if kind not in ('upload', 'delete', 'list') or not weight:
+            raise argparse.ArgumentTypeError(f'bad mix entry {value!r}, expected upload|delete|list=<weight>')
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--operations', type=int, default=2000, help='workload operations per node count')
+    parser.add_argument('--mix', nargs='+', default=['upload=70', 'delete=20', 'list=10'],
+                        help='operation weights, e.g. upload=70 delete=20 list=10')
+    parser.add_argument('--placement', choices=['client', 'random'], default='client',
+                        help='client: the order /upload uses; random: a shuffled node list per file, for comparison')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--chunk-size', type=int, default=MB)
+    parser.add_argument('--median-file-mb', type=float, default=4.0)
+    parser.add_argument('--max-file-mb', type=int, default=256)
+    parser.add_argument('--failure-rate', type=float, default=0.002, help='chance per operation that a node fails')
+    parser.add_argument('--recovery-ops', type=int, default=500, help='operations until a failed node returns, 0 never')
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0)
+    parser.add_argument('--probe-interval', type=float, default=5.0, help='coordinator NODE_PROBE_INTERVAL')
+    parser.add_argument('--report-interval', type=float, default=10.0, help='seconds between transfer outcome reports')
+    parser.add_argument('--settle', type=float, default=30.0, help='seconds to wait for failed nodes to be marked down')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='previous results file to compare against')
+    parser.add_argument('--keep-logs', action='store_true', help='keep the coordinator log in the work directory')
+    args = parser.parse_args()
+    args.mix = parse_mix(args.mix)
+
+    results = []
+    for node_count in args.nodes:
+        print(f'nodes={node_count} operations={args.operations} placement={args.placement}', file=sys.stderr)
+        results.append(simulate(node_count, args))
+
+    parameters = dict(vars(args))
+    for name in ('nodes', 'output', 'baseline', 'keep_logs'):
+        parameters.pop(name)
+    report = {
+        'benchmark': 'cluster_sim',
+        'environment': environment_info(),
+        'parameters': parameters,
+        'results': results
+    }
+    write_results(report, args.output)
+    if args.baseline:
+        compare_results(
+            report, args.baseline,
+            key_fields=['nodes', 'placement'],
+            metric_fields=['coordinator.cpu_ms_per_op', 'coordinator.peak_rss_kb', 'latency.register.p99_ms',
+                           'latency.available_nodes.p99_ms', 'latency.store_file_metadata.p99_ms',
+                           'failures.detection_s.p99_ms', 'balance.gini']
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import platform
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COORDINATOR_DIR = os.path.join(REPO_ROOT, 'server', 'coordinator')
+CLIENT_DIR = os.path.join(REPO_ROOT, 'server', 'client')
+STORAGE_NODE_DIR = os.path.join(REPO_ROOT, 'StorageNode', 'storage_node')
+
+# Unreachable chain endpoint: the services run without a contract in benchmarks
+NO_CHAIN_URL = 'http://127.0.0.1:9'
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def environment_info():
+    return {
+        'commit': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(samples):
+    """Latency stats in milliseconds for a list of durations in seconds"""
+    ms = [s * 1000 for s in samples]
+    return {
+        'count': len(ms),
+        'p50_ms': round(percentile(ms, 50), 3) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 3) if ms else None,
+        'max_ms': round(max(ms), 3) if ms else None
+    }
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_service(service_dir, cwd, port, env=None, register=False, log_path=None):
+    """Run one of the Flask apps as a local process bound to 127.0.0.1:port"""
+    launcher = (
+        "import sys; sys.path.insert(0, {dir!r}); import app; "
+        "{register}"
+        "app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    ).format(
+        dir=service_dir,
+        port=port,
+        register='app.register_with_coordinator(); ' if register else ''
+    )
+    os.makedirs(cwd, exist_ok=True)
+    full_env = dict(os.environ)
+    full_env.update(env or {})
+    log = open(log_path or os.devnull, 'w')
+    return subprocess.Popen(
+        [sys.executable, '-c', launcher], cwd=cwd, env=full_env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def wait_until(check, timeout=30.0, interval=0.1):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if check():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def stop_processes(processes):
+    for proc in processes:
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in processes:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def peak_rss_kb(pid):
+    """High-water resident set size of a process, from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time consumed by a process, from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        return (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def write_results(results, output=None, stream=None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text, file=stream or sys.stdout)
+
+
+def compare_results(current, baseline_path, key_fields, metric_fields):
+    """Print relative change of each metric against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    index = {tuple(r.get(k) for k in key_fields): r for r in baseline.get('results', [])}
+    print(f"Compared with {baseline.get('environment', {}).get('commit')}:", file=sys.stderr)
+    for result in current['results']:
+        key = tuple(result.get(k) for k in key_fields)
+        old = index.get(key)
+        if not old:
+            continue
+        changes = []
+        for field in metric_fields:
+            new_value, old_value = _lookup(result, field), _lookup(old, field)
+            if isinstance(new_value, (int, float)) and isinstance(old_value, (int, float)) and old_value:
+                changes.append(f"{field} {100.0 * (new_value - old_value) / old_value:+.1f}%")
+        print(f"  {dict(zip(key_fields, key))}: {', '.join(changes)}", file=sys.stderr)
+
+
+def _lookup(record, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
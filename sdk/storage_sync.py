@@ -0,0 +1,416 @@
+"""Python client for the client API with incremental directory sync.
+
+    python sdk/storage_sync.py --api http://localhost:5002 --owner 0xabc... sync ./photos
+    python sdk/storage_sync.py sync ./backups --workers 16 --no-delete --dry-run
+
+A manifest (`.storage_sync.json` in the synced directory by default) maps
+each relative path to its remote file id, size, mtime and content hashes.
+On each run files whose size and mtime are unchanged are skipped without
+being read, new files are uploaded, and changed files are hashed chunk by
+chunk with the API's chunk size so only the chunks that differ are sent
+through `/update`. Files removed locally are deleted remotely. Transfers
+run in parallel and the manifest is written after every finished file, so
+an interrupted run resumes where it stopped.
+
+With `--direct` (when the API has TRANSFER_TOKEN_SECRET set) files are sent
+unencrypted straight to the storage nodes with signed tokens from the API,
+which then only records the metadata.
+"""
+import os
+import sys
+import json
+import zlib
+import hashlib
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+try:
+    import zstandard
+except ImportError:  # only needed to read zstd chunks in download_direct
+    zstandard = None
+
+MANIFEST_NAME = '.storage_sync.json'
+# Past this share of changed chunks a whole new upload is cheaper than an update
+MAX_UPDATE_FRACTION = 0.5
+# Attempts for a request the API turns away with 429/503 and Retry-After
+MAX_ATTEMPTS = 5
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageClient:
+    """Thin wrapper over the client API endpoints"""
+
+    def __init__(self, base_url, owner='anonymous', timeout=300, priority=None):
+        self.base_url = base_url.rstrip('/')
+        self.owner = owner
+        self.timeout = timeout
+        self.priority = priority  # X-Priority: interactive, normal or bulk
+        self.session = requests.Session()
+        self._config = None
+
+    def _call(self, method, path, **kwargs):
+        headers = kwargs.pop('headers', {})
+        headers.setdefault('X-Owner', self.owner)
+        if self.priority:
+            headers.setdefault('X-Priority', self.priority)
+        for attempt in range(MAX_ATTEMPTS):
+            # Open files are sent again from the start on a retry
+            for _, part in (kwargs.get('files') or {}).items():
+                if hasattr(part[1], 'seek'):
+                    part[1].seek(0)
+            response = self.session.request(method, f"{self.base_url}{path}", headers=headers,
+                                            timeout=self.timeout, **kwargs)
+            if response.status_code not in (429, 503) or 'Retry-After' not in response.headers:
+                break
+            time.sleep(float(response.headers['Retry-After']) * (attempt + 1))
+        if response.status_code != 200:
+            try:
+                error = response.json().get('error', response.text)
+            except ValueError:
+                error = response.text
+            raise StorageError(f"{method} {path} failed with HTTP {response.status_code}: {error}")
+        return response
+
+    def config(self):
+        if self._config is None:
+            self._config = self._call('GET', '/client_config').json()
+        return self._config
+
+    def upload(self, path, name=None, encryption='aes', agreement_id=None, tier=None):
+        data = {'owner': self.owner, 'encryption': encryption}
+        headers = {}
+        if agreement_id:
+            data['agreement_id'] = agreement_id
+            headers['X-Agreement-Id'] = agreement_id
+        if tier:
+            data['tier'] = tier
+        with open(path, 'rb') as f:
+            files = {'file': (name or os.path.basename(path), f)}
+            return self._call('POST', '/upload', data=data, files=files, headers=headers).json()
+
+    def update(self, file_id, size, chunk_count, changed):
+        """Replace chunks of a stored file, `changed` maps chunk index to plaintext"""
+        files = {f'chunk_{index}': (f'chunk_{index}', data) for index, data in changed.items()}
+        data = {'size': str(size), 'chunk_count': str(chunk_count)}
+        return self._call('POST', f'/update/{file_id}', data=data, files=files).json()
+
+    def delete(self, file_id):
+        return self._call('DELETE', f'/delete/{file_id}').json()
+
+    def clone(self, file_id, filename=None):
+        return self._call('POST', f'/clone/{file_id}', json={'filename': filename}).json()
+
+    def snapshot(self, file_ids, label=None):
+        return self._call('POST', '/snapshot', json={'file_ids': list(file_ids), 'label': label}).json()
+
+    def list_files(self):
+        return self._call('GET', '/list_files', params={'owner': self.owner}).json()
+
+    def download(self, file_id, path):
+        with self._call('GET', f'/download/{file_id}', stream=True) as response, open(path, 'wb') as f:
+            for block in response.iter_content(1024 * 1024):
+                f.write(block)
+        return path
+
+    def _node_call(self, method, grant, **kwargs):
+        """One chunk transfer to the node named in a grant from the API"""
+        response = self.session.request(method, grant['url'], headers=grant['headers'], timeout=self.timeout, **kwargs)
+        if response.status_code != 200:
+            raise StorageError(f"{method} {grant['url']} failed with HTTP {response.status_code}: {response.text}")
+        return response
+
+    def upload_direct(self, path, name=None, tier=None, workers=4):
+        """Upload a file unencrypted, sending its chunks straight to the storage nodes"""
+        chunk_size = self.config()['chunk_size']
+        size = os.path.getsize(path)
+        _, hashes = hash_file(path, chunk_size)
+        name = name or os.path.basename(path)
+        grants = self._call('POST', '/direct/upload', json={
+            'filename': name, 'size': size, 'tier': tier,
+            'chunks': [{'index': i, 'chunk_id': chunk_id} for i, chunk_id in enumerate(hashes)]
+        }).json()
+
+        def send(grant):
+            with open(path, 'rb') as f:
+                f.seek(grant['index'] * chunk_size)
+                data = f.read(chunk_size)
+            return self._node_call('POST', grant, data=data).json()['receipt']
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            receipts = list(pool.map(send, grants['chunks']))
+        return self._call('POST', f"/direct/upload/{grants['file_id']}/complete",
+                          json={'filename': name, 'size': size, 'receipts': receipts}).json()
+
+    def download_direct(self, file_id, path):
+        """Download an unencrypted file straight from the storage nodes, checking each chunk's hash"""
+        grants = self._call('GET', f'/direct/download/{file_id}').json()
+        with open(path, 'wb') as f:
+            for grant in grants['chunks']:
+                data = self._node_call('GET', grant).content
+                if hashlib.sha256(data).hexdigest() != grant['chunk_id']:
+                    raise StorageError(f"Chunk {grant['index']} from {grant['node_id']} failed its hash check")
+                if grant['compression'] == 'zlib':
+                    data = zlib.decompress(data)
+                elif grant['compression'] == 'zstd':
+                    if zstandard is None:
+                        raise StorageError('zstandard is required to read this file directly, use download')
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                f.write(data)
+        return path
+
+
+def hash_file(path, chunk_size):
+    """(sha256 of the file, sha256 of each chunk_size chunk)"""
+    whole = hashlib.sha256()
+    chunks = []
+    with open(path, 'rb') as f:
+        while block := f.read(chunk_size):
+            whole.update(block)
+            chunks.append(hashlib.sha256(block).hexdigest())
+    return whole.hexdigest(), chunks
+
+
+class DirectorySync:
+    """Mirror a local directory tree into storage, transferring only the delta"""
+
+    def __init__(self, client, root, manifest_path=None, workers=8, chunk_hashing=True,
+                 delete=True, dry_run=False, encryption='aes', tier=None, direct=False):
+        self.client = client
+        self.root = os.path.abspath(root)
+        self.manifest_path = manifest_path or os.path.join(self.root, MANIFEST_NAME)
+        self.workers = workers
+        self.chunk_hashing = chunk_hashing
+        self.delete = delete
+        self.dry_run = dry_run
+        self.encryption = encryption
+        self.tier = tier
+        self.direct = direct  # new files go straight to the nodes, unencrypted
+        self._lock = threading.Lock()
+        self.manifest = {'files': {}}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.stats = {'uploaded': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0,
+                      'bytes_sent': 0, 'chunks_sent': 0, 'chunks_kept': 0}
+
+    def _save_manifest(self):
+        if self.dry_run:
+            return
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _record(self, relpath, entry):
+        with self._lock:
+            if entry is None:
+                self.manifest['files'].pop(relpath, None)
+            else:
+                self.manifest['files'][relpath] = entry
+            self._save_manifest()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.stats[name] += delta
+
+    def scan(self):
+        """Relative path -> os.stat_result of every regular file under the root"""
+        found = {}
+        manifest = os.path.abspath(self.manifest_path)
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(directory, name)
+                if path in (manifest, manifest + '.tmp') or not os.path.isfile(path):
+                    continue
+                found[os.path.relpath(path, self.root).replace(os.sep, '/')] = os.stat(path)
+        return found
+
+    def plan(self):
+        """Split the tree into (new, possibly changed, removed) relative paths"""
+        local = self.scan()
+        known = self.manifest['files']
+        new, changed = [], []
+        for relpath, stat in local.items():
+            entry = known.get(relpath)
+            if entry is None:
+                new.append(relpath)
+            elif entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                changed.append(relpath)
+            else:
+                self._count(unchanged=1)
+        removed = [relpath for relpath in known if relpath not in local]
+        return new, changed, removed
+
+    def _entry(self, relpath, file_id, chunk_size):
+        path = os.path.join(self.root, relpath)
+        stat = os.stat(path)
+        digest, chunks = hash_file(path, chunk_size)
+        return {'file_id': file_id, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest, 'chunk_size': chunk_size, 'chunks': chunks if self.chunk_hashing else []}
+
+    def _upload(self, relpath):
+        path = os.path.join(self.root, relpath)
+        # Hashed before the upload so a write during it is picked up by the next run
+        entry = self._entry(relpath, None, self.client.config()['chunk_size'])
+        if self.direct and entry['size']:
+            result = self.client.upload_direct(path, name=relpath, tier=self.tier)
+        else:
+            result = self.client.upload(path, name=relpath, encryption=self.encryption, tier=self.tier)
+        self._count(uploaded=1, bytes_sent=entry['size'], chunks_sent=result.get('chunks', 0))
+        return dict(entry, file_id=result['file_id'])
+
+    def _sync_new(self, relpath):
+        if self.dry_run:
+            return 'upload'
+        self._record(relpath, self._upload(relpath))
+        return 'upload'
+
+    def _sync_changed(self, relpath):
+        old = self.manifest['files'][relpath]
+        path = os.path.join(self.root, relpath)
+        chunk_size = self.client.config()['chunk_size']
+        stat = os.stat(path)
+        digest, chunks = hash_file(path, chunk_size)
+
+        if digest == old['sha256']:
+            # Touched but not modified, only the mtime needs recording
+            if not self.dry_run:
+                self._record(relpath, dict(old, mtime_ns=os.stat(path).st_mtime_ns))
+            self._count(unchanged=1)
+            return 'unchanged'
+
+        differing = [i for i, chunk in enumerate(chunks)
+                     if i >= len(old['chunks']) or old['chunks'][i] != chunk]
+        # A grown file's old last chunk was partial and has to be resent too
+        if (len(chunks) > len(old['chunks']) and old['size'] % chunk_size
+                and len(old['chunks']) - 1 not in differing):
+            differing.insert(0, len(old['chunks']) - 1)
+        incremental = (self.chunk_hashing and old.get('chunk_size') == chunk_size and old['chunks']
+                       and len(differing) <= len(chunks) * MAX_UPDATE_FRACTION)
+        if self.dry_run:
+            return 'update' if incremental else 'replace'
+
+        if incremental:
+            changed = {}
+            with open(path, 'rb') as f:
+                for index in differing:
+                    f.seek(index * chunk_size)
+                    changed[index] = f.read(chunk_size)
+            try:
+                result = self.client.update(old['file_id'], stat.st_size, len(chunks), changed)
+            except StorageError as e:
+                # e.g. the API's chunk size changed since the file was stored
+                print(f"Incremental update of {relpath} failed, uploading it again: {e}")
+            else:
+                self._count(updated=1, bytes_sent=sum(len(data) for data in changed.values()),
+                            chunks_sent=result['chunks_uploaded'], chunks_kept=result['chunks_kept'])
+                self._record(relpath, {'file_id': old['file_id'], 'size': stat.st_size,
+                                       'mtime_ns': stat.st_mtime_ns, 'sha256': digest,
+                                       'chunk_size': chunk_size, 'chunks': chunks})
+                return 'update'
+
+        # Upload the new version before removing the old one so the file is never missing
+        entry = self._upload(relpath)
+        self._record(relpath, entry)
+        try:
+            self.client.delete(old['file_id'])
+        except StorageError as e:
+            print(f"Could not delete the previous version of {relpath}: {e}")
+        return 'replace'
+
+    def _sync_removed(self, relpath):
+        if self.dry_run:
+            return 'delete'
+        try:
+            self.client.delete(self.manifest['files'][relpath]['file_id'])
+        except StorageError as e:
+            if 'HTTP 404' not in str(e):
+                raise
+        self._record(relpath, None)
+        self._count(deleted=1)
+        return 'delete'
+
+    def run(self):
+        new, changed, removed = self.plan()
+        jobs = [(self._sync_new, relpath) for relpath in new]
+        jobs += [(self._sync_changed, relpath) for relpath in changed]
+        if self.delete:
+            jobs += [(self._sync_removed, relpath) for relpath in removed]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(job, relpath): relpath for job, relpath in jobs}
+            for future in as_completed(futures):
+                relpath = futures[future]
+                try:
+                    action = future.result()
+                    if action != 'unchanged':
+                        print(f"{'would ' if self.dry_run else ''}{action}: {relpath}")
+                except Exception as e:
+                    self._count(failed=1)
+                    print(f"failed: {relpath}: {e}")
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync files with the decentralized storage client API')
+    parser.add_argument('--api', default=os.getenv('STORAGE_API_URL', 'http://localhost:5002'))
+    parser.add_argument('--owner', default=os.getenv('STORAGE_OWNER', 'anonymous'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync = commands.add_parser('sync', help='Mirror a local directory into storage')
+    sync.add_argument('directory')
+    sync.add_argument('--manifest', help=f'Manifest path (default: <directory>/{MANIFEST_NAME})')
+    sync.add_argument('--workers', type=int, default=8)
+    sync.add_argument('--encryption', choices=['aes', 'none'], default='aes')
+    sync.add_argument('--tier', choices=['fast', 'capacity'])
+    sync.add_argument('--priority', choices=['interactive', 'normal', 'bulk'], default='bulk',
+                      help='X-Priority of the transfers (default: bulk, behind interactive traffic)')
+    sync.add_argument('--no-chunk-hashing', action='store_true',
+                      help='Re-upload changed files whole instead of sending changed chunks')
+    sync.add_argument('--no-delete', action='store_true', help='Keep remote files that were removed locally')
+    sync.add_argument('--dry-run', action='store_true')
+    sync.add_argument('--direct', action='store_true',
+                      help='Send new files unencrypted straight to the storage nodes with signed tokens')
+
+    download = commands.add_parser('download', help='Download one file')
+    download.add_argument('file_id')
+    download.add_argument('output')
+    download.add_argument('--direct', action='store_true', help='Fetch chunks straight from the storage nodes')
+
+    commands.add_parser('list', help='List stored files')
+
+    args = parser.parse_args()
+    client = StorageClient(args.api, args.owner, priority=getattr(args, 'priority', None))
+
+    if args.command == 'sync':
+        syncer = DirectorySync(client, args.directory, manifest_path=args.manifest, workers=args.workers,
+                               chunk_hashing=not args.no_chunk_hashing, delete=not args.no_delete,
+                               dry_run=args.dry_run, encryption=args.encryption, tier=args.tier,
+                               direct=args.direct)
+        stats = syncer.run()
+        print(json.dumps(stats, indent=2))
+        return 1 if stats['failed'] else 0
+    if args.command == 'download':
+        if args.direct:
+            client.download_direct(args.file_id, args.output)
+        else:
+            client.download(args.file_id, args.output)
+        return 0
+    for file in client.list_files():
+        print(f"{file['file_id']}  {file.get('size', 0):>12}  {file.get('filename')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
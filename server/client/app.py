@@ -7,18 +7,73 @@ import time
 import json
 import uuid
 import tempfile
-from web3 import Web3
+import random
+from concurrent.futures import ThreadPoolExecutor
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 import base64
+from chunk_cache import ChunkCache
+from coordinator_cache import CoordinatorCache
+from key_cache import EncryptionKeyCache
+from node_health import NodeHealthClient
+from shard_router import ShardRouter
+from metadata_codec import decode_chunks, encode_record, expand_record, is_compact
+from tx_manager import TransactionManager
+from merkle import SEGMENT_SIZE, merkle_root, segment_root, verify_proof
+from chain import ChainClient, checksum_address
+import compression
+from admission import Admission, INTERACTIVE, NORMAL, BULK, query_identity
+import transfer_token
+from transfer_token import TokenError
+from telemetry import REGISTRY, StartupTimer, instrument_app, install_profiling, timed_chain_call, start_span, inject_headers
+
+startup = StartupTimer('client')
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app, 'client')
+install_profiling(app)
+
+# Per-stage timings of uploads and downloads and per-node transfer stats
+stage_latency = REGISTRY.histogram(
+    'client_stage_duration_seconds', 'Time spent in each stage of uploads and downloads', ('operation', 'stage'))
+node_bytes = REGISTRY.counter(
+    'client_node_bytes_total', 'Chunk bytes exchanged with storage nodes', ('node_id', 'direction'))
+compression_bytes = REGISTRY.counter(
+    'client_compression_bytes_total', 'Chunk bytes before and after the compression stage', ('codec', 'stage'))
+chunk_transfer_latency = REGISTRY.histogram(
+    'client_chunk_transfer_duration_seconds', 'Latency of single chunk transfers', ('node_id', 'operation'))
+admission_rejected = REGISTRY.counter(
+    'admission_rejected_total', 'Requests turned away by rate limits or load shedding', ('reason', 'priority'))
+direct_tokens = REGISTRY.counter(
+    'client_direct_transfer_tokens_total', 'Tokens issued for chunk transfers straight to the nodes', ('operation',))
+UPLOAD_STAGES = {stage: stage_latency.labels('upload', stage)
+                 for stage in ('read', 'compress', 'encrypt', 'hash', 'network', 'metadata_write')}
+DOWNLOAD_STAGES = {stage: stage_latency.labels('download', stage)
+                   for stage in ('metadata_read', 'key_lookup', 'network', 'verify', 'decrypt', 'decompress', 'write')}
 
 COORDINATOR_URL = os.getenv('COORDINATOR_URL', 'http://localhost:5001')
 BLOCKCHAIN_URL = os.getenv('BLOCKCHAIN_URL', 'http://localhost:8545')
-TEMP_DIR = './temp'
+TEMP_DIR = os.path.abspath('./temp')  # send_file resolves relative paths against the app, not the cwd
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE_BYTES', str(1024 * 1024)))
+# Chunks are compressed before encryption: auto (zstd if installed, else zlib), zstd, zlib or none
+COMPRESSION = os.getenv('COMPRESSION', 'auto')
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', '3'))
+VERIFY_SAMPLES = int(os.getenv('VERIFY_SAMPLES', '4'))  # segments challenged per chunk by /verify
+VERIFY_WORKERS = int(os.getenv('VERIFY_WORKERS', '8'))
+MAX_CHALLENGE_SEGMENTS = 64  # per request, must not exceed the nodes' limit
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '16'))  # concurrent uploads and downloads, 0 disables
+MAX_QUEUED = int(os.getenv('MAX_QUEUED', '64'))  # requests waiting for a slot before new ones are shed
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', '5'))  # seconds a queued request waits before a 503
+BULK_SHARE = float(os.getenv('BULK_SHARE', '0.75'))  # share of the slots X-Priority: bulk may use
+OWNER_RATE_MB_PER_SEC = float(os.getenv('OWNER_RATE_MB_PER_SEC', '0'))  # per X-Owner, 0 disables
+OWNER_BURST_MB = float(os.getenv('OWNER_BURST_MB', '0'))  # defaults to one second of the rate
+AGREEMENT_RATE_MB_PER_SEC = float(os.getenv('AGREEMENT_RATE_MB_PER_SEC', '0'))  # per X-Agreement-Id, 0 disables
+AGREEMENT_BURST_MB = float(os.getenv('AGREEMENT_BURST_MB', '0'))
+NODE_RETRY_AFTER_MAX = float(os.getenv('NODE_RETRY_AFTER_MAX', '2'))  # longest wait before retrying a busy node
+TRANSFER_TOKEN_SECRET = os.getenv('TRANSFER_TOKEN_SECRET', '')  # shared with the storage nodes, empty disables direct transfers
+TRANSFER_TOKEN_TTL = float(os.getenv('TRANSFER_TOKEN_TTL', '300'))  # seconds a transfer token stays valid
 
 if not os.path.exists(TEMP_DIR):
     try:
@@ -28,33 +83,116 @@ if not os.path.exists(TEMP_DIR):
         print(f"Error creating temp directory: {e}")
         raise
 
-# Initialize Web3
-web3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
+# Short-TTL cache of coordinator reads, revalidated with ETags once stale
+NODES_CACHE_TTL = float(os.getenv('NODES_CACHE_TTL', '2'))
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', '30'))
+COORDINATOR_CACHE_MAX_ENTRIES = int(os.getenv('COORDINATOR_CACHE_MAX_ENTRIES', '4096'))  # cached coordinator responses
+COORDINATOR_CACHE_MAX_AGE = float(os.getenv('COORDINATOR_CACHE_MAX_AGE', '300'))  # seconds an unused response is kept for revalidation
+coordinator_cache = CoordinatorCache(COORDINATOR_URL, default_ttl=NODES_CACHE_TTL, header_hook=inject_headers,
+                                     max_entries=COORDINATOR_CACHE_MAX_ENTRIES, max_age=COORDINATOR_CACHE_MAX_AGE)
+
+# File metadata calls go to the coordinator shard owning the file
+shard_router = ShardRouter(COORDINATOR_URL, coordinator_cache, header_hook=inject_headers)
+
+# Adaptive per-node timeouts and batched transfer outcome reports
+NODE_STATS_TTL = float(os.getenv('NODE_STATS_TTL', '10'))
+NODE_REPORT_INTERVAL = float(os.getenv('NODE_REPORT_INTERVAL', '10'))  # 0 disables reporting
+node_health = NodeHealthClient(
+    coordinator_cache,
+    stats_ttl=NODE_STATS_TTL,
+    report_interval=NODE_REPORT_INTERVAL,
+    header_hook=inject_headers
+)
+node_health.start()
 
+# Decrypted chunk cache (memory tier) with an optional on-disk tier for node payloads
+CHUNK_CACHE_MB = int(os.getenv('CHUNK_CACHE_MB', '64'))
+CHUNK_CACHE_DISK_MB = int(os.getenv('CHUNK_CACHE_DISK_MB', '0'))  # 0 disables the disk tier
+chunk_cache = ChunkCache(
+    max_bytes=CHUNK_CACHE_MB * 1024 * 1024,
+    disk_dir=os.path.join(TEMP_DIR, 'chunk_cache'),
+    max_disk_bytes=CHUNK_CACHE_DISK_MB * 1024 * 1024
+)
+
+# Bandwidth per owner and agreement, and a bounded number of transfers in flight
+admission = Admission(
+    max_in_flight=MAX_IN_FLIGHT,
+    max_queue=MAX_QUEUED,
+    queue_timeout=QUEUE_TIMEOUT,
+    bulk_share=BULK_SHARE,
+    owner_rate=OWNER_RATE_MB_PER_SEC * 1024 * 1024,
+    owner_burst=OWNER_BURST_MB * 1024 * 1024,
+    agreement_rate=AGREEMENT_RATE_MB_PER_SEC * 1024 * 1024,
+    agreement_burst=AGREEMENT_BURST_MB * 1024 * 1024,
+    rejected_counter=admission_rejected
+)
+REGISTRY.gauge_callback(
+    'admission_requests', 'Transfers in flight and queued',
+    lambda: {(state,): value for state, value in admission.slots.status().items() if state != 'max_in_flight'},
+    ('state',))
+
+startup.mark('caches')
+
+# Chain client and contract are created on first use, so startup does not wait on the chain
 CONTRACT_ABI_PATH ='../coordinator/data/contract_abi.json'
 CONTRACT_ADDRESS_FILE ='../coordinator/data/contract_address.txt'
-contract = None
-CONTRACT_ADDRESS = ''
+CHAIN_TIMEOUT = float(os.getenv('CHAIN_TIMEOUT', '10'))
+CHAIN_CHECK_INTERVAL = float(os.getenv('CHAIN_CHECK_INTERVAL', '30'))  # 0 disables connection checks
+chain = ChainClient(BLOCKCHAIN_URL, abi_path=CONTRACT_ABI_PATH, address_file=CONTRACT_ADDRESS_FILE,
+                    timeout=CHAIN_TIMEOUT)
+chain.start_monitor(CHAIN_CHECK_INTERVAL)
 
-# Read contract address from file if it exists
-if os.path.exists(CONTRACT_ADDRESS_FILE):
-    try:
-        with open(CONTRACT_ADDRESS_FILE, 'r') as f:
-            CONTRACT_ADDRESS = f.read().strip()
-        print(f"Loaded contract address: {CONTRACT_ADDRESS}")
-    except Exception as e:
-        print(f"Error reading contract address: {e}")
+# Background submission of contract transactions
+TX_WORKERS = int(os.getenv('TX_WORKERS', '4'))
+TX_RECEIPT_TIMEOUT = int(os.getenv('TX_RECEIPT_TIMEOUT', '120'))
+STORE_KEY_GAS = int(os.getenv('STORE_KEY_GAS', '300000'))
+tx_manager = TransactionManager(lambda: chain.web3, max_workers=TX_WORKERS, receipt_timeout=TX_RECEIPT_TIMEOUT)
 
+# Agreement keys read from the chain, held in memory only
+KEY_CACHE_TTL = float(os.getenv('KEY_CACHE_TTL', '300'))
+KEY_CACHE_MAX_ENTRIES = int(os.getenv('KEY_CACHE_MAX_ENTRIES', '1024'))
+KEY_CACHE_REFRESH_INTERVAL = float(os.getenv('KEY_CACHE_REFRESH_INTERVAL', '10'))  # 0 disables
+key_cache = EncryptionKeyCache(max_entries=KEY_CACHE_MAX_ENTRIES, ttl=KEY_CACHE_TTL)
 
-if os.path.exists(CONTRACT_ABI_PATH):
-    try:
-        with open(CONTRACT_ABI_PATH, 'r') as f:
-            contract_abi = json.load(f)
-        contract = web3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-        print(contract)
-        print(f"Contract loaded successfully at address {CONTRACT_ADDRESS}")
-    except Exception as e:
-        print(f"Error loading contract: {e}")
+def fetch_agreement_key(agreement_id, owner):
+    """Read the encryption key of an agreement from the contract"""
+    with timed_chain_call('getEncryptionKey'):
+        encrypted_key = chain.contract.functions.getEncryptionKey(agreement_id).call({'from': owner})
+    return base64.b64decode(encrypted_key)
+
+def get_agreement_key(agreement_id, owner):
+    """Encryption key of an agreement, from the key cache when possible"""
+    key = key_cache.get(agreement_id, owner)
+    if key is None:
+        key = fetch_agreement_key(agreement_id, owner)
+        key_cache.put(agreement_id, owner, key)
+    return key
+
+def list_indexed_agreements():
+    status_code, agreements = coordinator_cache.get_json('/storage_agreements')
+    return agreements if status_code == 200 else None
+
+if chain.configured:
+    key_cache.start_refresher(list_indexed_agreements, fetch_agreement_key, KEY_CACHE_REFRESH_INTERVAL)
+
+startup.mark('chain')
+
+def _hit_ratio(hits, lookups):
+    return round(hits / lookups, 4) if lookups else 0.0
+
+def cache_hit_ratios():
+    chunks = chunk_cache.stats()
+    coordinator = coordinator_cache.stats()
+    keys = key_cache.stats()
+    coordinator_served = coordinator['hits'] + coordinator['revalidated']
+    return {
+        ('chunks_memory',): chunks['memory_hit_rate'],
+        ('chunks_disk',): _hit_ratio(chunks['disk_hits'], chunks['disk_hits'] + chunks['disk_misses']),
+        ('coordinator',): _hit_ratio(coordinator_served, coordinator_served + coordinator['misses']),
+        ('keys',): _hit_ratio(keys['hits'], keys['hits'] + keys['misses'])
+    }
+
+REGISTRY.gauge_callback('client_cache_hit_ratio', 'Hit ratio of the client-side caches', cache_hit_ratios, ('cache',))
 
 def generate_encryption_key():
     """Generate a random AES key"""
@@ -85,15 +223,151 @@ def split_file_into_chunks(file_path, chunk_size=1024*1024):
             chunks.append(chunk)
     return chunks
 
+def node_request(method, url, node_id, **kwargs):
+    """Request to a storage node, retried once when the node sheds load with Retry-After"""
+    response = requests.request(method, url, timeout=node_health.timeouts(node_id), **kwargs)
+    if response.status_code in (429, 503) and 'Retry-After' in response.headers:
+        try:
+            delay = float(response.headers['Retry-After'])
+        except ValueError:
+            return response
+        time.sleep(min(delay, NODE_RETRY_AFTER_MAX))
+        response = requests.request(method, url, timeout=node_health.timeouts(node_id), **kwargs)
+    return response
+
+def node_busy(response):
+    """A node shedding load is not failing, it should not count against its health"""
+    return response.status_code in (429, 503) and 'Retry-After' in response.headers
+
+def transfer_headers(operation, chunk_id, node_id, **claims):
+    """X-Transfer-Token for a chunk transfer, when the nodes share a token secret"""
+    if not TRANSFER_TOKEN_SECRET:
+        return {}
+    return {'X-Transfer-Token': transfer_token.sign(TRANSFER_TOKEN_SECRET, operation, chunk_id, node_id,
+                                                    ttl=TRANSFER_TOKEN_TTL, **claims)}
+
+def upload_chunk(chunk_data, i, node, file_id, owner, key, encryption, codec, agreement_id=None, tier=None):
+    """Compress, encrypt and store one chunk on a node.
+
+    Returns (chunk metadata, None) or (None, error message).
+    """
+    # Compress before encrypting, ciphertext does not compress
+    with UPLOAD_STAGES['compress'].time():
+        compression_type, compressed = compression.compress(chunk_data, codec, COMPRESSION_LEVEL)
+    compression_bytes.labels(compression_type, 'in').inc(len(chunk_data))
+    compression_bytes.labels(compression_type, 'out').inc(len(compressed))
+    chunk_data = compressed
+    
+    # Encrypt chunk if required
+    if encryption == 'aes' and key:
+        # Convert chunk to JSON string for encryption
+        with UPLOAD_STAGES['encrypt'].time():
+            encrypted_data = encrypt_data(chunk_data, key)
+            chunk_data = encrypted_data.encode('utf-8')
+        encryption_type = 'aes'
+    else:
+        encryption_type = 'none'
+    
+    # Generate chunk ID
+    with UPLOAD_STAGES['hash'].time():
+        chunk_id = hashlib.sha256(chunk_data).hexdigest()
+        chunk_root = segment_root(chunk_data).hex()
+    
+    # Upload to node
+    headers = {
+        'X-Owner': owner,
+        'X-File-Id': file_id,
+        'X-Encryption': encryption_type,
+        'X-Priority': Admission.priority(request.headers.get('X-Priority'), NORMAL)
+    }
+    if tier:
+        headers['X-Tier'] = tier
+    
+    # If using rented storage, add agreement ID header
+    if agreement_id:
+        headers['X-Agreement-Id'] = agreement_id
+    # Nodes that require tokens take the chunk's owner and agreement from it
+    headers.update(transfer_headers(transfer_token.STORE, chunk_id, node['node_id'], owner=owner, file_id=file_id,
+                                    encryption=encryption_type, agreement_id=agreement_id))
+    
+    url = f"{node['url']}/store/{chunk_id}"
+    
+    try:
+        transfer_start = time.perf_counter()
+        with start_span('chunk.store', kind='client', node_id=node['node_id'],
+                        chunk_id=chunk_id, chunk_index=i, bytes=len(chunk_data)) as span:
+            try:
+                response = node_request('POST', url, node['node_id'], data=chunk_data,
+                                        headers=inject_headers(headers))
+            except Exception as e:
+                node_health.record(node['node_id'], error=type(e).__name__)
+                raise
+            if span and response.status_code != 200:
+                span.set_error(f'HTTP {response.status_code}')
+        elapsed = time.perf_counter() - transfer_start
+        if response.status_code >= 500 and not node_busy(response):
+            node_health.record(node['node_id'], error=f'HTTP {response.status_code}')
+        else:
+            node_health.record(node['node_id'], elapsed)
+        UPLOAD_STAGES['network'].observe(elapsed)
+        chunk_transfer_latency.labels(node['node_id'], 'store').observe(elapsed)
+        node_bytes.labels(node['node_id'], 'out').inc(len(chunk_data))
+        if response.status_code != 200:
+            return None, f'Failed to upload chunk {i} to node {node["node_id"]}'
+        result = response.json()
+        return {
+            'chunk_id': chunk_id,
+            'segment_root': chunk_root,
+            'node_id': result['node_id'],
+            'node_url': node['url'],
+            'size': len(chunk_data),
+            'index': i,
+            'encryption': encryption_type,
+            'compression': compression_type,
+            'agreement_id': agreement_id
+        }, None
+    except Exception as e:
+        return None, f'Error uploading chunk {i}: {str(e)}'
+
+def discard_uploaded(chunks, owner, agreement_id=None):
+    """Roll back chunks uploaded for metadata that was never stored.
+
+    Unencrypted chunks are addressed by their content and may already belong
+    to another file, so only encrypted ones are deleted; the rest are left.
+    """
+    delete_chunks([chunk for chunk in chunks if chunk['encryption'] == 'aes'], owner, agreement_id)
+
+def delete_chunks(chunks, owner, agreement_id=None):
+    """Remove chunks from their nodes, logging failures"""
+    for chunk in chunks:
+        chunk_id = chunk['chunk_id']
+        node_url = chunk['node_url']
+        chunk_cache.invalidate(chunk_id)
+        
+        # Delete chunk
+        headers = {'X-Owner': owner}
+        if agreement_id:
+            headers['X-Agreement-Id'] = agreement_id
+        
+        url = f"{node_url}/delete/{chunk_id}"
+        with start_span('chunk.delete', kind='client', node_id=chunk['node_id'], chunk_id=chunk_id):
+            try:
+                response = requests.delete(url, headers=inject_headers(headers),
+                                           timeout=node_health.timeouts(chunk['node_id']))
+            except Exception as e:
+                node_health.record(chunk['node_id'], error=type(e).__name__)
+                print(f"Failed to delete chunk {chunk_id}: {e}")
+                continue
+        if response.status_code != 200:
+            print(f"Failed to delete chunk {chunk_id}: {response.text}")
+
 @app.route('/available_storage_providers', methods=['GET'])
 def available_storage_providers():
     """Get list of available storage providers with available space for rental"""
-    response = requests.get(f'{COORDINATOR_URL}/available_nodes')
-    if response.status_code != 200:
+    status_code, nodes = coordinator_cache.get_json('/available_nodes')
+    if status_code != 200:
         return jsonify({'error': 'Failed to get available storage nodes'}), 500
     
-    nodes = response.json()
-    
     # Filter for nodes with locked storage available
     providers = []
     for node in nodes:
@@ -126,13 +400,14 @@ def rent_storage():
     key_hash = hashlib.sha256(encryption_key).hexdigest()
     
     # Create agreement on blockchain
+    contract = chain.contract
     if not contract:
         return jsonify({'error': 'Smart contract not available'}), 500
     
     # Calculate price in wei based on provider's pricing
-    response = requests.get(f'{COORDINATOR_URL}/available_nodes')
+    _, nodes = coordinator_cache.get_json('/available_nodes')
     provider = None
-    for node in response.json():
+    for node in nodes or []:
         if node['node_id'] == node_id:
             provider = node
             break
@@ -145,52 +420,79 @@ def rent_storage():
     
     try:
         # Convert wallet address to checksum format
-        wallet_address = Web3.to_checksum_address(wallet_address)
-        
-        # Create storage agreement on blockchain
-        tx_hash = contract.functions.createStorageAgreement(
-            node_id,
-            int(size_mb),
-            int(duration_days),
-            key_hash
-        ).transact({
-            'from': wallet_address,
-            'value': total_price
-        })
-        
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-        if tx_receipt.status != 1:
-            return jsonify({'error': 'Blockchain transaction failed'}), 500
-        
-        # Generate agreement ID as node_id-size_mb
-        agreement_id = f"{node_id}-{size_mb}"
-        
-        # Encrypt the encryption key with client's public key for secure storage on blockchain
-        # For simplicity, we're just storing the encrypted key in the contract
-        # In a real implementation, you would encrypt the key with the client's public key
-        encrypted_key = encryption_key_b64
-        
-        # Store the encryption key on blockchain
-        tx_hash = contract.functions.storeEncryptionKey(
-            agreement_id,
-            encrypted_key
-        ).transact({'from': wallet_address})
-        
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-        if tx_receipt.status != 1:
-            return jsonify({'error': 'Failed to store encryption key'}), 500
-        
-        return jsonify({
-            'status': 'success',
-            'agreement_id': agreement_id,
-            'encryption_key': encryption_key_b64,  # In a real app, this would be securely transmitted
-            'total_price': total_price
-        }), 200
-        
+        wallet_address = checksum_address(wallet_address)
     except Exception as e:
-        return jsonify({'error': f'Error creating agreement: {str(e)}'}), 500
+        return jsonify({'error': f'Invalid wallet address: {str(e)}'}), 400
+    
+    # Generate agreement ID as node_id-size_mb
+    agreement_id = f"{node_id}-{size_mb}"
+    
+    # Encrypt the encryption key with client's public key for secure storage on blockchain
+    # For simplicity, we're just storing the encrypted key in the contract
+    # In a real implementation, you would encrypt the key with the client's public key
+    encrypted_key = encryption_key_b64
+    
+    def on_confirmed():
+        # A new key replaces whatever was cached for this agreement ID
+        key_cache.invalidate(agreement_id)
+        key_cache.put(agreement_id, wallet_address, encryption_key)
+        
+        # Let the coordinator index the new agreement right away
+        try:
+            requests.post(f'{COORDINATOR_URL}/sync_agreements', headers=inject_headers())
+        except Exception as e:
+            print(f"Failed to sync agreements: {e}")
+        coordinator_cache.invalidate('/storage_agreements', params={'user': data.get('wallet_address')})
+    
+    # Create the agreement and store its key; the key transaction has a fixed
+    # gas limit so it is pipelined right behind the agreement transaction
+    job_id = tx_manager.submit([
+        {
+            'name': 'createStorageAgreement',
+            'call': lambda: contract.functions.createStorageAgreement(
+                node_id,
+                int(size_mb),
+                int(duration_days),
+                key_hash
+            ),
+            'tx': {'from': wallet_address, 'value': total_price}
+        },
+        {
+            'name': 'storeEncryptionKey',
+            'call': lambda: contract.functions.storeEncryptionKey(agreement_id, encrypted_key),
+            'tx': {'from': wallet_address},
+            'gas': STORE_KEY_GAS
+        }
+    ], description=f'rent {agreement_id}', on_success=on_confirmed)
+    
+    result = {
+        'status': 'pending',
+        'job_id': job_id,
+        'agreement_id': agreement_id,
+        'encryption_key': encryption_key_b64,  # In a real app, this would be securely transmitted
+        'total_price': total_price
+    }
+    
+    # Callers that still want the old blocking behaviour can ask for it
+    if data.get('wait'):
+        job = tx_manager.wait(job_id, timeout=TX_RECEIPT_TIMEOUT)
+        if job['status'] != 'confirmed':
+            return jsonify({'error': f"Error creating agreement: {job['error']}", 'job_id': job_id}), 500
+        result['status'] = 'success'
+        return jsonify(result), 200
+    
+    return jsonify(result), 202
+
+@app.route('/tx_jobs/<job_id>', methods=['GET'])
+def tx_job_status(job_id):
+    """Status of a background blockchain transaction job"""
+    job = tx_manager.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
 
 @app.route('/upload', methods=['POST'])
+@admission.guard(identity=query_identity)
 def upload_file():
     try:
         # Check if file is in request
@@ -205,42 +507,47 @@ def upload_file():
         owner = request.form.get('owner', 'anonymous')
         encryption = request.form.get('encryption', 'aes')
         agreement_id = request.form.get('agreement_id')  # For rented storage
-        print(f"Owner: {owner}, Encryption: {encryption}, Agreement ID: {agreement_id}")
-        
-        # Save file temporarily
-        temp_path = os.path.join(TEMP_DIR, file.filename)
-        file.save(temp_path)
+        tier = request.form.get('tier')  # 'fast' for latency-sensitive data, 'capacity' for archives
+        try:
+            codec = compression.choose_codec(file.filename, request.form.get('compression', COMPRESSION))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        print(f"Owner: {owner}, Encryption: {encryption}, Agreement ID: {agreement_id}, Compression: {codec}")
         
         # Generate a file ID
         file_id = str(uuid.uuid4())
         
+        # Save file temporarily, under the file ID since names may contain directories
+        read_start = time.perf_counter()
+        temp_path = os.path.join(TEMP_DIR, f'{file_id}.upload')
+        file.save(temp_path)
+        
         # If using rented storage, get storage node information
         if agreement_id:
             # Extract node_id from agreement_id (format is node_id-size_mb)
             node_id = agreement_id.split('-')[0]
             
             # Get node information
-            response = requests.get(f'{COORDINATOR_URL}/all_nodes')
-            node_list = [node for node in response.json() if node['node_id'] == node_id]
+            _, all_nodes = coordinator_cache.get_json('/all_nodes')
+            node_list = [node for node in all_nodes or [] if node['node_id'] == node_id]
             
             if not node_list:
                 return jsonify({'error': f'Storage node {node_id} not found'}), 404
             
             # Get encryption key from blockchain
-            if contract and owner != 'anonymous':
+            if chain.contract and owner != 'anonymous':
                 try:
-                    encrypted_key = contract.functions.getEncryptionKey(agreement_id).call({'from': owner})
-                    key = base64.b64decode(encrypted_key)
+                    with start_span('key.lookup', agreement_id=agreement_id):
+                        key = get_agreement_key(agreement_id, owner)
                     encryption = 'aes'  # Force AES encryption for rented storage
                 except Exception as e:
                     return jsonify({'error': f'Failed to get encryption key: {str(e)}'}), 500
         else:
-            # For regular storage, get available nodes
-            node_list_response = requests.get(f'{COORDINATOR_URL}/available_nodes')
-            if node_list_response.status_code != 200:
+            # For regular storage, get available nodes, those with room on the requested tier first
+            status_code, node_list = coordinator_cache.get_json('/available_nodes', params={'tier': tier} if tier else None)
+            if status_code != 200:
                 return jsonify({'error': 'Failed to get available storage nodes'}), 500
             
-            node_list = node_list_response.json()
             if not node_list:
                 return jsonify({'error': 'No storage nodes available'}), 503
             
@@ -250,59 +557,22 @@ def upload_file():
                 key = generate_encryption_key()
         
         # Split file into chunks
-        chunks = split_file_into_chunks(temp_path)
+        chunks = split_file_into_chunks(temp_path, CHUNK_SIZE)
         file_size = os.path.getsize(temp_path)
+        UPLOAD_STAGES['read'].observe(time.perf_counter() - read_start)
         
         # Upload each chunk to storage nodes
         chunk_metadata = []
         for i, chunk_data in enumerate(chunks):
             # Select a node using round-robin for regular storage, or specific node for rented storage
             node = node_list[i % len(node_list)] if not agreement_id else node_list[0]
-            
-            # Encrypt chunk if required
-            if encryption == 'aes' and key:
-                # Convert chunk to JSON string for encryption
-                encrypted_data = encrypt_data(chunk_data, key)
-                chunk_data = encrypted_data.encode('utf-8')
-                encryption_type = 'aes'
-            else:
-                encryption_type = 'none'
-            
-            # Generate chunk ID
-            chunk_id = hashlib.sha256(chunk_data).hexdigest()
-            
-            # Upload to node
-            headers = {
-                'X-Owner': owner,
-                'X-File-Id': file_id,
-                'X-Encryption': encryption_type
-            }
-            
-            # If using rented storage, add agreement ID header
-            if agreement_id:
-                headers['X-Agreement-Id'] = agreement_id
-            
-            url = f"{node['url']}/store/{chunk_id}"
-            
-            try:
-                response = requests.post(url, data=chunk_data, headers=headers)
-                if response.status_code == 200:
-                    result = response.json()
-                    chunk_metadata.append({
-                        'chunk_id': chunk_id,
-                        'node_id': result['node_id'],
-                        'node_url': node['url'],
-                        'size': len(chunk_data),
-                        'index': i,
-                        'encryption': encryption_type,
-                        'agreement_id': agreement_id
-                    })
-                else:
-                    return jsonify({'error': f'Failed to upload chunk {i} to node {node["node_id"]}'}), 500
-            except Exception as e:
-                return jsonify({'error': f'Error uploading chunk {i}: {str(e)}'}), 500
+            chunk, error = upload_chunk(chunk_data, i, node, file_id, owner, key, encryption, codec,
+                                        agreement_id=agreement_id, tier=tier)
+            if error:
+                return jsonify({'error': error}), 500
+            chunk_metadata.append(chunk)
         
-        # Save file metadata to coordinator
+        # Save file metadata to coordinator, with the chunk list in the compact form
         metadata = {
             'file_id': file_id,
             'filename': file.filename,
@@ -311,14 +581,18 @@ def upload_file():
             'owner': owner,
             'created_at': time.time(),
             'encryption': encryption,
-            'agreement_id': agreement_id
+            'agreement_id': agreement_id,
+            # Root over the chunks' segment roots, checked before any chunk is trusted
+            'merkle_root': merkle_root([bytes.fromhex(c['segment_root']) for c in chunk_metadata]).hex(),
+            'chunk_size': CHUNK_SIZE
         }
         
         # Store the encryption key if used
         if key and not agreement_id:  # For regular storage only
             metadata['key'] = base64.b64encode(key).decode('utf-8')
         
-        response = requests.post(f'{COORDINATOR_URL}/store_file_metadata', json=metadata)
+        with UPLOAD_STAGES['metadata_write'].time():
+            response = shard_router.store_metadata(encode_record(metadata))
         if response.status_code != 200:
             return jsonify({'error': 'Failed to store file metadata'}), 500
         
@@ -329,87 +603,639 @@ def upload_file():
             'status': 'success',
             'file_id': file_id,
             'size': file_size,
-            'chunks': len(chunk_metadata)
+            'chunks': len(chunk_metadata),
+            'stored_bytes': sum(chunk['size'] for chunk in chunk_metadata),
+            'merkle_root': metadata['merkle_root']
         }), 200
     
     except Exception as e:
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/client_config', methods=['GET'])
+def client_config():
+    """Settings SDK clients need to split files the way uploads do"""
+    return jsonify({
+        'chunk_size': CHUNK_SIZE,
+        'segment_size': SEGMENT_SIZE,
+        'compression': COMPRESSION,
+        'direct_transfers': bool(TRANSFER_TOKEN_SECRET)
+    }), 200
+
+def direct_disabled():
+    return jsonify({'error': 'Direct transfers are not enabled, TRANSFER_TOKEN_SECRET is not set'}), 501
+
+@app.route('/direct/upload', methods=['POST'])
+def direct_upload():
+    """Tokens for sending a file's chunks straight to the storage nodes.
+
+    The JSON body has `filename`, `size` and `chunks`, a list of
+    {index, chunk_id} where chunk_id is the SHA-256 of the chunk's bytes,
+    cut at the `chunk_size` of /client_config. Nodes store the bytes as
+    sent, so direct uploads are neither encrypted nor compressed here. Each
+    chunk is POSTed to its `url` with its `headers`; the receipts the nodes
+    answer with go to /direct/upload/<file_id>/complete.
+    """
+    if not TRANSFER_TOKEN_SECRET:
+        return direct_disabled()
+    owner = request.headers.get('X-Owner', 'anonymous')
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data['size'])
+        chunks = sorted(data['chunks'], key=lambda chunk: int(chunk['index']))
+        indexes = [int(chunk['index']) for chunk in chunks]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'filename, size and chunks are required'}), 400
+    if not data.get('filename') or size <= 0 or indexes != list(range(-(-size // CHUNK_SIZE))):
+        return jsonify({'error': f'Expected chunks 0 to n-1 of {CHUNK_SIZE} bytes for a {size} byte file'}), 400
+    if not all(isinstance(chunk.get('chunk_id'), str) and len(chunk['chunk_id']) == 64 for chunk in chunks):
+        return jsonify({'error': 'chunk_id must be the hex SHA-256 of the chunk'}), 400
+    
+    tier = data.get('tier')
+    status_code, node_list = coordinator_cache.get_json('/available_nodes', params={'tier': tier} if tier else None)
+    if status_code != 200:
+        return jsonify({'error': 'Failed to get available storage nodes'}), 500
+    if not node_list:
+        return jsonify({'error': 'No storage nodes available'}), 503
+    
+    # Same placement as /upload; each token is bound to one chunk, node and length
+    file_id = str(uuid.uuid4())
+    grants = []
+    for i, chunk in enumerate(chunks):
+        node = node_list[i % len(node_list)]
+        headers = {'X-Owner': owner}
+        headers.update(transfer_headers(transfer_token.STORE, chunk['chunk_id'], node['node_id'], owner=owner,
+                                        file_id=file_id, max_size=min(CHUNK_SIZE, size - i * CHUNK_SIZE),
+                                        check_hash=True))
+        if tier:
+            headers['X-Tier'] = tier
+        grants.append({
+            'index': i,
+            'chunk_id': chunk['chunk_id'],
+            'node_id': node['node_id'],
+            'url': f"{node['url']}/store/{chunk['chunk_id']}",
+            'headers': headers
+        })
+    direct_tokens.labels('store').inc(len(grants))
+    return jsonify({
+        'file_id': file_id,
+        'chunk_size': CHUNK_SIZE,
+        'expires_at': time.time() + TRANSFER_TOKEN_TTL,
+        'chunks': grants
+    }), 200
+
+@app.route('/direct/upload/<file_id>/complete', methods=['POST'])
+def direct_upload_complete(file_id):
+    """Record a directly uploaded file from the receipts its nodes returned, in chunk order"""
+    if not TRANSFER_TOKEN_SECRET:
+        return direct_disabled()
+    owner = request.headers.get('X-Owner', 'anonymous')
+    data = request.get_json(silent=True) or {}
+    receipts = data.get('receipts') or []
+    try:
+        size = int(data['size'])
+    except (KeyError, TypeError, ValueError):
+        size = -1
+    if not data.get('filename') or size <= 0 or len(receipts) != -(-size // CHUNK_SIZE):
+        return jsonify({'error': 'filename, size and one receipt per chunk are required'}), 400
+    
+    status_code, _ = shard_router.get_metadata(file_id, ttl=0)
+    if status_code == 200:
+        return jsonify({'error': 'File already exists'}), 409
+    
+    _, nodes = coordinator_cache.get_json('/all_nodes')
+    node_urls = {node['node_id']: node['url'] for node in nodes or []}
+    chunks = []
+    for i, receipt in enumerate(receipts):
+        try:
+            claims = transfer_token.verify(TRANSFER_TOKEN_SECRET, receipt, transfer_token.STORED)
+        except TokenError as e:
+            return jsonify({'error': f'Receipt {i}: {e}'}), 403
+        if claims.get('file_id') != file_id or claims.get('owner') != owner:
+            return jsonify({'error': f'Receipt {i} is for another file'}), 403
+        if claims['size'] != min(CHUNK_SIZE, size - i * CHUNK_SIZE):
+            return jsonify({'error': f'Receipt {i} is for a chunk of {claims["size"]} bytes'}), 400
+        if claims['node_id'] not in node_urls:
+            return jsonify({'error': f'Storage node {claims["node_id"]} is not registered'}), 502
+        chunks.append({
+            'chunk_id': claims['chunk_id'],
+            'segment_root': claims['segment_root'],
+            'node_id': claims['node_id'],
+            'node_url': node_urls[claims['node_id']],
+            'size': claims['size'],
+            'index': i,
+            'encryption': 'none',
+            'compression': 'none',
+            'agreement_id': None
+        })
+    
+    metadata = {
+        'file_id': file_id,
+        'filename': data['filename'],
+        'size': size,
+        'chunks': chunks,
+        'owner': owner,
+        'created_at': time.time(),
+        'encryption': 'none',
+        'agreement_id': None,
+        'merkle_root': merkle_root([bytes.fromhex(c['segment_root']) for c in chunks]).hex(),
+        'chunk_size': CHUNK_SIZE
+    }
+    with UPLOAD_STAGES['metadata_write'].time():
+        response = shard_router.store_metadata(encode_record(metadata))
+    if response.status_code != 200:
+        return jsonify({'error': 'Failed to store file metadata'}), 500
+    
+    return jsonify({
+        'status': 'success',
+        'file_id': file_id,
+        'size': size,
+        'chunks': len(chunks),
+        'merkle_root': metadata['merkle_root']
+    }), 200
+
+@app.route('/direct/download/<file_id>', methods=['GET'])
+def direct_download(file_id):
+    """Where to fetch each chunk of an unencrypted file, with tokens to fetch them from the nodes directly"""
+    if not TRANSFER_TOKEN_SECRET:
+        return direct_disabled()
+    status_code, metadata = shard_router.get_metadata(file_id, ttl=METADATA_CACHE_TTL)
+    if status_code != 200:
+        return jsonify({'error': 'File not found'}), 404
+    if metadata.get('encryption', 'none') != 'none':
+        return jsonify({'error': f'Encrypted files are decrypted by the client API, use /download/{file_id}'}), 409
+    
+    chunks = file_chunks(metadata)
+    if not manifest_intact(metadata, chunks):
+        shard_router.invalidate_metadata(file_id)
+        return jsonify({'error': 'Chunk list does not match the file Merkle root'}), 502
+    
+    # Nodes still check rented chunks against the owner named in the token
+    owner = request.headers.get('X-Owner', '')
+    agreement_id = metadata.get('agreement_id')
+    grants = []
+    for chunk in chunks:
+        headers = transfer_headers(transfer_token.RETRIEVE, chunk['chunk_id'], chunk['node_id'],
+                                   owner=owner, agreement_id=agreement_id)
+        grants.append({
+            'index': chunk['index'],
+            'chunk_id': chunk['chunk_id'],
+            'node_id': chunk['node_id'],
+            'url': f"{chunk['node_url']}/retrieve/{chunk['chunk_id']}",
+            'headers': headers,
+            'size': chunk['size'],
+            'segment_root': chunk.get('segment_root'),
+            'compression': chunk.get('compression', 'none')
+        })
+    direct_tokens.labels('retrieve').inc(len(grants))
+    return jsonify({
+        'file_id': file_id,
+        'filename': metadata['filename'],
+        'size': metadata.get('size'),
+        'merkle_root': metadata.get('merkle_root'),
+        'expires_at': time.time() + TRANSFER_TOKEN_TTL,
+        'chunks': grants
+    }), 200
+
+@app.route('/update/<file_id>', methods=['POST'])
+@admission.guard(default_priority=BULK, identity=query_identity)
+def update_file(file_id):
+    """Replace the changed chunks of a stored file in place.
+
+    Form fields `size` and `chunk_count` describe the new file; each changed
+    chunk is sent as a file part named `chunk_<index>` with its plaintext.
+    Chunks that are not sent are kept, chunks past `chunk_count` are dropped.
+    """
+    status_code, metadata = shard_router.get_metadata(file_id, ttl=0)
+    if status_code != 200:
+        return jsonify({'error': 'File not found'}), 404
+    
+    owner = request.headers.get('X-Owner')
+    if metadata['owner'] != 'anonymous' and metadata['owner'] != owner:
+        return jsonify({'error': 'Not authorized to update this file'}), 403
+    if metadata.get('chunk_size') != CHUNK_SIZE:
+        return jsonify({'error': 'File was stored with a different chunk size, upload it again'}), 409
+    
+    try:
+        size = int(request.form['size'])
+        chunk_count = int(request.form['chunk_count'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'size and chunk_count are required'}), 400
+    if size < 0 or chunk_count != -(-size // CHUNK_SIZE):
+        return jsonify({'error': f'chunk_count does not match size for {CHUNK_SIZE} byte chunks'}), 400
+    
+    def chunk_length(index, file_size, count):
+        return CHUNK_SIZE if index < count - 1 else file_size - CHUNK_SIZE * (count - 1)
+    
+    new_data = {}
+    for field, part in request.files.items():
+        try:
+            index = int(field[len('chunk_'):]) if field.startswith('chunk_') else -1
+        except ValueError:
+            index = -1
+        data = part.read()
+        if not 0 <= index < chunk_count or len(data) != chunk_length(index, size, chunk_count):
+            return jsonify({'error': f'Unexpected part {field} of {len(data)} bytes'}), 400
+        new_data[index] = data
+    
+    # A kept chunk must have the same plaintext length as before, so a grown
+    # file has to resend its old partial last chunk
+    old_chunks = file_chunks(metadata)
+    old_size = metadata.get('size') or 0
+    missing = [i for i in range(chunk_count) if i not in new_data and (
+        i >= len(old_chunks) or chunk_length(i, old_size, len(old_chunks)) != chunk_length(i, size, chunk_count))]
+    if missing:
+        return jsonify({'error': 'These chunks must be sent', 'chunks': missing}), 400
+    
+    key, error = file_key(metadata)
+    if error:
+        return error
+    encryption = metadata.get('encryption', 'none')
+    agreement_id = metadata.get('agreement_id')
+    try:
+        codec = compression.choose_codec(metadata['filename'], request.form.get('compression', COMPRESSION))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Rented storage stays on the agreement's node, other chunks go round-robin
+    if agreement_id:
+        node_list = [{'node_id': old_chunks[0]['node_id'], 'url': old_chunks[0]['node_url']}] if old_chunks else []
+    else:
+        status_code, node_list = coordinator_cache.get_json('/available_nodes')
+        if status_code != 200:
+            return jsonify({'error': 'Failed to get available storage nodes'}), 500
+    if new_data and not node_list:
+        return jsonify({'error': 'No storage nodes available'}), 503
+    
+    chunks, uploaded = [], []
+    for i in range(chunk_count):
+        if i not in new_data:
+            chunks.append(old_chunks[i])
+            continue
+        node = node_list[i % len(node_list)]
+        chunk, error = upload_chunk(new_data[i], i, node, file_id, metadata['owner'], key, encryption, codec,
+                                    agreement_id=agreement_id)
+        if error:
+            discard_uploaded(uploaded, metadata['owner'], agreement_id)
+            return jsonify({'error': error}), 500
+        uploaded.append(chunk)
+        chunks.append(chunk)
+    
+    updated = {field: value for field, value in expand_record(metadata).items() if field != 'chunks'}
+    updated.update({
+        'size': size,
+        'chunks': chunks,
+        'merkle_root': merkle_root([bytes.fromhex(c['segment_root']) for c in chunks]).hex()
+    })
+    with UPLOAD_STAGES['metadata_write'].time():
+        response = shard_router.store_metadata(encode_record(updated))
+    if response.status_code != 200:
+        discard_uploaded(uploaded, metadata['owner'], agreement_id)
+        return jsonify({'error': 'Failed to store file metadata'}), 500
+    shard_router.invalidate_metadata(file_id)
+    
+    # Old versions of replaced chunks are only removed once the new metadata
+    # is stored, and only those no clone of the file still uses
+    replaced = response.json().get('released_chunks', [])
+    delete_chunks(replaced, metadata['owner'], agreement_id)
+    
+    return jsonify({
+        'status': 'updated',
+        'file_id': file_id,
+        'size': size,
+        'chunks_uploaded': len(uploaded),
+        'chunks_kept': chunk_count - len(uploaded),
+        'chunks_deleted': len(replaced),
+        'merkle_root': updated['merkle_root']
+    }), 200
+
+def chunk_intact(chunk, data):
+    """Check a chunk payload from a node or the disk cache against its manifest entry"""
+    if chunk.get('segment_root'):
+        return segment_root(data).hex() == chunk['segment_root']
+    # Files uploaded before Merkle manifests: the chunk id is the payload hash
+    return hashlib.sha256(data).hexdigest() == chunk['chunk_id']
+
+def manifest_intact(metadata, chunks):
+    """Check the chunk list against the file's Merkle root, when it has one"""
+    if not metadata.get('merkle_root'):
+        return True
+    if not all(chunk.get('segment_root') for chunk in chunks):
+        return False
+    return merkle_root([bytes.fromhex(chunk['segment_root']) for chunk in chunks]).hex() == metadata['merkle_root']
+
+def file_chunks(metadata):
+    """Chunks in index order, from either metadata schema"""
+    chunks = decode_chunks(metadata)
+    if not is_compact(metadata):
+        chunks = sorted(chunks, key=lambda x: x['index'])
+    return chunks
+
+def chunk_headers(agreement_id):
+    if not agreement_id:
+        return {}
+    return {
+        'X-Agreement-Id': agreement_id,
+        'X-Owner': request.headers.get('X-Owner', '')
+    }
+
+def file_key(metadata):
+    """Return (key, None) for reading a file, or (None, error response)"""
+    if metadata.get('encryption', 'none') != 'aes':
+        return None, None
+    agreement_id = metadata.get('agreement_id')
+    if agreement_id and chain.contract:
+        # Get key from blockchain for rented storage
+        owner = request.headers.get('X-Owner')
+        if not owner:
+            return None, (jsonify({'error': 'Owner address required for encrypted files'}), 400)
+        
+        try:
+            with DOWNLOAD_STAGES['key_lookup'].time(), start_span('key.lookup', agreement_id=agreement_id):
+                return get_agreement_key(agreement_id, owner), None
+        except Exception as e:
+            return None, (jsonify({'error': f'Failed to get encryption key: {str(e)}'}), 500)
+    elif 'key' in metadata:
+        # Get key from metadata for regular storage
+        return base64.b64decode(metadata['key']), None
+    return None, (jsonify({'error': 'Encryption key not found'}), 500)
+
+def load_chunk(chunk, key, encryption, agreement_id, cache_owner):
+    """Return (plaintext, None) for one chunk, or (None, error response).
+
+    Payloads from a node or the disk cache tier are verified against the
+    manifest before they are cached or decrypted.
+    """
+    chunk_id = chunk['chunk_id']
+    node_url = chunk['node_url']
+    
+    chunk_data = chunk_cache.get(chunk_id, cache_owner)
+    if chunk_data is not None:
+        return chunk_data, None
+    
+    chunk_data = chunk_cache.get_raw(chunk_id, cache_owner)
+    if chunk_data is not None:
+        with DOWNLOAD_STAGES['verify'].time():
+            intact = chunk_intact(chunk, chunk_data)
+        if not intact:
+            print(f"Cached payload of chunk {chunk_id} is corrupt, fetching it again")
+            chunk_cache.invalidate(chunk_id)
+            chunk_data = None
+    
+    if chunk_data is None:
+        # Download chunk
+        url = f"{node_url}/retrieve/{chunk_id}"
+        headers = chunk_headers(agreement_id)
+        headers['X-Priority'] = Admission.priority(request.headers.get('X-Priority'), INTERACTIVE)
+        headers.update(transfer_headers(transfer_token.RETRIEVE, chunk_id, chunk['node_id'],
+                                        owner=request.headers.get('X-Owner', ''), agreement_id=agreement_id))
+        transfer_start = time.perf_counter()
+        with start_span('chunk.retrieve', kind='client', node_id=chunk['node_id'],
+                        chunk_id=chunk_id, chunk_index=chunk['index']) as span:
+            try:
+                response = node_request('GET', url, chunk['node_id'], headers=inject_headers(headers))
+            except Exception as e:
+                node_health.record(chunk['node_id'], error=type(e).__name__)
+                return None, (jsonify({'error': f'Failed to download chunk {chunk_id}: {str(e)}'}), 502)
+            if span:
+                span.set_attribute('bytes', len(response.content))
+                if response.status_code != 200:
+                    span.set_error(f'HTTP {response.status_code}')
+        elapsed = time.perf_counter() - transfer_start
+        DOWNLOAD_STAGES['network'].observe(elapsed)
+        chunk_transfer_latency.labels(chunk['node_id'], 'retrieve').observe(elapsed)
+        if response.status_code >= 500 and not node_busy(response):
+            node_health.record(chunk['node_id'], error=f'HTTP {response.status_code}')
+        
+        if response.status_code != 200:
+            if response.status_code < 500 or node_busy(response):
+                node_health.record(chunk['node_id'], elapsed)
+            return None, (jsonify({'error': f'Failed to download chunk {chunk_id}'}), 500)
+        
+        chunk_data = response.content
+        node_bytes.labels(chunk['node_id'], 'in').inc(len(chunk_data))
+        with DOWNLOAD_STAGES['verify'].time():
+            intact = chunk_intact(chunk, chunk_data)
+        if not intact:
+            # A node serving bad data counts against its health like a failed transfer
+            node_health.record(chunk['node_id'], error='integrity')
+            return None, (jsonify({'error': f'Chunk {chunk_id} from node {chunk["node_id"]} failed verification'}), 502)
+        node_health.record(chunk['node_id'], elapsed)
+        chunk_cache.put_raw(chunk_id, chunk_data, cache_owner)
+    
+    # Decrypt if needed
+    if encryption == 'aes' and key:
+        try:
+            # Chunk data is a JSON string
+            with DOWNLOAD_STAGES['decrypt'].time():
+                encrypted_data = chunk_data.decode('utf-8')
+                decrypted_data = decrypt_data(encrypted_data, key)
+            chunk_data = decrypted_data
+        except Exception as e:
+            chunk_cache.invalidate(chunk_id)
+            return None, (jsonify({'error': f'Failed to decrypt chunk: {str(e)}'}), 500)
+    
+    # Undo the compression applied before encryption
+    if chunk.get('compression', 'none') != 'none':
+        try:
+            with DOWNLOAD_STAGES['decompress'].time():
+                chunk_data = compression.decompress(chunk_data, chunk['compression'])
+        except Exception as e:
+            chunk_cache.invalidate(chunk_id)
+            return None, (jsonify({'error': f'Failed to decompress chunk: {str(e)}'}), 500)
+    
+    chunk_cache.put(chunk_id, chunk_data, cache_owner)
+    return chunk_data, None
+
 @app.route('/download/<file_id>', methods=['GET'])
+@admission.guard(default_priority=INTERACTIVE, charge_response=True, identity=query_identity)
 def download_file(file_id):
     # Get file metadata
-    response = requests.get(f'{COORDINATOR_URL}/get_file_metadata/{file_id}')
-    if response.status_code != 200:
+    with DOWNLOAD_STAGES['metadata_read'].time(), start_span('metadata.read', file_id=file_id):
+        status_code, metadata = shard_router.get_metadata(file_id, ttl=METADATA_CACHE_TTL)
+    if status_code != 200:
         return jsonify({'error': 'File not found'}), 404
     
-    metadata = response.json()
     filename = metadata['filename']
-    chunks = metadata['chunks']
     encryption = metadata.get('encryption', 'none')
     agreement_id = metadata.get('agreement_id')
     
-    # Sort chunks by index
-    chunks.sort(key=lambda x: x['index'])
+    chunks = file_chunks(metadata)
+    with DOWNLOAD_STAGES['verify'].time():
+        if not manifest_intact(metadata, chunks):
+            shard_router.invalidate_metadata(file_id)
+            return jsonify({'error': 'Chunk list does not match the file Merkle root'}), 502
     
     # Create temp file to assemble the chunks
-    temp_file = os.path.join(TEMP_DIR, filename)
+    temp_file = os.path.join(TEMP_DIR, f'{file_id}.download')
     
     # Get encryption key
-    key = None
-    if encryption == 'aes':
-        if agreement_id and contract:
-            # Get key from blockchain for rented storage
-            owner = request.headers.get('X-Owner')
-            if not owner:
-                return jsonify({'error': 'Owner address required for encrypted files'}), 400
-            
-            try:
-                encrypted_key = contract.functions.getEncryptionKey(agreement_id).call({'from': owner})
-                key = base64.b64decode(encrypted_key)
-            except Exception as e:
-                return jsonify({'error': f'Failed to get encryption key: {str(e)}'}), 500
-        elif 'key' in metadata:
-            # Get key from metadata for regular storage
-            key = base64.b64decode(metadata['key'])
-        else:
-            return jsonify({'error': 'Encryption key not found'}), 500
+    key, error = file_key(metadata)
+    if error:
+        return error
+    
+    # Chunks in rented storage are only served from cache to the owner the node would accept
+    cache_owner = request.headers.get('X-Owner', '') if agreement_id else None
     
     with open(temp_file, 'wb') as f:
         for chunk in chunks:
-            chunk_id = chunk['chunk_id']
-            node_url = chunk['node_url']
-            
-            # Download chunk
-            headers = {}
-            if agreement_id:
-                headers = {
-                    'X-Agreement-Id': agreement_id,
-                    'X-Owner': request.headers.get('X-Owner', '')
-                }
-            
-            url = f"{node_url}/retrieve/{chunk_id}"
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code != 200:
-                return jsonify({'error': f'Failed to download chunk {chunk_id}'}), 500
-            
-            chunk_data = response.content
-            
-            # Decrypt if needed
-            if encryption == 'aes' and key:
-                try:
-                    # Chunk data is a JSON string
-                    encrypted_data = chunk_data.decode('utf-8')
-                    decrypted_data = decrypt_data(encrypted_data, key)
-                    chunk_data = decrypted_data
-                except Exception as e:
-                    return jsonify({'error': f'Failed to decrypt chunk: {str(e)}'}), 500
+            chunk_data, error = load_chunk(chunk, key, encryption, agreement_id, cache_owner)
+            if error:
+                return error
             
             # Write chunk to file
-            f.write(chunk_data)
+            with DOWNLOAD_STAGES['write'].time():
+                f.write(chunk_data)
     
     # Send the file
-    return send_file(temp_file, as_attachment=True, download_name=filename)
+    return send_file(temp_file, as_attachment=True, download_name=os.path.basename(filename))
+
+def challenge_segments(chunk, indexes, agreement_id):
+    """Fetch segments of a chunk with proofs and check them against its segment root.
+
+    Returns (segments by index, bytes transferred); raises ValueError when
+    a proof does not verify.
+    """
+    segments, transferred = {}, 0
+    expected_root = bytes.fromhex(chunk['segment_root'])
+    for i in range(0, len(indexes), MAX_CHALLENGE_SEGMENTS):
+        batch = indexes[i:i + MAX_CHALLENGE_SEGMENTS]
+        response = requests.get(f"{chunk['node_url']}/challenge/{chunk['chunk_id']}",
+                                params={'segments': ','.join(str(index) for index in batch)},
+                                headers=inject_headers(chunk_headers(agreement_id)),
+                                timeout=node_health.timeouts(chunk['node_id']))
+        transferred += len(response.content)
+        if response.status_code != 200:
+            raise ValueError(f'challenge failed with HTTP {response.status_code}')
+        answer = response.json()
+        for segment in answer['segments']:
+            data = base64.b64decode(segment['data'])
+            if not verify_proof(hashlib.sha256(data).digest(), segment['index'],
+                                answer['segment_count'], segment['proof'], expected_root):
+                raise ValueError(f"segment {segment['index']} does not match the segment root")
+            segments[segment['index']] = data
+    if set(segments) != set(indexes):
+        raise ValueError('node did not answer every challenged segment')
+    return segments, transferred
+
+@app.route('/verify/<file_id>', methods=['GET'])
+@admission.guard(default_priority=BULK, identity=query_identity)
+def verify_file(file_id):
+    """Proof-of-storage check: challenge random segments of each chunk on its node"""
+    status_code, metadata = shard_router.get_metadata(file_id, ttl=METADATA_CACHE_TTL)
+    if status_code != 200:
+        return jsonify({'error': 'File not found'}), 404
+    
+    chunks = file_chunks(metadata)
+    if not metadata.get('merkle_root'):
+        return jsonify({'error': 'File was uploaded without a Merkle manifest'}), 409
+    if not manifest_intact(metadata, chunks):
+        return jsonify({'error': 'Chunk list does not match the file Merkle root'}), 502
+    
+    samples = request.args.get('samples', VERIFY_SAMPLES, type=int)
+    # Optionally check a random subset of the chunks only
+    max_chunks = request.args.get('chunks', type=int)
+    if max_chunks and max_chunks < len(chunks):
+        chunks = random.sample(chunks, max_chunks)
+    agreement_id = metadata.get('agreement_id')
+    
+    def check(chunk):
+        segment_count = max(1, -(-chunk['size'] // SEGMENT_SIZE))
+        indexes = sorted(random.sample(range(segment_count), min(samples, segment_count)))
+        try:
+            _, transferred = challenge_segments(chunk, indexes, agreement_id)
+            return chunk, len(indexes), transferred, None
+        except Exception as e:
+            node_health.record(chunk['node_id'], error='challenge')
+            return chunk, len(indexes), 0, str(e)
+    
+    failures, segments_checked, transferred = [], 0, 0
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+        for chunk, count, chunk_bytes, error in pool.map(check, chunks):
+            segments_checked += count
+            transferred += chunk_bytes
+            if error:
+                failures.append({'chunk_id': chunk['chunk_id'], 'index': chunk['index'],
+                                 'node_id': chunk['node_id'], 'error': error})
+    
+    return jsonify({
+        'file_id': file_id,
+        'merkle_root': metadata['merkle_root'],
+        'status': 'failed' if failures else 'verified',
+        'chunks_checked': len(chunks),
+        'segments_checked': segments_checked,
+        'bytes_transferred': transferred,
+        'failures': failures
+    }), 200
+
+@app.route('/download_range/<file_id>', methods=['GET'])
+@admission.guard(default_priority=INTERACTIVE, charge_response=True, identity=query_identity)
+def download_range(file_id):
+    """Verified partial read of `length` bytes at `offset` of a file"""
+    offset = request.args.get('offset', 0, type=int)
+    length = request.args.get('length', type=int)
+    if offset < 0 or not length or length < 0:
+        return jsonify({'error': 'offset and a positive length are required'}), 400
+    
+    status_code, metadata = shard_router.get_metadata(file_id, ttl=METADATA_CACHE_TTL)
+    if status_code != 200:
+        return jsonify({'error': 'File not found'}), 404
+    
+    chunks = file_chunks(metadata)
+    if not manifest_intact(metadata, chunks):
+        shard_router.invalidate_metadata(file_id)
+        return jsonify({'error': 'Chunk list does not match the file Merkle root'}), 502
+    end = min(offset + length, metadata.get('size') or 0)
+    if offset >= end:
+        return app.response_class(b'', mimetype='application/octet-stream')
+    
+    encryption = metadata.get('encryption', 'none')
+    agreement_id = metadata.get('agreement_id')
+    parts = []
+    
+    compressed = any(chunk.get('compression', 'none') != 'none' for chunk in chunks)
+    if encryption != 'aes' and not compressed and metadata.get('merkle_root'):
+        # Stored bytes are the plaintext: fetch only the covering segments, each with its proof
+        chunk_start = 0
+        for chunk in chunks:
+            chunk_end = chunk_start + chunk['size']
+            if chunk_end > offset and chunk_start < end:
+                first = (max(offset, chunk_start) - chunk_start) // SEGMENT_SIZE
+                last = (min(end, chunk_end) - chunk_start - 1) // SEGMENT_SIZE
+                try:
+                    segments, _ = challenge_segments(chunk, list(range(first, last + 1)), agreement_id)
+                except Exception as e:
+                    node_health.record(chunk['node_id'], error='challenge')
+                    return jsonify({'error': f"Chunk {chunk['chunk_id']} failed verification: {e}"}), 502
+                data = b''.join(segments[i] for i in range(first, last + 1))
+                base = chunk_start + first * SEGMENT_SIZE
+                parts.append(data[max(offset, base) - base:end - base])
+            chunk_start = chunk_end
+    else:
+        # Encrypted or compressed chunks are verified and decoded whole, then sliced
+        key, error = file_key(metadata)
+        if error:
+            return error
+        cache_owner = request.headers.get('X-Owner', '') if agreement_id else None
+        plain_size = metadata.get('chunk_size')
+        chunk_start = 0
+        for chunk in chunks:
+            if chunk_start >= end:
+                break
+            if plain_size and chunk_start + plain_size <= offset:
+                # Plaintext chunk boundaries are known, skip without reading
+                chunk_start += plain_size
+                continue
+            chunk_data, error = load_chunk(chunk, key, encryption, agreement_id, cache_owner)
+            if error:
+                return error
+            chunk_end = chunk_start + len(chunk_data)
+            if chunk_end > offset:
+                parts.append(chunk_data[max(offset, chunk_start) - chunk_start:end - chunk_start])
+            chunk_start = chunk_end
+    
+    response = app.response_class(b''.join(parts), mimetype='application/octet-stream')
+    response.headers['Content-Range'] = f"bytes {offset}-{end - 1}/{metadata.get('size')}"
+    return response
 
 @app.route('/list_files', methods=['GET'])
 def list_files():
@@ -417,22 +1243,20 @@ def list_files():
     owner = request.args.get('owner')
     agreement_id = request.args.get('agreement_id')
     
-    # Call coordinator to list files
-    url = f'{COORDINATOR_URL}/list_files'
-    params = {}
-    
-    if owner:
-        params['owner'] = owner
-    
-    response = requests.get(url, params=params)
-    if response.status_code != 200:
+    # Ask the coordinator shards for the files
+    status_code, files = shard_router.list_files(owner=owner)
+    if status_code != 200:
         return jsonify({'error': 'Failed to list files'}), 500
     
-    files = response.json()
+    # Callers get the chunk list in the original schema
+    files = [expand_record(file) for file in files]
     
-    # Filter by agreement_id if provided
+    # Filter by agreement_id or snapshot_id if provided
     if agreement_id:
         files = [file for file in files if file.get('agreement_id') == agreement_id]
+    snapshot_id = request.args.get('snapshot_id')
+    if snapshot_id:
+        files = [file for file in files if file.get('snapshot_id') == snapshot_id]
     
     # Remove sensitive info like encryption keys
     for file in files:
@@ -444,11 +1268,10 @@ def list_files():
 @app.route('/delete/<file_id>', methods=['DELETE'])
 def delete_file(file_id):
     # Get file metadata
-    response = requests.get(f'{COORDINATOR_URL}/get_file_metadata/{file_id}')
-    if response.status_code != 200:
+    status_code, metadata = shard_router.get_metadata(file_id, ttl=METADATA_CACHE_TTL)
+    if status_code != 200:
         return jsonify({'error': 'File not found'}), 404
     
-    metadata = response.json()
     
     # Check authorization
     owner = request.headers.get('X-Owner')
@@ -458,28 +1281,58 @@ def delete_file(file_id):
     # Get agreement ID if exists
     agreement_id = metadata.get('agreement_id')
     
-    # Delete each chunk from storage nodes
-    chunks = metadata['chunks']
-    for chunk in chunks:
-        chunk_id = chunk['chunk_id']
-        node_url = chunk['node_url']
-        
-        # Delete chunk
-        headers = {'X-Owner': owner}
-        if agreement_id:
-            headers['X-Agreement-Id'] = agreement_id
-        
-        url = f"{node_url}/delete/{chunk_id}"
-        response = requests.delete(url, headers=headers)
-        if response.status_code != 200:
-            print(f"Failed to delete chunk {chunk_id}: {response.text}")
-    
     # Delete file metadata from coordinator
-    response = requests.delete(f'{COORDINATOR_URL}/delete_file_metadata/{file_id}', headers={'X-Owner': owner})
+    response = shard_router.delete_metadata(file_id, owner)
     if response.status_code != 200:
         return jsonify({'error': 'Failed to delete file metadata'}), 500
     
-    return jsonify({'status': 'deleted', 'file_id': file_id}), 200
+    # Delete the chunks whose last reference went with the file; clones keep the rest
+    released = response.json().get('released_chunks', [])
+    delete_chunks(released, owner, agreement_id)
+    
+    return jsonify({'status': 'deleted', 'file_id': file_id, 'chunks_deleted': len(released)}), 200
+
+@app.route('/clone/<file_id>', methods=['POST'])
+def clone_file(file_id):
+    """Copy a file by sharing its chunks, no chunk is downloaded or uploaded"""
+    owner = request.headers.get('X-Owner')
+    filename = (request.get_json(silent=True) or {}).get('filename') or request.form.get('filename')
+    response = shard_router.clone_file(file_id, owner, filename)
+    if response.status_code != 200:
+        return jsonify({'error': response.json().get('error', 'Failed to clone file')}), response.status_code
+    return jsonify(response.json()), 200
+
+@app.route('/snapshot', methods=['POST'])
+def snapshot_files():
+    """Clone a set of files under one snapshot id, listed with /list_files?snapshot_id="""
+    owner = request.headers.get('X-Owner')
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('file_ids') or []
+    if not file_ids:
+        return jsonify({'error': 'file_ids required'}), 400
+    status_code, result = shard_router.snapshot(file_ids, owner, str(uuid.uuid4()), label=data.get('label'))
+    if status_code != 200:
+        return jsonify({'error': 'Failed to create snapshot'}), 500
+    return jsonify(result), 200
+
+@app.route('/chain_status', methods=['GET'])
+def chain_status():
+    """Chain connection state from the background checks, without touching the chain"""
+    return jsonify(chain.status()), 200
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss and size statistics for the client-side caches"""
+    return jsonify({
+        'chunks': chunk_cache.stats(),
+        'coordinator': coordinator_cache.stats(),
+        'keys': key_cache.stats()
+    }), 200
+
+@app.route('/admission_status', methods=['GET'])
+def admission_status():
+    """Transfers in flight and queued, and requests turned away so far"""
+    return jsonify(admission.status()), 200
 
 @app.route('/user_agreements', methods=['GET'])
 def user_agreements():
@@ -489,15 +1342,30 @@ def user_agreements():
     if not wallet_address:
         return jsonify({'error': 'Wallet address is required'}), 400
     
+    # Served from the coordinator's agreement index when it is available
+    status_code, agreements = coordinator_cache.get_json('/storage_agreements', params={'user': wallet_address})
+    if status_code == 200:
+        return jsonify([{
+            'node_id': agreement['node_id'],
+            'size_mb': agreement['size_mb'],
+            'duration_days': agreement['duration_days'],
+            'total_price': agreement['total_price'],
+            'start_time': agreement['start_time'],
+            'active': agreement['active'],
+            'agreement_id': agreement['agreement_id']
+        } for agreement in agreements]), 200
+    
+    contract = chain.contract
     if not contract:
         return jsonify({'error': 'Smart contract not available'}), 500
     
     try:
         # Convert wallet address to checksum format
-        wallet_address = Web3.to_checksum_address(wallet_address)
+        wallet_address = checksum_address(wallet_address)
         
-        # Call contract to get user agreements
-        agreements = contract.functions.getUserAgreements().call({'from': wallet_address})
+        # Fall back to asking the contract directly
+        with timed_chain_call('getUserAgreements'):
+            agreements = contract.functions.getUserAgreements().call({'from': wallet_address})
         
         return jsonify([{
             'node_id': agreement[1],
@@ -512,5 +1380,8 @@ def user_agreements():
     except Exception as e:
         return jsonify({'error': f'Error getting agreements: {str(e)}'}), 500
 
+startup.mark('routes')
+startup.report()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""Blockchain client created on first use.
+
+Importing web3 and building the contract object take a noticeable share of
+service startup, and none of it is needed to serve chunks or metadata.
+ChainClient reads only the contract address at construction and creates
+the Web3 provider and contract when a call first needs them. A background
+monitor checks the connection, so status pages can show the chain is down
+without a request waiting on a timeout.
+"""
+import os
+import json
+import time
+import threading
+
+
+def checksum_address(address):
+    """EIP-55 form of an address, without importing web3"""
+    from eth_utils import to_checksum_address
+    return to_checksum_address(address)
+
+
+class ChainClient:
+    """Lazily created Web3 connection and contract handle"""
+
+    def __init__(self, url, abi_path=None, address_file=None, timeout=10):
+        self.url = url
+        self.abi_path = abi_path
+        self.timeout = timeout
+        self.address = ''
+        self._abi = None
+        self._web3 = None
+        self._contract = None
+        self._load_failed = False
+        self._lock = threading.RLock()
+        self.connected = None
+        self._checks = {'last_check_at': None, 'latency_ms': None, 'block_number': None, 'init_seconds': None}
+        if address_file and os.path.exists(address_file):
+            try:
+                with open(address_file, 'r') as f:
+                    self.address = f.read().strip()
+                print(f"Loaded contract address: {self.address}")
+            except Exception as e:
+                print(f"Error reading contract address: {e}")
+
+    @property
+    def web3(self):
+        if self._web3 is None:
+            with self._lock:
+                if self._web3 is None:
+                    started = time.perf_counter()
+                    from web3 import Web3
+                    self._web3 = Web3(Web3.HTTPProvider(self.url, request_kwargs={'timeout': self.timeout}))
+                    self._checks['init_seconds'] = round(time.perf_counter() - started, 4)
+                    print(f"Chain client for {self.url} created in {self._checks['init_seconds']}s")
+        return self._web3
+
+    @property
+    def configured(self):
+        """Whether a contract address and ABI are known, checked without loading web3"""
+        return bool(self.address) and (self._abi is not None or bool(self.abi_path and os.path.exists(self.abi_path)))
+
+    @property
+    def contract(self):
+        """Contract handle, or None without an address and ABI or when it fails to load"""
+        if self._contract is None and not self._load_failed and self.configured:
+            with self._lock:
+                if self._contract is None and not self._load_failed:
+                    try:
+                        abi = self._abi
+                        if abi is None:
+                            with open(self.abi_path, 'r') as f:
+                                abi = json.load(f)
+                        self._contract = self.web3.eth.contract(address=self.address, abi=abi)
+                        print(f"Contract loaded successfully at address {self.address}")
+                    except Exception as e:
+                        self._load_failed = True
+                        print(f"Error loading contract: {e}")
+        return self._contract
+
+    def set_contract(self, address, abi):
+        """Switch to another deployment; the contract is rebuilt on next use"""
+        with self._lock:
+            self.address = address
+            self._abi = abi
+            self._contract = None
+            self._load_failed = False
+
+    def check(self):
+        """Probe the chain once, return whether it answered"""
+        started = time.perf_counter()
+        try:
+            block_number = self.web3.eth.block_number
+            connected = True
+        except Exception:
+            block_number = None
+            connected = False
+        if connected != self.connected:
+            print(f"Chain at {self.url} is {'reachable' if connected else 'unreachable'}")
+        self.connected = connected
+        self._checks.update({
+            'last_check_at': time.time(),
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+            'block_number': block_number
+        })
+        return connected
+
+    def start_monitor(self, interval):
+        """Check the connection every `interval` seconds in the background, starting now"""
+        if interval <= 0:
+            return
+
+        def run():
+            while True:
+                self.check()
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def status(self):
+        status = {
+            'url': self.url,
+            'contract_address': self.address,
+            'configured': self.configured,
+            'loaded': self._web3 is not None,
+            'connected': self.connected
+        }
+        status.update(self._checks)
+        return status
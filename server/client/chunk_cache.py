@@ -0,0 +1,181 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+class ChunkCache:
+    """Size-bounded LRU cache of chunks keyed by chunk_id.
+
+    The memory tier holds decrypted chunk data. The optional disk tier only
+    ever holds the payload exactly as returned by the storage node (ciphertext
+    for encrypted chunks), so plaintext of encrypted files never touches disk.
+
+    Every entry records the owner it was fetched for. Entries fetched without
+    an owner (regular storage) are served to anyone, mirroring the storage
+    node's `/retrieve`; entries for rented storage are only served back to the
+    same owner.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes if disk_dir else 0
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+
+        # chunk_id -> (data, owner)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+        # chunk_id -> (size, owner)
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+
+        self._stats = {
+            'memory_hits': 0,
+            'memory_misses': 0,
+            'disk_hits': 0,
+            'disk_misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'denied': 0
+        }
+
+        if self.max_disk_bytes > 0:
+            # The disk index is not persisted, so start from an empty directory
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _allowed(entry_owner, owner):
+        return entry_owner is None or entry_owner == owner
+
+    def get(self, chunk_id, owner=None):
+        """Return decrypted chunk data from the memory tier, or None"""
+        with self._lock:
+            entry = self._memory.get(chunk_id)
+            if entry is None:
+                self._stats['memory_misses'] += 1
+                return None
+            data, entry_owner = entry
+            if not self._allowed(entry_owner, owner):
+                self._stats['denied'] += 1
+                self._stats['memory_misses'] += 1
+                return None
+            self._memory.move_to_end(chunk_id)
+            self._stats['memory_hits'] += 1
+            return data
+
+    def put(self, chunk_id, data, owner=None):
+        """Add decrypted chunk data to the memory tier"""
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(chunk_id, None)
+            if old is not None:
+                self._memory_bytes -= len(old[0])
+            self._memory[chunk_id] = (data, owner)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes:
+                _, (evicted, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def _disk_path(self, chunk_id):
+        return os.path.join(self.disk_dir, chunk_id)
+
+    def get_raw(self, chunk_id, owner=None):
+        """Return the node payload for a chunk from the disk tier, or None"""
+        if self.max_disk_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._disk.get(chunk_id)
+            if entry is None or not self._allowed(entry[1], owner):
+                if entry is not None:
+                    self._stats['denied'] += 1
+                self._stats['disk_misses'] += 1
+                return None
+            self._disk.move_to_end(chunk_id)
+        try:
+            with open(self._disk_path(chunk_id), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self._drop_disk(chunk_id)
+            with self._lock:
+                self._stats['disk_misses'] += 1
+            return None
+        with self._lock:
+            self._stats['disk_hits'] += 1
+        return data
+
+    def put_raw(self, chunk_id, data, owner=None):
+        """Add a node payload to the disk tier"""
+        size = len(data)
+        if size > self.max_disk_bytes:
+            return
+        path = self._disk_path(chunk_id)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing chunk {chunk_id} to disk cache: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            old = self._disk.pop(chunk_id, None)
+            if old is not None:
+                self._disk_bytes -= old[0]
+            self._disk[chunk_id] = (size, owner)
+            self._disk_bytes += size
+            while self._disk_bytes > self.max_disk_bytes:
+                old_id, (old_size, _) = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                self._stats['evictions'] += 1
+                evicted.append(old_id)
+        for old_id in evicted:
+            try:
+                os.remove(self._disk_path(old_id))
+            except OSError:
+                pass
+
+    def _drop_disk(self, chunk_id):
+        with self._lock:
+            entry = self._disk.pop(chunk_id, None)
+            if entry is None:
+                return False
+            self._disk_bytes -= entry[0]
+        try:
+            os.remove(self._disk_path(chunk_id))
+        except OSError:
+            pass
+        return True
+
+    def invalidate(self, chunk_id):
+        """Drop a chunk from both tiers"""
+        with self._lock:
+            entry = self._memory.pop(chunk_id, None)
+            if entry is not None:
+                self._memory_bytes -= len(entry[0])
+                self._stats['invalidations'] += 1
+        if self._drop_disk(chunk_id) and entry is None:
+            with self._lock:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_limit_bytes': self.max_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'disk_limit_bytes': self.max_disk_bytes
+            })
+        lookups = stats['memory_hits'] + stats['memory_misses']
+        stats['memory_hit_rate'] = round(stats['memory_hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,96 @@
+"""Per-chunk compression applied before encryption.
+
+Ciphertext does not compress, so chunks are compressed while still plain.
+Files whose extension marks them as already compressed are skipped, and so
+is any chunk whose sampled byte entropy is close to random or that does not
+shrink by at least MIN_SAVING. The codec actually used is recorded per chunk
+so downloads know how to undo it.
+"""
+import math
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+NONE = 'none'
+CODECS = ('zstd', 'zlib')
+SAMPLE_SIZE = 4096
+MAX_ENTROPY = 7.5  # bits per byte above which a sample is treated as incompressible
+MIN_SAVING = 0.05
+
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v',
+    '.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.br', '.lz4',
+    '.docx', '.xlsx', '.pptx', '.odt', '.jar', '.apk', '.whl', '.parquet'
+}
+
+
+def available(codec):
+    return codec == 'zlib' or (codec == 'zstd' and zstandard is not None)
+
+
+def choose_codec(filename, requested='auto'):
+    """Codec to try for a file's chunks, or None to store them as they are"""
+    requested = (requested or 'auto').lower()
+    if requested == NONE:
+        return None
+    if os.path.splitext(filename or '')[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    if requested == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if requested not in CODECS:
+        raise ValueError(f'Unknown compression codec {requested}')
+    if not available(requested):
+        # Fall back rather than fail when the optional library is missing
+        return 'zlib'
+    return requested
+
+
+def _entropy(sample):
+    counts = [0] * 256
+    for byte in sample:
+        counts[byte] += 1
+    total = len(sample)
+    return -sum(c / total * math.log2(c / total) for c in counts if c)
+
+
+def looks_compressible(data):
+    """Entropy of samples from the start, middle and end of the data"""
+    if not data:
+        return False
+    if len(data) <= SAMPLE_SIZE:
+        samples = [data]
+    else:
+        middle = (len(data) - SAMPLE_SIZE) // 2
+        samples = [data[:SAMPLE_SIZE], data[middle:middle + SAMPLE_SIZE], data[-SAMPLE_SIZE:]]
+    return min(_entropy(sample) for sample in samples) < MAX_ENTROPY
+
+
+def compress(data, codec, level):
+    """Return (codec used, payload), falling back to 'none' when it does not pay off"""
+    if codec is None or not looks_compressible(data):
+        return NONE, data
+    if codec == 'zstd':
+        payload = zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        payload = zlib.compress(data, min(level, 9))
+    if len(payload) > len(data) * (1 - MIN_SAVING):
+        return NONE, data
+    return codec, payload
+
+
+def decompress(data, codec):
+    if not codec or codec == NONE:
+        return data
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read this chunk')
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'Unknown compression codec {codec}')
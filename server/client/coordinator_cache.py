@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+import requests
+import metadata_codec
+
+
+class CoordinatorCache:
+    """Short-TTL cache of coordinator GET responses.
+
+    Fresh entries are served without contacting the coordinator. Once an entry
+    is older than its TTL it is revalidated with If-None-Match, so an unchanged
+    resource costs a 304 with no body instead of a full listing.
+
+    At most `max_entries` responses are kept, least recently used first out,
+    and one not fetched or revalidated for `max_age` seconds is dropped.
+    Returned objects are shared between requests and must not be mutated.
+    When MessagePack is installed it is requested for the compact metadata
+    the coordinator can send that way.
+    """
+
+    def __init__(self, base_url, default_ttl=2.0, header_hook=None, max_entries=4096, max_age=300.0):
+        self.base_url = base_url
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_age = max_age
+        # Optional callable that decorates outgoing headers (e.g. trace context)
+        self.header_hook = header_hook
+        self._lock = threading.Lock()
+        # (base_url, path, params) -> {'etag': ..., 'data': ..., 'fetched_at': ...}
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evictions': 0}
+
+    def _key(self, path, params, base_url):
+        return (base_url or self.base_url, path, tuple(sorted((params or {}).items())))
+
+    def get_json(self, path, params=None, ttl=None, base_url=None):
+        """Return (status_code, data) for a GET on the coordinator, or on another shard"""
+        ttl = self.default_ttl if ttl is None else ttl
+        key = self._key(path, params, base_url)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry['fetched_at'] >= max(self.max_age, ttl):
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                if now - entry['fetched_at'] < ttl:
+                    self._stats['hits'] += 1
+                    return 200, entry['data']
+
+        headers = {}
+        if metadata_codec.msgpack is not None:
+            headers['Accept'] = f'{metadata_codec.MSGPACK_TYPE}, application/json;q=0.9'
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+
+        if self.header_hook:
+            headers = self.header_hook(headers)
+        response = requests.get(f'{base_url or self.base_url}{path}', params=params, headers=headers)
+
+        with self._lock:
+            if response.status_code == 304 and entry:
+                entry['fetched_at'] = time.time()
+                self._stats['revalidated'] += 1
+                return 200, entry['data']
+
+            self._stats['misses'] += 1
+            if response.status_code != 200:
+                self._entries.pop(key, None)
+                return response.status_code, None
+
+            if response.headers.get('Content-Type', '').startswith(metadata_codec.MSGPACK_TYPE):
+                data = metadata_codec.unpack(response.content)
+            else:
+                data = response.json()
+            self._entries[key] = {
+                'etag': response.headers.get('ETag'),
+                'data': data,
+                'fetched_at': time.time()
+            }
+            self._entries.move_to_end(key)
+            self._evict()
+            return 200, data
+
+    def _evict(self):
+        # Least recently used first; expired entries mostly sit at that end too
+        now = time.time()
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_entries and now - entry['fetched_at'] < self.max_age:
+                break
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, path, params=None, base_url=None):
+        with self._lock:
+            self._entries.pop(self._key(path, params, base_url), None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
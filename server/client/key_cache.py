@@ -0,0 +1,115 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class EncryptionKeyCache:
+    """Bounded in-memory cache of agreement encryption keys.
+
+    Entries are keyed by (agreement_id, owner) because the contract only
+    releases a key to the wallet that holds the agreement. Keys live in
+    process memory only and are never persisted.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (agreement_id, owner_lower) -> {'key': ..., 'owner': ..., 'expires_at': ...}
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'refreshes': 0}
+        self._agreement_versions = None
+        self._thread = None
+
+    @staticmethod
+    def _key(agreement_id, owner):
+        return (agreement_id, (owner or '').lower())
+
+    def get(self, agreement_id, owner):
+        with self._lock:
+            entry = self._entries.get(self._key(agreement_id, owner))
+            if entry is None or entry['expires_at'] < time.time():
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(self._key(agreement_id, owner))
+            self._stats['hits'] += 1
+            return entry['key']
+
+    def put(self, agreement_id, owner, key):
+        if not key:
+            return
+        with self._lock:
+            cache_key = self._key(agreement_id, owner)
+            self._entries[cache_key] = {
+                'key': key,
+                'owner': owner,
+                'expires_at': time.time() + self.ttl
+            }
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, agreement_id, owner=None):
+        """Drop the key cached for one owner, or for every owner of the agreement"""
+        with self._lock:
+            if owner is not None:
+                removed = self._entries.pop(self._key(agreement_id, owner), None) is not None
+                self._stats['invalidations'] += int(removed)
+                return
+            for cache_key in [k for k in self._entries if k[0] == agreement_id]:
+                del self._entries[cache_key]
+                self._stats['invalidations'] += 1
+
+    def refresh_changed(self, agreements, fetch_key):
+        """Re-fetch cached keys whose agreement changed since the last call.
+
+        `agreements` is the current agreement listing (with `updated_block`
+        and `user`), `fetch_key(agreement_id, owner)` reads a key from chain.
+        """
+        versions = {
+            a['agreement_id']: (a.get('updated_block'), (a.get('user') or '').lower())
+            for a in agreements
+        }
+        previous, self._agreement_versions = self._agreement_versions, versions
+        if previous is None:
+            return
+
+        with self._lock:
+            stale = [
+                (cache_key, entry['owner']) for cache_key, entry in self._entries.items()
+                if versions.get(cache_key[0]) != previous.get(cache_key[0])
+            ]
+        for (agreement_id, _), owner in stale:
+            self.invalidate(agreement_id, owner)
+            if agreement_id not in versions:
+                continue
+            try:
+                self.put(agreement_id, owner, fetch_key(agreement_id, owner))
+                with self._lock:
+                    self._stats['refreshes'] += 1
+            except Exception as e:
+                print(f"Failed to refresh key for agreement {agreement_id}: {e}")
+
+    def start_refresher(self, list_agreements, fetch_key, interval):
+        """Poll agreement changes in the background and refresh affected keys"""
+        if interval <= 0 or self._thread:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    agreements = list_agreements()
+                    if agreements is not None:
+                        self.refresh_changed(agreements, fetch_key)
+                except Exception as e:
+                    print(f"Key cache refresh failed: {e}")
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
@@ -0,0 +1,81 @@
+"""Merkle trees over chunk segments and over the chunks of a file.
+
+Each stored chunk is cut into SEGMENT_SIZE segments whose SHA-256 hashes
+are the leaves of the chunk's segment tree; the root of that tree is the
+chunk's `segment_root`. The segment roots of a file's chunks, in order,
+are the leaves of the file tree whose root is the file's `merkle_root`.
+Leaves and inner nodes are hashed with different prefixes so an inner node
+can never be passed off as a leaf.
+
+A segment can be checked against a chunk's segment root with a proof of
+log2(segments) sibling hashes, which is what storage challenges and
+partial reads use instead of transferring whole chunks.
+"""
+import hashlib
+
+SEGMENT_SIZE = 4096
+
+
+def _leaf(digest):
+    return hashlib.sha256(b'\x00' + digest).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def segment_hashes(data, segment_size=SEGMENT_SIZE):
+    view = memoryview(data)
+    return [hashlib.sha256(view[i:i + segment_size]).digest()
+            for i in range(0, max(len(data), 1), segment_size)]
+
+
+def tree_levels(leaves):
+    """All levels of the tree from the hashed leaves up to the root"""
+    level = [_leaf(leaf) for leaf in leaves] or [_leaf(hashlib.sha256(b'').digest())]
+    levels = [level]
+    while len(level) > 1:
+        # An odd node out is carried up unchanged
+        level = [_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def merkle_root(leaves):
+    return tree_levels(leaves)[-1][0]
+
+
+def segment_root(data):
+    return merkle_root(segment_hashes(data))
+
+
+def merkle_proof(levels, index):
+    """Sibling hashes from a leaf to the root as [hex, side] pairs"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append([level[sibling].hex(), 'L' if sibling < index else 'R'])
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf, index, leaf_count, proof, root):
+    """Check that `leaf` (an unhashed leaf digest) is leaf `index` of the tree under `root`"""
+    current = _leaf(leaf)
+    steps = list(proof)
+    width = leaf_count
+    while width > 1:
+        sibling = index ^ 1
+        if sibling < width:
+            if not steps:
+                return False
+            sibling_hex, side = steps.pop(0)
+            if side != ('L' if sibling < index else 'R'):
+                return False
+            sibling_hash = bytes.fromhex(sibling_hex)
+            current = _node(sibling_hash, current) if side == 'L' else _node(current, sibling_hash)
+        index //= 2
+        width = (width + 1) // 2
+    return not steps and current == root
@@ -0,0 +1,167 @@
+"""Compact encoding of the chunk list in file metadata.
+
+The original schema stores one dict per chunk repeating the node URL, node
+id, encryption, agreement id and a 64-character hex chunk id. The compact
+form (`chunk_format` 2) keeps:
+
+- `nodes`: a per-file table of [node_id, node_url], referenced by position
+  from `chunk_nodes`
+- `chunk_digests`: hex digest fields (chunk_id, segment_root) packed as raw
+  32-byte digests, base64 encoded in JSON and raw bytes in MessagePack
+- `chunk_defaults`: fields with the same value in every chunk, hoisted to
+  the file; `chunk_last` overrides the last chunk when only it differs (the
+  usual case for `size`)
+- `chunk_columns`: any remaining per-chunk values, one list per field
+
+Chunk order is the list order, so `index` is implicit. Records in the
+original schema are decoded transparently.
+"""
+import base64
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional, JSON is always available
+    msgpack = None
+
+CHUNK_FORMAT = 2
+MSGPACK_TYPE = 'application/msgpack'
+DIGEST_FIELDS = ('chunk_id', 'segment_root')
+DIGEST_BYTES = 32
+COMPACT_FIELDS = ('chunk_format', 'chunk_count', 'nodes', 'chunk_nodes', 'chunk_digests',
+                  'chunk_defaults', 'chunk_last', 'chunk_columns')
+
+
+def is_compact(record):
+    return record.get('chunk_format') == CHUNK_FORMAT
+
+
+def _uniform(values):
+    first = values[0]
+    return all(value == first for value in values)
+
+
+def encode_chunks(chunks):
+    """Compact fields for a list of chunk dicts in the original schema"""
+    chunks = sorted(chunks, key=lambda chunk: chunk['index'])
+    count = len(chunks)
+    encoded = {'chunk_format': CHUNK_FORMAT, 'chunk_count': count}
+
+    node_table = {}
+    chunk_nodes = []
+    for chunk in chunks:
+        node = (chunk['node_id'], chunk['node_url'])
+        chunk_nodes.append(node_table.setdefault(node, len(node_table)))
+    encoded['nodes'] = [list(node) for node in node_table]
+    encoded['chunk_nodes'] = chunk_nodes
+
+    digests = {}
+    for field in DIGEST_FIELDS:
+        if count and all(len(chunk.get(field) or '') == 2 * DIGEST_BYTES for chunk in chunks):
+            raw = b''.join(bytes.fromhex(chunk[field]) for chunk in chunks)
+            digests[field] = base64.b64encode(raw).decode('ascii')
+    encoded['chunk_digests'] = digests
+
+    defaults, last, columns = {}, {}, {}
+    skip = {'node_id', 'node_url', 'index'} | set(digests)
+    fields = []
+    for chunk in chunks:
+        fields.extend(field for field in chunk if field not in skip and field not in fields)
+    for field in fields:
+        values = [chunk.get(field) for chunk in chunks]
+        if _uniform(values):
+            defaults[field] = values[0]
+        elif count > 1 and _uniform(values[:-1]):
+            defaults[field] = values[0]
+            last[field] = values[-1]
+        else:
+            columns[field] = values
+    encoded['chunk_defaults'] = defaults
+    encoded['chunk_last'] = last
+    encoded['chunk_columns'] = columns
+
+    if any(chunk['index'] != i for i, chunk in enumerate(chunks)):
+        columns['index'] = [chunk['index'] for chunk in chunks]
+    return encoded
+
+
+def decode_chunks(record):
+    """Chunk dicts in the original schema, from either representation"""
+    if not is_compact(record):
+        return record.get('chunks', [])
+
+    count = record['chunk_count']
+    width = 2 * DIGEST_BYTES
+    digests = []
+    for field, packed in record['chunk_digests'].items():
+        raw = packed if isinstance(packed, bytes) else base64.b64decode(packed)
+        text = raw.hex()
+        digests.append((field, [text[i * width:(i + 1) * width] for i in range(count)]))
+
+    # Node fields and hoisted defaults are shared, so build one base dict per node
+    bases = [dict(record['chunk_defaults'], node_id=node_id, node_url=node_url)
+             for node_id, node_url in record['nodes']]
+    columns = list(record['chunk_columns'].items())
+    chunks = [dict(bases[node], index=i) for i, node in enumerate(record['chunk_nodes'])]
+    if count and record['chunk_last']:
+        chunks[-1].update(record['chunk_last'])
+    for field, values in columns + digests:
+        for chunk, value in zip(chunks, values):
+            chunk[field] = value
+    return chunks
+
+
+def chunk_count(record):
+    if is_compact(record):
+        return record['chunk_count']
+    return len(record.get('chunks', []))
+
+
+def chunk_sizes(record):
+    """Stored size of each chunk without building the chunk dicts"""
+    if not is_compact(record):
+        return [chunk['size'] for chunk in record.get('chunks', [])]
+    count = record['chunk_count']
+    if 'size' in record['chunk_columns']:
+        return list(record['chunk_columns']['size'])
+    sizes = [record['chunk_defaults'].get('size')] * count
+    if count and 'size' in record['chunk_last']:
+        sizes[-1] = record['chunk_last']['size']
+    return sizes
+
+
+def encode_record(record):
+    """Copy of a file record with its chunk list in the compact form"""
+    if is_compact(record) or 'chunks' not in record:
+        return record
+    encoded = {field: value for field, value in record.items() if field != 'chunks'}
+    encoded.update(encode_chunks(record['chunks']))
+    return encoded
+
+
+def expand_record(record):
+    """Copy of a file record with its chunk list in the original schema"""
+    if not is_compact(record):
+        return record
+    expanded = {field: value for field, value in record.items() if field not in COMPACT_FIELDS}
+    expanded['chunks'] = decode_chunks(record)
+    return expanded
+
+
+def _digests_to_bytes(record):
+    if is_compact(record) and record['chunk_digests']:
+        record = dict(record, chunk_digests={
+            field: base64.b64decode(packed) for field, packed in record['chunk_digests'].items()})
+    return record
+
+
+def pack(payload):
+    """MessagePack body for a record or a list of records, digests as raw bytes"""
+    if isinstance(payload, list):
+        payload = [_digests_to_bytes(record) for record in payload]
+    elif isinstance(payload, dict):
+        payload = _digests_to_bytes(payload)
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False)
@@ -0,0 +1,74 @@
+import time
+import threading
+import requests
+
+DEFAULT_TIMEOUTS = (3.0, 30.0)
+
+
+class NodeHealthClient:
+    """Per-node timeouts from the coordinator plus batched outcome reports.
+
+    Connect/read timeouts come from the coordinator's `/node_stats`, which
+    derives them from observed latency percentiles, so a slow or dead node
+    fails fast instead of holding a request for the library default.
+    Transfer outcomes are accumulated locally and posted to
+    `/report_node_stats` in batches so they feed back into node health.
+    """
+
+    def __init__(self, coordinator_cache, stats_ttl=10.0, report_interval=10.0, header_hook=None):
+        self.coordinator_cache = coordinator_cache
+        self.stats_ttl = stats_ttl
+        self.report_interval = report_interval
+        self.header_hook = header_hook
+        self._lock = threading.Lock()
+        # node_id -> {'latencies': [...], 'errors': [...]}
+        self._pending = {}
+        self._thread = None
+
+    def timeouts(self, node_id):
+        """(connect, read) timeout tuple for requests to a node"""
+        try:
+            status_code, stats = self.coordinator_cache.get_json('/node_stats', ttl=self.stats_ttl)
+        except Exception as e:
+            print(f"Failed to fetch node stats: {e}")
+            return DEFAULT_TIMEOUTS
+        if status_code != 200:
+            return DEFAULT_TIMEOUTS
+        for entry in stats:
+            if entry['node_id'] == node_id:
+                return entry['connect_timeout_s'], entry['read_timeout_s']
+        return DEFAULT_TIMEOUTS
+
+    def record(self, node_id, latency=None, error=None):
+        with self._lock:
+            pending = self._pending.setdefault(node_id, {'latencies': [], 'errors': []})
+            if error is None:
+                pending['latencies'].append(round(latency, 6))
+            else:
+                pending['errors'].append(error)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        reports = [dict(outcomes, node_id=node_id) for node_id, outcomes in pending.items()]
+        headers = self.header_hook({}) if self.header_hook else {}
+        try:
+            requests.post(f'{self.coordinator_cache.base_url}/report_node_stats',
+                          json={'reports': reports}, headers=headers, timeout=5)
+        except Exception as e:
+            print(f"Failed to report node stats: {e}")
+
+    def start(self):
+        """Flush reports every report_interval seconds from a background thread"""
+        if self.report_interval <= 0 or self._thread:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.report_interval)
+                self.flush()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
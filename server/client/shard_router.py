@@ -0,0 +1,216 @@
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+def shard_hash(key):
+    # Must match sharding.shard_hash on the coordinator
+    return int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16)
+
+
+class ShardRouter:
+    """Routes file metadata calls to the coordinator shard owning each key.
+
+    The shard map is read from the coordinators and refreshed whenever a
+    shard answers 421 (the key moved after a split), or a listing, which
+    has no key to be refused for, reports a newer epoch in X-Shard-Epoch. Point lookups go to
+    the shard owning the file_id; an owner's listing asks the shard holding
+    that owner's index and then fetches the files from their shards; other
+    listings are scattered to every shard and gathered.
+    """
+
+    def __init__(self, coordinator_url, coordinator_cache, header_hook=None, max_workers=16):
+        self.coordinator_url = coordinator_url
+        self.coordinator_cache = coordinator_cache
+        self.header_hook = header_hook
+        self._lock = threading.Lock()
+        self._map = None
+        self._starts = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _headers(self, headers=None):
+        headers = dict(headers or {})
+        return self.header_hook(headers) if self.header_hook else headers
+
+    def _url(self, shard):
+        # Shards without a published URL are the coordinator the map came from
+        return shard['url'] or self.coordinator_url
+
+    def refresh(self):
+        """Adopt the newest map known to any shard"""
+        urls = [self.coordinator_url] + [self._url(shard) for shard in (self._map or {}).get('shards', [])]
+        newest = self._map
+        for url in dict.fromkeys(urls):
+            try:
+                response = requests.get(f'{url}/shard_map', headers=self._headers(), timeout=5)
+            except Exception as e:
+                print(f"Failed to read shard map from {url}: {e}")
+                continue
+            if response.status_code == 200:
+                shard_map = response.json()
+                if newest is None or shard_map['epoch'] > newest['epoch']:
+                    newest = shard_map
+        if newest is None:
+            raise RuntimeError('No coordinator returned a shard map')
+        with self._lock:
+            if self._map is None or newest['epoch'] > self._map['epoch']:
+                newest['shards'].sort(key=lambda shard: shard['start'])
+                self._starts = [shard['start'] for shard in newest['shards']]
+                self._map = newest
+        return self._map
+
+    def _stale(self, response):
+        """Refresh the map if a response came from a newer one, return whether it did"""
+        epoch = response.headers.get('X-Shard-Epoch')
+        if epoch is None or int(epoch) <= (self._map or {}).get('epoch', -1):
+            return False
+        self.refresh()
+        return True
+
+    def shards(self):
+        return (self._map or self.refresh())['shards']
+
+    def shard_url(self, key):
+        shards = self.shards()
+        return self._url(shards[bisect.bisect_right(self._starts, shard_hash(key)) - 1])
+
+    def _routed(self, key, send):
+        """Call send(url) on the owning shard, re-routing once after a 421"""
+        status_code, result = send(self.shard_url(key))
+        if status_code == 421:
+            self.refresh()
+            status_code, result = send(self.shard_url(key))
+        return status_code, result
+
+    def get_metadata(self, file_id, ttl=None):
+        return self._routed(file_id, lambda url: self.coordinator_cache.get_json(
+            f'/get_file_metadata/{file_id}', ttl=ttl, base_url=url))
+
+    def invalidate_metadata(self, file_id):
+        for shard in self.shards():
+            self.coordinator_cache.invalidate(f'/get_file_metadata/{file_id}', base_url=self._url(shard))
+
+    def store_metadata(self, metadata):
+        """Return the coordinator response of storing a file's metadata"""
+        def send(url):
+            response = requests.post(f'{url}/store_file_metadata', json=metadata, headers=self._headers())
+            return response.status_code, response
+        return self._routed(metadata['file_id'], send)[1]
+
+    def delete_metadata(self, file_id, owner):
+        def send(url):
+            response = requests.delete(f'{url}/delete_file_metadata/{file_id}',
+                                       headers=self._headers({'X-Owner': owner}))
+            return response.status_code, response
+        response = self._routed(file_id, send)[1]
+        self.invalidate_metadata(file_id)
+        return response
+
+    def clone_file(self, file_id, owner, filename=None):
+        """Return the coordinator response of cloning a file on its shard"""
+        def send(url):
+            response = requests.post(f'{url}/clone_file/{file_id}', json={'filename': filename},
+                                     headers=self._headers({'X-Owner': owner}))
+            return response.status_code, response
+        return self._routed(file_id, send)[1]
+
+    def snapshot(self, file_ids, owner, snapshot_id, label=None, attempts=2):
+        """Clone files on every shard holding some of them, return (status_code, result)"""
+        by_shard = {}
+        for file_id in file_ids:
+            by_shard.setdefault(self.shard_url(file_id), []).append(file_id)
+        batches = list(by_shard.items())
+
+        def clone_batch(item):
+            url, batch = item
+            response = requests.post(f'{url}/snapshot', headers=self._headers({'X-Owner': owner}),
+                                     json={'file_ids': batch, 'snapshot_id': snapshot_id, 'label': label})
+            return response.status_code, response.json() if response.status_code == 200 else None
+
+        result = {'snapshot_id': snapshot_id, 'files': {}, 'errors': {}}
+        moved = []
+        for (_, batch), (status_code, shard_result) in zip(batches, self._pool.map(clone_batch, batches)):
+            if status_code == 421 and attempts > 1:
+                moved.extend(batch)
+                continue
+            if status_code != 200:
+                return status_code, None
+            result['files'].update(shard_result['files'])
+            result['errors'].update(shard_result['errors'])
+        if moved:
+            # A split moved some of the files, only those are sent again
+            self.refresh()
+            status_code, retried = self.snapshot(moved, owner, snapshot_id, label, attempts - 1)
+            if status_code != 200:
+                return status_code, None
+            result['files'].update(retried['files'])
+            result['errors'].update(retried['errors'])
+        return 200, result
+
+    def _scatter(self, call):
+        results = list(self._pool.map(call, [self._url(shard) for shard in self.shards()]))
+        if any(result[0] == 421 for result in results):
+            self.refresh()
+            results = list(self._pool.map(call, [self._url(shard) for shard in self.shards()]))
+        return results
+
+    def list_files(self, owner=None, attempts=2):
+        """Return (status_code, files) for all files, or the files of one owner"""
+        if len(self.shards()) == 1:
+            params = {'owner': owner} if owner else {}
+            response = requests.get(f'{self._url(self.shards()[0])}/list_files', params=params, headers=self._headers())
+            # The shard split since the map was read, list again across the new map
+            if self._stale(response) and attempts > 1:
+                return self.list_files(owner, attempts - 1)
+            return response.status_code, response.json() if response.status_code == 200 else None
+        if owner:
+            return self._list_owner_files(owner, attempts)
+
+        def fetch(url):
+            response = requests.get(f'{url}/list_files', headers=self._headers())
+            return response.status_code, response.json() if response.status_code == 200 else None, self._stale(response)
+
+        results = self._scatter(fetch)
+        if any(stale for _, _, stale in results) and attempts > 1:
+            return self.list_files(owner, attempts - 1)
+        files = {}
+        for status_code, shard_files, _ in results:
+            if status_code != 200:
+                return status_code, None
+            # Records copied by a split in progress can show up on two shards
+            for record in shard_files:
+                files.setdefault(record['file_id'], record)
+        return 200, list(files.values())
+
+    def _list_owner_files(self, owner, attempts=2):
+        def fetch_index(url):
+            response = requests.get(f'{url}/owner_index/{owner}', headers=self._headers())
+            return response.status_code, response.json() if response.status_code == 200 else None
+
+        status_code, index = self._routed(owner, fetch_index)
+        if status_code != 200:
+            return status_code, None
+
+        by_shard = {}
+        for file_id in index['file_ids']:
+            by_shard.setdefault(self.shard_url(file_id), []).append(file_id)
+
+        def fetch_batch(item):
+            url, file_ids = item
+            response = requests.post(f'{url}/get_file_metadata_batch', json={'file_ids': file_ids},
+                                     headers=self._headers())
+            return (response.status_code, response.json()['files'] if response.status_code == 200 else None,
+                    self._stale(response))
+
+        # Shards skip ids they no longer own, so a batch routed on an old map is asked again
+        results = list(self._pool.map(fetch_batch, by_shard.items()))
+        if any(stale for _, _, stale in results) and attempts > 1:
+            return self._list_owner_files(owner, attempts - 1)
+        files = []
+        for status_code, shard_files, _ in results:
+            if status_code != 200:
+                return status_code, None
+            files.extend(shard_files)
+        return 200, files
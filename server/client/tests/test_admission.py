@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+flask = pytest.importorskip('flask')
+
+from admission import Admission, query_identity
+
+
+def upload_app(admission):
+    app = flask.Flask(__name__)
+
+    @app.route('/upload', methods=['POST'])
+    @admission.guard(identity=query_identity)
+    def upload():
+        return flask.jsonify({'status': 'success'}), 200
+
+    return app.test_client()
+
+
+def upload(client, size=1000, **kwargs):
+    return client.post('/upload', data={'file': (io.BytesIO(b'x' * size), 'f.bin')},
+                       content_type='multipart/form-data', **kwargs)
+
+
+def test_upload_limited_by_owner_header():
+    client = upload_app(Admission(max_in_flight=0, owner_rate=1500))
+    assert upload(client, headers={'X-Owner': '0xalice'}).status_code == 200
+    response = upload(client, headers={'X-Owner': '0xalice'})
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+    # Another owner behind the same address has a bucket of its own
+    assert upload(client, headers={'X-Owner': '0xbob'}).status_code == 200
+
+
+def test_upload_limited_by_query_agreement():
+    client = upload_app(Admission(max_in_flight=0, agreement_rate=1500))
+    assert upload(client, query_string={'agreement_id': 'node-1-100'}).status_code == 200
+    assert upload(client, query_string={'agreement_id': 'node-1-100'}).status_code == 429
+    assert upload(client, query_string={'agreement_id': 'node-2-100'}).status_code == 200
+
+
+def test_rejected_before_body_is_parsed(monkeypatch):
+    client = upload_app(Admission(max_in_flight=0, owner_rate=1500))
+    upload(client, headers={'X-Owner': '0xalice'})
+    monkeypatch.setattr(flask.Request, '_load_form_data', lambda self: pytest.fail('body parsed'))
+    assert upload(client, headers={'X-Owner': '0xalice'}).status_code == 429
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import coordinator_cache
+from coordinator_cache import CoordinatorCache
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {'Content-Type': 'application/json'}
+
+    def __init__(self, url):
+        self.url = url
+
+    def json(self):
+        return {'url': self.url}
+
+
+def test_entries_bounded_lru(monkeypatch):
+    monkeypatch.setattr(coordinator_cache.requests, 'get', lambda url, **kwargs: FakeResponse(url))
+    cache = CoordinatorCache('http://coordinator', max_entries=2)
+    cache.get_json('/get_file_metadata/a', ttl=60)
+    cache.get_json('/get_file_metadata/b', ttl=60)
+    cache.get_json('/get_file_metadata/a', ttl=60)
+    cache.get_json('/get_file_metadata/c', ttl=60)
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+    # b was least recently used, a is still served from the cache
+    cache.get_json('/get_file_metadata/a', ttl=60)
+    assert cache.stats()['hits'] == 2
+
+
+def test_expired_entries_dropped_on_insert(monkeypatch):
+    monkeypatch.setattr(coordinator_cache.requests, 'get', lambda url, **kwargs: FakeResponse(url))
+    cache = CoordinatorCache('http://coordinator', max_age=0.01)
+    cache.get_json('/all_nodes')
+    monkeypatch.setattr(coordinator_cache.time, 'time', lambda real=coordinator_cache.time.time: real() + 1)
+    cache.get_json('/available_nodes')
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import shard_router
+from shard_router import ShardRouter
+
+SPLIT_MAP = {'epoch': 1, 'shards': [
+    {'shard_id': 'shard-0', 'url': 'http://shard-0', 'start': 0, 'end': 2 ** 31},
+    {'shard_id': 'shard-1', 'url': 'http://shard-1', 'start': 2 ** 31, 'end': 2 ** 32}
+]}
+
+
+class Response:
+    def __init__(self, payload, epoch=None):
+        self.status_code = 200
+        self.payload = payload
+        self.headers = {'X-Shard-Epoch': str(epoch)} if epoch is not None else {}
+
+    def json(self):
+        return self.payload
+
+
+def test_listing_refreshes_map_after_split(monkeypatch):
+    files = {'http://shard-0': [{'file_id': 'a'}], 'http://shard-1': [{'file_id': 'b'}]}
+
+    def get(url, **kwargs):
+        base, path = url.rsplit('/', 1)
+        if path == 'shard_map':
+            return Response(SPLIT_MAP)
+        return Response(files[base], epoch=1)
+
+    monkeypatch.setattr(shard_router.requests, 'get', get)
+    router = ShardRouter('http://shard-0', coordinator_cache=None)
+    # A map read before the split: one shard owning everything
+    router._map = {'epoch': 0, 'shards': [{'shard_id': 'shard-0', 'url': 'http://shard-0', 'start': 0, 'end': 2 ** 32}]}
+    router._starts = [0]
+
+    status_code, listed = router.list_files()
+    assert status_code == 200
+    assert sorted(record['file_id'] for record in listed) == ['a', 'b']
+    assert router._map['epoch'] == 1
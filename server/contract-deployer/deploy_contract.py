@@ -1,45 +1,85 @@
+import hashlib
 import json
 import os
 import sys
+import time
 from web3 import Web3
 import solcx
 
-try:
-    solcx.install_solc('0.8.0')
-except Exception as e:
-    print(f"Error installing solc: {e}")
-
+SOLC_VERSION = '0.8.0'
+CONTRACT_PATH = './StorageContract.sol'
+# Compiled ABI and bytecode, keyed by a hash of the source and compiler version
+BUILD_DIR = os.getenv('CONTRACT_BUILD_DIR', './build')
 BLOCKCHAIN_URL = os.getenv('BLOCKCHAIN_URL', 'http://localhost:8545')
-w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
 
-if not w3.is_connected():
-    sys.exit(1)
+timings = []
+
+def timed(step, started):
+    timings.append((step, time.perf_counter() - started))
+
+def source_hash(contract_path):
+    with open(contract_path, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(SOLC_VERSION.encode())
+    return digest.hexdigest()
+
+def artifact_path(key):
+    return os.path.join(BUILD_DIR, f'StorageContract-{key[:16]}.json')
+
+def load_artifacts(key):
+    try:
+        with open(artifact_path(key), 'r') as f:
+            artifacts = json.load(f)
+        if artifacts.get('source_hash') == key:
+            return artifacts['abi'], artifacts['bytecode']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_artifacts(key, abi, bytecode):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp = artifact_path(key) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'source_hash': key, 'solc_version': SOLC_VERSION, 'abi': abi, 'bytecode': bytecode}, f)
+    os.replace(tmp, artifact_path(key))
 
 def compile_contract():
-    contract_path = './StorageContract.sol'
-    
+    """ABI and bytecode of the contract, compiled only when the source changed"""
+    key = source_hash(CONTRACT_PATH)
+    cached = load_artifacts(key)
+    if cached:
+        print(f"Using cached build of {CONTRACT_PATH} ({key[:16]})")
+        return cached
+
+    try:
+        if SOLC_VERSION not in [str(version) for version in solcx.get_installed_solc_versions()]:
+            solcx.install_solc(SOLC_VERSION)
+    except Exception as e:
+        print(f"Error installing solc: {e}")
+
     try:
         compiled_sol = solcx.compile_files(
-            [contract_path],
+            [CONTRACT_PATH],
             output_values=['abi', 'bin'],
-            solc_version='0.8.0'
+            solc_version=SOLC_VERSION
         )
-        
-        contract_id = f"{contract_path}:StorageContract"
+
+        contract_id = f"{CONTRACT_PATH}:StorageContract"
         contract_interface = compiled_sol[contract_id]
-        
+
         abi = contract_interface['abi']
         bytecode = contract_interface['bin']
-        
+
+        save_artifacts(key, abi, bytecode)
         return abi, bytecode
     except Exception as e:
         print(f"Error compiling contract: {e}")
         sys.exit(1)
 
-def deploy_contract(abi, bytecode):
+def deploy_contract(w3, abi, bytecode):
     w3.eth.default_account = w3.eth.accounts[0]
     Contract = w3.eth.contract(abi=abi, bytecode=bytecode)
-    
+
     try:
         tx_hash = Contract.constructor().transact()
         tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
@@ -55,19 +95,34 @@ def save_contract_info(abi, contract_address):
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
         print(f"Created directory: {data_dir}")
-    
-    
+
+
     address_file = os.path.join(data_dir, 'contract_address.txt')
     with open(address_file, 'w') as f:
         f.write(contract_address)
-    
+
     abi_file = os.path.join(data_dir, 'contract_abi.json')
     with open(abi_file, 'w') as f:
         json.dump(abi, f)
-    
+
 
 if __name__ == "__main__":
+    started = time.perf_counter()
     abi, bytecode = compile_contract()
-    contract_address = deploy_contract(abi, bytecode)
-    save_contract_info(abi, contract_address)
-    print("Contract deployment completed successfully!") 
\ No newline at end of file
+    timed('compile', started)
+
+    # The image build runs this with --compile-only to bake the artifacts in
+    if '--compile-only' not in sys.argv[1:]:
+        started = time.perf_counter()
+        w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
+        if not w3.is_connected():
+            sys.exit(1)
+        timed('connect', started)
+
+        started = time.perf_counter()
+        contract_address = deploy_contract(w3, abi, bytecode)
+        save_contract_info(abi, contract_address)
+        timed('deploy', started)
+        print("Contract deployment completed successfully!")
+
+    print("Deployer timings: " + ', '.join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in timings))
@@ -0,0 +1,260 @@
+import os
+import json
+import threading
+from contextlib import nullcontext
+
+# Contract events the index is built from
+INDEXED_EVENTS = ['AgreementCreated', 'StorageLocked', 'PaymentReleased', 'EncryptionKeyStored']
+
+# Backend namespace and key holding the index when state is shared
+AGREEMENTS = 'agreements'
+STATE_KEY = 'state'
+
+
+class AgreementIndexer:
+    """Local index of storage agreements built from contract event logs.
+
+    Logs are scanned incrementally from the last processed block, which is
+    persisted together with the index, so each sync only reads the blocks
+    mined since the previous one. Queries by user and by node are answered
+    from in-memory indexes without touching the chain.
+
+    With a shared StateBackend the index is stored there instead of in
+    `state_file`; workers reload it when its version moves and syncs are
+    serialized with a backend lock.
+
+    The index is bound to the chain client's contract address at creation.
+    The Web3 connection is only made by the first sync, so a saved index is
+    served without waiting on the chain.
+    """
+
+    def __init__(self, chain, state_file, start_block=0, confirmations=0, batch_blocks=5000,
+                 backend=None):
+        self.chain = chain
+        self.address = chain.address
+        self.state_file = state_file
+        self.confirmations = confirmations
+        self.batch_blocks = batch_blocks
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._version = 0
+        self._loaded_version = 0
+
+        self.state = {
+            'contract_address': self.address,
+            'last_block': start_block - 1,
+            'agreements': {},
+            'user_counts': {},
+            'locked_storage': {}
+        }
+        self._load()
+        self._rebuild_indexes()
+
+    @property
+    def web3(self):
+        return self.chain.web3
+
+    @property
+    def contract(self):
+        return self.chain.contract
+
+    def _read_state(self):
+        if self.backend:
+            state, self._loaded_version = self.backend.get(AGREEMENTS, STATE_KEY, with_version=True)
+            return state
+        if not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file, 'r') as f:
+            return json.load(f)
+
+    def _load(self):
+        try:
+            state = self._read_state()
+        except (OSError, ValueError) as e:
+            print(f"Error loading agreement index: {e}")
+            return
+        if state is None:
+            return
+        # An index built for a different deployment is useless, start over
+        if (state.get('contract_address') or '').lower() != self.address.lower():
+            print("Agreement index belongs to another contract, rebuilding")
+            return
+        self.state.update(state)
+
+    def _save(self):
+        if self.backend:
+            self._loaded_version = self.backend.put(AGREEMENTS, STATE_KEY, self.state)
+            return
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def _refresh(self):
+        """Pick up an index saved by another worker"""
+        if self.backend and self.backend.version(AGREEMENTS) != self._loaded_version:
+            self._load()
+            self._rebuild_indexes()
+
+    @property
+    def version(self):
+        if self.backend:
+            return self.backend.version(AGREEMENTS)
+        return self._version
+
+    def _rebuild_indexes(self):
+        self.by_user = {}
+        self.by_node = {}
+        for agreement_id, agreement in self.state['agreements'].items():
+            self._index(agreement_id, agreement)
+
+    def _index(self, agreement_id, agreement):
+        self.by_user.setdefault(agreement['user'].lower(), set()).add(agreement_id)
+        self.by_node.setdefault(agreement['node_id'], set()).add(agreement_id)
+
+    def _fetch_logs(self, from_block, to_block):
+        logs = []
+        for name in INDEXED_EVENTS:
+            event = getattr(self.contract.events, name)
+            logs.extend(event.get_logs(fromBlock=from_block, toBlock=to_block))
+        logs.sort(key=lambda log: (log['blockNumber'], log['logIndex']))
+        return logs
+
+    def _block_timestamp(self, block_number, cache):
+        if block_number not in cache:
+            cache[block_number] = self.web3.eth.get_block(block_number)['timestamp']
+        return cache[block_number]
+
+    def _apply_agreement_created(self, log, timestamps):
+        args = log['args']
+        user = args['user']
+        node_id = args['nodeId']
+        size_mb = args['sizeInMB']
+        agreement_id = f"{node_id}-{size_mb}"
+
+        # userAgreements[user] is append-only, so the n-th event for a user
+        # is the n-th entry of the on-chain array
+        user_key = user.lower()
+        index = self.state['user_counts'].get(user_key, 0)
+        self.state['user_counts'][user_key] = index + 1
+
+        total_price = None
+        start_time = None
+        active = True
+        try:
+            stored = self.contract.functions.userAgreements(user, index).call()
+            total_price, start_time, active = stored[4], stored[5], stored[6]
+        except Exception as e:
+            print(f"Error reading agreement {agreement_id} for {user}: {e}")
+        if start_time is None:
+            start_time = self._block_timestamp(log['blockNumber'], timestamps)
+
+        previous = self.state['agreements'].get(agreement_id, {})
+        self.state['agreements'][agreement_id] = {
+            'agreement_id': agreement_id,
+            'user': user,
+            'node_id': node_id,
+            'size_mb': size_mb,
+            'duration_days': args['duration'],
+            'total_price': total_price,
+            'start_time': start_time,
+            'active': active,
+            'key_stored': previous.get('key_stored', False) and previous.get('user') == user,
+            'payments_released': 0,
+            'created_block': log['blockNumber'],
+            'updated_block': log['blockNumber']
+        }
+        if previous and previous.get('user', '').lower() != user_key:
+            self.by_user.get(previous['user'].lower(), set()).discard(agreement_id)
+        self._index(agreement_id, self.state['agreements'][agreement_id])
+
+    def _apply(self, log, timestamps):
+        name = log['event']
+        args = log['args']
+        if name == 'AgreementCreated':
+            self._apply_agreement_created(log, timestamps)
+        elif name == 'StorageLocked':
+            self.state['locked_storage'][args['nodeId']] = args['sizeInMB']
+        elif name == 'EncryptionKeyStored':
+            agreement = self.state['agreements'].get(args['agreementId'])
+            if agreement:
+                agreement['key_stored'] = True
+                agreement['updated_block'] = log['blockNumber']
+        elif name == 'PaymentReleased':
+            user_key = args['user'].lower()
+            for agreement_id in self.by_user.get(user_key, ()):
+                agreement = self.state['agreements'][agreement_id]
+                if agreement['node_id'] == args['nodeId']:
+                    agreement['payments_released'] += args['amount']
+                    agreement['updated_block'] = log['blockNumber']
+
+    def sync(self):
+        """Process logs up to the latest confirmed block, return how many were applied"""
+        shared_lock = self.backend.lock(AGREEMENTS, ttl=300.0) if self.backend else nullcontext()
+        with self._lock, shared_lock:
+            if self.chain.address != self.address:
+                # Replaced by an index for the newly saved contract
+                return 0
+            self._refresh()
+            head = self.web3.eth.block_number - self.confirmations
+            applied = 0
+            while self.state['last_block'] < head:
+                from_block = self.state['last_block'] + 1
+                to_block = min(head, from_block + self.batch_blocks - 1)
+                timestamps = {}
+                for log in self._fetch_logs(from_block, to_block):
+                    self._apply(log, timestamps)
+                    applied += 1
+                self.state['last_block'] = to_block
+                self._save()
+            if applied:
+                self._version += 1
+            return applied
+
+    def agreements(self, user=None, node_id=None):
+        with self._lock:
+            self._refresh()
+            if user is not None:
+                ids = set(self.by_user.get(user.lower(), ()))
+                if node_id is not None:
+                    ids &= self.by_node.get(node_id, set())
+            elif node_id is not None:
+                ids = set(self.by_node.get(node_id, ()))
+            else:
+                ids = self.state['agreements'].keys()
+            return [dict(self.state['agreements'][agreement_id]) for agreement_id in sorted(ids)]
+
+    def locked_storage(self):
+        with self._lock:
+            self._refresh()
+            return dict(self.state['locked_storage'])
+
+    @property
+    def last_block(self):
+        return self.state['last_block']
+
+    def _run(self, interval, lease):
+        while True:
+            try:
+                # Only the lease holder reads the chain, the others follow its saves
+                if lease is None or lease.held():
+                    self.sync()
+                else:
+                    with self._lock:
+                        self._refresh()
+            except Exception as e:
+                print(f"Agreement index sync failed: {e}")
+            if self._stop.wait(interval):
+                break
+
+    def start(self, interval, lease=None):
+        """Keep the index up to date from a background thread"""
+        if interval <= 0 or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval, lease), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -2,10 +2,24 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 import json
+import uuid
+import time
 import requests
-from web3 import Web3
+from contextlib import ExitStack
+from metadata_store import FileMetadataStore, SharedMetadataStore
+from state_backend import LeaderLease, MemoryBackend, open_backend
+from sharding import ShardManager
+import metadata_codec
+from agreement_indexer import AgreementIndexer
+from chain import ChainClient, checksum_address
+from node_registry import NodeRegistry
+from telemetry import REGISTRY, StartupTimer, instrument_app, install_profiling, timed_chain_call
+
+startup = StartupTimer('coordinator')
 app = Flask(__name__)
 CORS(app)
+instrument_app(app, 'coordinator')
+install_profiling(app)
 
 CONTRACT_ABI_PATH ='./data/contract_abi.json'
 CONTRACT_ADDRESS_FILE ='./data/contract_address.txt'
@@ -16,39 +30,208 @@ METADATA_FILE = os.path.join(DATA_DIR, 'file_metadata.json')
 AGREEMENTS_FILE = os.path.join(DATA_DIR, 'agreements_metadata.json')
 
 BLOCKCHAIN_URL = os.getenv('BLOCKCHAIN_URL', 'http://localhost:8545')  # Default to localhost if not set
-web3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
+CHAIN_TIMEOUT = float(os.getenv('CHAIN_TIMEOUT', '10'))
+CHAIN_CHECK_INTERVAL = float(os.getenv('CHAIN_CHECK_INTERVAL', '30'))  # 0 disables connection checks
 
-if not os.path.exists(METADATA_FILE):
-    with open(METADATA_FILE, 'w') as f:
-        json.dump({}, f)
+# Shared state lets several workers or instances serve the same registry,
+# metadata and agreement index: sqlite:///<path> for one host,
+# redis://host:port/db for several. Unset keeps state local to the process.
+STATE_BACKEND = os.getenv('STATE_BACKEND', '')
+state_backend = open_backend(STATE_BACKEND) if STATE_BACKEND else None
 
-if not os.path.exists(AGREEMENTS_FILE):
-    with open(AGREEMENTS_FILE, 'w') as f:
-        json.dump({}, f)
+def leader_lease(name, interval):
+    """Lease electing the worker that runs a background loop, if state is shared"""
+    if not state_backend:
+        return None
+    return LeaderLease(state_backend, name, ttl=max(30.0, 3 * interval))
 
-contract = None
-CONTRACT_ADDRESS = ''
+if state_backend:
+    file_metadata = SharedMetadataStore(state_backend, legacy_path=METADATA_FILE)
+else:
+    # File metadata is parsed once and served from memory
+    file_metadata = FileMetadataStore(METADATA_FILE)
 
-if os.path.exists(CONTRACT_ADDRESS_FILE):
-    try:
-        with open(CONTRACT_ADDRESS_FILE, 'r') as f:
-            CONTRACT_ADDRESS = f.read().strip()
-        print(f"Loaded contract address: {CONTRACT_ADDRESS}")
-    except Exception as e:
-        print(f"Error reading contract address: {e}")
+# File metadata is partitioned by hash of file_id, the owner index by hash
+# of owner. A lone coordinator owns the whole range; /admin/shards/split
+# hands half of it to a new coordinator.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+SHARD_ID = os.getenv('SHARD_ID', 'shard-0')
+SHARD_URL = os.getenv('SHARD_URL')  # how other shards and clients reach this one
+shard_manager = ShardManager(
+    state_backend or MemoryBackend(os.path.join(DATA_DIR, 'shard_state.json')),
+    SHARD_ID,
+    shard_url=SHARD_URL,
+    admin_token=ADMIN_TOKEN
+)
+
+def admin_authorized():
+    return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+def wrong_shard():
+    """421 carrying the current shard map, so the caller can route again"""
+    return jsonify({'error': 'Key belongs to another shard', 'shard_map': shard_manager.shard_map()}), 421
+
+# Keyless reads never get a 421, so they carry the epoch for callers to notice a split
+EPOCH_ENDPOINTS = {'list_files', 'get_file_metadata_batch', 'owner_index'}
+
+@app.after_request
+def add_shard_epoch(response):
+    if request.endpoint in EPOCH_ENDPOINTS:
+        response.headers['X-Shard-Epoch'] = str(shard_manager.shard_map()['epoch'])
+    return response
+
+def file_lock(file_id):
+    """Serializes changes to a file's record with clones of it and with splits, across workers"""
+    return shard_manager.file_lock(file_id)
+
+def chunk_ids(record):
+    """Distinct chunk ids a file record references"""
+    return {chunk['chunk_id'] for chunk in metadata_codec.decode_chunks(record)} if record else set()
 
-if os.path.exists(CONTRACT_ABI_PATH):
+def shareable_chunk_ids(record):
+    """Chunk ids of a record that another upload of the same content would share.
+
+    Unencrypted chunks are addressed by a hash of their content; encrypted
+    ones get a fresh IV and so an id of their own.
+    """
+    if not record:
+        return set()
+    return {chunk['chunk_id'] for chunk in metadata_codec.decode_chunks(record)
+            if chunk.get('encryption', record.get('encryption', 'none')) != 'aes'}
+
+def released_chunks(record, released):
+    """Node locations of the chunks of `record` whose last reference is gone"""
+    released, chunks = set(released), {}
+    for chunk in metadata_codec.decode_chunks(record):
+        if chunk['chunk_id'] in released:
+            chunks.setdefault(chunk['chunk_id'], {field: chunk[field] for field in ('chunk_id', 'node_id', 'node_url')})
+    return list(chunks.values())
+
+def release_chunks(record, dropped):
+    """Drop a record's references to `dropped` chunk ids, return the released chunks"""
+    if not dropped:
+        return []
     try:
-        with open(CONTRACT_ABI_PATH, 'r') as f:
-            contract_abi = json.load(f)
-        contract = web3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-        print(f"Contract loaded successfully at address {CONTRACT_ADDRESS}")
+        return released_chunks(record, shard_manager.chunk_refs(remove=list(dropped)))
     except Exception as e:
-        print(f"Error loading contract: {e}")
+        # Leaking the chunks is safer than deleting ones a clone may still use
+        print(f"Failed to release chunks of {record['file_id']}: {e}")
+        return []
+
+def new_file_id():
+    """Random file id in this shard's range, so a clone is stored where it is made"""
+    while True:
+        file_id = str(uuid.uuid4())
+        if shard_manager.owns(file_id):
+            return file_id
+
+startup.mark('state')
+
+# Chain client and contract are created on first use, so startup does not wait on the chain
+chain = ChainClient(BLOCKCHAIN_URL, abi_path=CONTRACT_ABI_PATH, address_file=CONTRACT_ADDRESS_FILE,
+                    timeout=CHAIN_TIMEOUT)
+chain.start_monitor(CHAIN_CHECK_INTERVAL)
+
+# A contract saved through /save_contract_abi on another worker
+contract_config_version = 0
+if state_backend:
+    contract_config, contract_config_version = state_backend.get('config', 'contract', with_version=True)
+    if contract_config:
+        chain.set_contract(contract_config['address'], contract_config['abi'])
+
+# Agreement index fed by contract events, persisted in AGREEMENTS_FILE
+AGREEMENT_INDEX_INTERVAL = float(os.getenv('AGREEMENT_INDEX_INTERVAL', '5'))  # seconds, 0 disables polling
+AGREEMENT_INDEX_START_BLOCK = int(os.getenv('AGREEMENT_INDEX_START_BLOCK', '0'))
+AGREEMENT_INDEX_CONFIRMATIONS = int(os.getenv('AGREEMENT_INDEX_CONFIRMATIONS', '0'))
+agreement_indexer = None
+# Shared indexes keep their versions in the backend, so their ETags agree across workers
+agreements_generation = 'shared' if state_backend else uuid.uuid4().hex[:8]
+
+def start_agreement_indexer():
+    """(Re)create the agreement index for the current contract"""
+    global agreement_indexer
+    if agreement_indexer:
+        agreement_indexer.stop()
+    agreement_indexer = AgreementIndexer(
+        chain,
+        AGREEMENTS_FILE,
+        start_block=AGREEMENT_INDEX_START_BLOCK,
+        confirmations=AGREEMENT_INDEX_CONFIRMATIONS,
+        backend=state_backend
+    )
+    agreement_indexer.start(AGREEMENT_INDEX_INTERVAL, lease=leader_lease('agreement_indexer', AGREEMENT_INDEX_INTERVAL))
 
-# Registered storage nodes
-# Format: node_id -> {'url': ..., 'limit_mb': ..., 'used_mb': ...}
-nodes = {}
+def refresh_contract():
+    """Follow a contract saved by another worker"""
+    global contract_config_version
+    if not state_backend or state_backend.version('config') == contract_config_version:
+        return
+    contract_config, contract_config_version = state_backend.get('config', 'contract', with_version=True)
+    if contract_config and contract_config['address'] != chain.address:
+        chain.set_contract(contract_config['address'], contract_config['abi'])
+        start_agreement_indexer()
+
+if chain.configured:
+    start_agreement_indexer()
+
+startup.mark('chain')
+
+# Registered storage nodes with heartbeat/probe based health tracking
+NODES_FILE = os.path.join(DATA_DIR, 'nodes_registry.json')
+NODE_HEARTBEAT_TIMEOUT = float(os.getenv('NODE_HEARTBEAT_TIMEOUT', '90'))  # seconds without /register before degraded
+NODE_EVICT_AFTER = float(os.getenv('NODE_EVICT_AFTER', '600'))  # seconds a down node is kept before eviction
+NODE_FAILURE_THRESHOLD = int(os.getenv('NODE_FAILURE_THRESHOLD', '3'))  # consecutive failures before down
+NODE_PROBE_INTERVAL = float(os.getenv('NODE_PROBE_INTERVAL', '15'))  # seconds, 0 disables probing
+NODE_PROBE_TIMEOUT = float(os.getenv('NODE_PROBE_TIMEOUT', '2'))
+node_registry = NodeRegistry(
+    NODES_FILE,
+    backend=state_backend,
+    heartbeat_timeout=NODE_HEARTBEAT_TIMEOUT,
+    evict_after=NODE_EVICT_AFTER,
+    failure_threshold=NODE_FAILURE_THRESHOLD
+)
+node_registry.start(NODE_PROBE_INTERVAL, NODE_PROBE_TIMEOUT, lease=leader_lease('node_prober', NODE_PROBE_INTERVAL))
+
+def _nodes_by_state():
+    counts = {}
+    for node in node_registry.all():
+        counts[(node['state'],)] = counts.get((node['state'],), 0) + 1
+    return counts
+
+REGISTRY.gauge_callback(
+    'coordinator_registered_nodes', 'Storage nodes currently registered', _nodes_by_state, ('state',))
+# Chunks that storage node scrubbers found corrupt, keyed by node and chunk
+CORRUPTION = 'corruption'
+corruption_reports = state_backend or MemoryBackend(os.path.join(DATA_DIR, 'corruption_reports.json'))
+REGISTRY.gauge_callback(
+    'coordinator_corrupt_chunks', 'Corrupt chunks reported by storage nodes',
+    lambda: {(): corruption_reports.count(CORRUPTION)})
+REGISTRY.gauge_callback(
+    'coordinator_files', 'Files with stored metadata', lambda: {(): len(file_metadata)})
+
+def json_with_etag(payload, etag):
+    """JSON response carrying an ETag, or 304 if the client already has it"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+def metadata_with_etag(payload, etag):
+    """Like json_with_etag, but in MessagePack when the client prefers it"""
+    if metadata_codec.msgpack is None or \
+            request.accept_mimetypes.best_match(['application/json', metadata_codec.MSGPACK_TYPE]) != metadata_codec.MSGPACK_TYPE:
+        response = json_with_etag(payload, etag)
+    else:
+        etag = f'{etag}-mp'
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(metadata_codec.pack(payload), mimetype=metadata_codec.MSGPACK_TYPE)
+        response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -67,21 +250,23 @@ def register():
     # Convert wallet address to checksum format if provided
     if wallet_address:
         try:
-            wallet_address = Web3.to_checksum_address(wallet_address)
+            wallet_address = checksum_address(wallet_address)
         except Exception as e:
             print(f"Warning: Invalid wallet address provided by {node_id}: {e}")
 
-    nodes[node_id] = {
+    # Every registration doubles as a heartbeat
+    record = node_registry.register({
         'node_id': node_id,
         'url': url,
         'limit_mb': limit_mb,
         'used_mb': used_mb,
         'locked_mb': locked_mb,
         'price_per_mb': price_per_mb,
-        'wallet_address': wallet_address
-    }
+        'wallet_address': wallet_address,
+        'tiers': data.get('tiers')
+    })
 
-    return jsonify({'status': 'registered', 'node_id': node_id}), 200
+    return jsonify({'status': 'registered', 'node_id': node_id, 'state': record['state']}), 200
 
 @app.route('/deregister', methods=['POST'])
 def deregister():
@@ -91,23 +276,69 @@ def deregister():
     if not node_id:
         return jsonify({'error': 'Missing node_id'}), 400
     
-    if node_id in nodes:
-        del nodes[node_id]
+    if node_registry.deregister(node_id):
         return jsonify({'status': 'deregistered', 'node_id': node_id}), 200
     else:
         return jsonify({'error': 'Node not found', 'node_id': node_id}), 404
 
 @app.route('/available_nodes', methods=['GET'])
 def available_nodes():
-    # Show nodes that have available space (either regular or locked)
-    return jsonify([
-        node for node in nodes.values()
-        if node.get('used_mb', 0) < node.get('limit_mb', 0) or node.get('locked_mb', 0) > 0
-    ]), 200
+    # Show nodes that have available space (either regular or locked); down
+    # nodes are excluded and degraded ones only offered when nothing is healthy.
+    # ?tier=fast puts nodes with room on their fast tier first
+    return json_with_etag(node_registry.available(tier=request.args.get('tier')), node_registry.etag())
 
 @app.route('/all_nodes', methods=['GET'])
 def all_nodes():
-    return jsonify(list(nodes.values())), 200
+    return json_with_etag(node_registry.all(), node_registry.etag())
+
+@app.route('/node_stats', methods=['GET'])
+def node_stats():
+    """Per-node health, latency percentiles and suggested client timeouts"""
+    return jsonify(node_registry.stats()), 200
+
+@app.route('/report_node_stats', methods=['POST'])
+def report_node_stats():
+    """Batched transfer outcomes observed by clients"""
+    reports = (request.json or {}).get('reports', [])
+    for report in reports:
+        if not report.get('node_id'):
+            continue
+        for latency in report.get('latencies', []):
+            node_registry.record(report['node_id'], True, latency)
+        for error in report.get('errors', []):
+            node_registry.record(report['node_id'], False, error=error)
+    return jsonify({'status': 'recorded', 'reports': len(reports)}), 200
+
+@app.route('/report_corruption', methods=['POST'])
+def report_corruption():
+    """Chunks a node's scrubber quarantined after they failed their hash check"""
+    data = request.json or {}
+    node_id = data.get('node_id')
+    if not node_id:
+        return jsonify({'error': 'node_id required'}), 400
+    
+    reports = {}
+    for chunk in data.get('chunks', []):
+        if chunk.get('chunk_id'):
+            reports[f"{node_id}:{chunk['chunk_id']}"] = dict(chunk, node_id=node_id, reported_at=time.time())
+    if reports:
+        corruption_reports.put_many(CORRUPTION, reports)
+        # Lost data counts against the node like a failed transfer
+        node_registry.record(node_id, False, source='scrubber', error='corruption')
+        print(f"Node {node_id} reported {len(reports)} corrupt chunks")
+    return jsonify({'status': 'recorded', 'chunks': len(reports)}), 200
+
+@app.route('/corruption_reports', methods=['GET'])
+def list_corruption_reports():
+    """Reported corrupt chunks, optionally for one node or file, for repair or re-upload"""
+    node_id = request.args.get('node_id')
+    file_id = request.args.get('file_id')
+    reports = [report for report in corruption_reports.items(CORRUPTION).values()
+               if (not node_id or report['node_id'] == node_id)
+               and (not file_id or report.get('file_id') == file_id)]
+    reports.sort(key=lambda report: report['reported_at'])
+    return jsonify(reports), 200
 
 @app.route('/store_file_metadata', methods=['POST'])
 def store_file_metadata():
@@ -119,42 +350,67 @@ def store_file_metadata():
     chunks = data.get('chunks')
     agreement_id = data.get('agreement_id')
     
-    if not all([file_id, filename, chunks]):
+    if not all([file_id, filename]) or not (chunks or metadata_codec.is_compact(data)):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    # Load current metadata
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    if not shard_manager.owns(file_id):
+        return wrong_shard()
     
-    # Store new file metadata
-    metadata[file_id] = {
+    # Store new file metadata, with the chunk list in the compact form
+    record = {
         'file_id': file_id,
         'filename': filename,
         'size': size,
         'owner': owner,
-        'chunks': chunks,
         'created_at': data.get('created_at'),
         'encryption': data.get('encryption', 'none'),
         'agreement_id': agreement_id
     }
+    if chunks:
+        record.update(metadata_codec.encode_chunks(chunks))
+    else:
+        record.update({field: data[field] for field in metadata_codec.COMPACT_FIELDS})
     
     # If this is for an agreement, store the key
     if 'key' in data:
-        metadata[file_id]['key'] = data['key']
+        record['key'] = data['key']
+    
+    # Merkle manifest of files uploaded with integrity checks
+    for field in ('merkle_root', 'chunk_size'):
+        if field in data:
+            record[field] = data[field]
     
     # Save updated metadata
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f)
+    with file_lock(file_id):
+        previous = file_metadata.get(file_id)
+        # Content another file may already hold is counted before the record
+        # points at it, so deleting either file leaves the other's chunks
+        claimed = shareable_chunk_ids(record) - chunk_ids(previous)
+        if claimed:
+            try:
+                shard_manager.chunk_refs(claim=list(claimed))
+            except Exception as e:
+                return jsonify({'error': f'Failed to reference chunks: {e}'}), 502
+        file_metadata.put(file_id, record)
+        shard_manager.forward_put(file_id, record)
+        # Chunks a new version dropped lose this file's reference; the caller
+        # deletes the ones no clone or identical upload still uses
+        released = release_chunks(previous, chunk_ids(previous) - chunk_ids(record))
+    if previous and previous.get('owner') != owner:
+        shard_manager.record_owner(previous.get('owner'), remove=[file_id])
+    shard_manager.record_owner(owner, add=[file_id])
     
-    return jsonify({'status': 'stored', 'file_id': file_id}), 200
+    return jsonify({'status': 'stored', 'file_id': file_id, 'released_chunks': released}), 200
 
 @app.route('/get_file_metadata/<file_id>', methods=['GET'])
 def get_file_metadata(file_id):
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    if not shard_manager.owns(file_id):
+        return wrong_shard()
     
-    if file_id in metadata:
-        return jsonify(metadata[file_id]), 200
+    record = file_metadata.get(file_id)
+    
+    if record is not None:
+        return metadata_with_etag(record, file_metadata.etag(file_id))
     else:
         return jsonify({'error': 'File not found'}), 404
 
@@ -163,94 +419,228 @@ def list_files():
     owner = request.args.get('owner')
     agreement_id = request.args.get('agreement_id')
     
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    etag = file_metadata.etag()
+    records = file_metadata.values()
     
     if owner:
-        files = [data for _, data in metadata.items() if data.get('owner') == owner]
+        files = [data for data in records if data.get('owner') == owner]
     elif agreement_id:
-        files = [data for _, data in metadata.items() if data.get('agreement_id') == agreement_id]
+        files = [data for data in records if data.get('agreement_id') == agreement_id]
     else:
-        files = list(metadata.values())
+        files = records
     
-    return jsonify(files), 200
+    return metadata_with_etag(files, etag)
 
 @app.route('/delete_file_metadata/<file_id>', methods=['DELETE'])
 def delete_file_metadata(file_id):
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    if not shard_manager.owns(file_id):
+        return wrong_shard()
     
-    if file_id not in metadata:
-        return jsonify({'error': 'File not found'}), 404
+    with file_lock(file_id):
+        record = file_metadata.get(file_id)
+        
+        if record is None:
+            return jsonify({'error': 'File not found'}), 404
+        
+        # Verify ownership
+        owner = request.headers.get('X-Owner')
+        if record['owner'] != 'anonymous' and record['owner'] != owner:
+            return jsonify({'error': 'Not authorized to delete this file'}), 403
+        
+        # Remove file metadata, then its references; the caller deletes the
+        # chunks no clone still uses
+        file_metadata.delete(file_id)
+        shard_manager.forward_delete(file_id)
+        released = release_chunks(record, chunk_ids(record))
+    shard_manager.record_owner(record.get('owner'), remove=[file_id])
     
-    # Verify ownership
-    owner = request.headers.get('X-Owner')
-    if metadata[file_id]['owner'] != 'anonymous' and metadata[file_id]['owner'] != owner:
-        return jsonify({'error': 'Not authorized to delete this file'}), 403
-    
-    # Remove file metadata
-    del metadata[file_id]
-    
-    # Save updated metadata
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f)
+    return jsonify({'status': 'deleted', 'file_id': file_id, 'released_chunks': released}), 200
+
+def clone_records(file_ids, owner, fields):
+    """New records sharing the chunks of files on this shard, nothing is copied.
+
+    Returns ({source file_id: clone}, {source file_id: (error, status code)}).
+    The references are taken while the sources are locked, so a concurrent
+    delete or update cannot release a chunk the clone is about to use.
+    """
+    clones, errors = {}, {}
+    with ExitStack() as locks:
+        for file_id in sorted(set(file_ids)):
+            locks.enter_context(file_lock(file_id))
+        sources = {}
+        for file_id in file_ids:
+            record = file_metadata.get(file_id)
+            if record is None:
+                errors[file_id] = ('File not found', 404)
+            elif record['owner'] != 'anonymous' and record['owner'] != owner:
+                errors[file_id] = ('Not authorized to clone this file', 403)
+            else:
+                sources[file_id] = record
+        shard_manager.chunk_refs(add=[chunk_id for record in sources.values() for chunk_id in chunk_ids(record)])
     
-    return jsonify({'status': 'deleted', 'file_id': file_id}), 200
+    now = time.time()
+    for file_id, record in sources.items():
+        clone = dict(record, file_id=new_file_id(), created_at=now, cloned_from=file_id)
+        clone.update({field: value for field, value in fields.items() if value})
+        clones[file_id] = clone
+    if clones:
+        file_metadata.put_many({clone['file_id']: clone for clone in clones.values()})
+        by_owner = {}
+        for clone in clones.values():
+            shard_manager.forward_put(clone['file_id'], clone)
+            by_owner.setdefault(clone['owner'], []).append(clone['file_id'])
+        for clone_owner, clone_ids in by_owner.items():
+            shard_manager.record_owner(clone_owner, add=clone_ids)
+    return clones, errors
+
+@app.route('/clone_file/<file_id>', methods=['POST'])
+def clone_file(file_id):
+    """Copy of a file that shares its chunks, made without moving any data"""
+    if not shard_manager.owns(file_id):
+        return wrong_shard()
+    data = request.json or {}
+    try:
+        clones, errors = clone_records([file_id], request.headers.get('X-Owner'), {'filename': data.get('filename')})
+    except Exception as e:
+        return jsonify({'error': f'Failed to reference chunks: {e}'}), 502
+    if file_id in errors:
+        message, status_code = errors[file_id]
+        return jsonify({'error': message}), status_code
+    clone = clones[file_id]
+    return jsonify({'status': 'cloned', 'file_id': clone['file_id'], 'source_file_id': file_id,
+                    'chunks': metadata_codec.chunk_count(clone)}), 200
+
+@app.route('/snapshot', methods=['POST'])
+def snapshot():
+    """Clone several files held by this shard under one snapshot id"""
+    data = request.json or {}
+    file_ids = data.get('file_ids') or []
+    if not file_ids:
+        return jsonify({'error': 'file_ids required'}), 400
+    if not all(shard_manager.owns(file_id) for file_id in file_ids):
+        return wrong_shard()
+    snapshot_id = data.get('snapshot_id') or str(uuid.uuid4())
+    try:
+        clones, errors = clone_records(file_ids, request.headers.get('X-Owner'), {
+            'snapshot_id': snapshot_id,
+            'snapshot_label': data.get('label')
+        })
+    except Exception as e:
+        return jsonify({'error': f'Failed to reference chunks: {e}'}), 502
+    return jsonify({
+        'snapshot_id': snapshot_id,
+        'files': {file_id: clone['file_id'] for file_id, clone in clones.items()},
+        'errors': {file_id: message for file_id, (message, _) in errors.items()}
+    }), 200
+
+@app.route('/chunk_refs', methods=['POST'])
+def chunk_refs():
+    """Reference changes for chunks placed on this shard, sent by the shard holding the file"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.json or {}
+    if not all(shard_manager.owns(chunk_id)
+               for chunk_id in data.get('add', []) + data.get('remove', []) + data.get('claim', [])):
+        return wrong_shard()
+    released = shard_manager.ref_update(add=data.get('add', []), remove=data.get('remove', []),
+                                        claim=data.get('claim', []))
+    return jsonify({'released': released}), 200
+
+@app.route('/get_file_metadata_batch', methods=['POST'])
+def get_file_metadata_batch():
+    """Metadata of several files held by this shard, unknown ids are skipped"""
+    file_ids = (request.json or {}).get('file_ids', [])
+    files = []
+    for file_id in file_ids:
+        record = file_metadata.get(file_id)
+        if record is not None and shard_manager.owns(file_id):
+            files.append(record)
+    return jsonify({'files': files}), 200
+
+@app.route('/shard_map', methods=['GET'])
+def shard_map():
+    return jsonify(dict(shard_manager.shard_map(), shard_id=SHARD_ID)), 200
+
+@app.route('/owner_index/<owner>', methods=['GET', 'POST'])
+def owner_index(owner):
+    """File ids of an owner, kept on the shard owning the owner"""
+    if not shard_manager.owns(owner):
+        return wrong_shard()
+    if request.method == 'GET':
+        return jsonify({'owner': owner, 'file_ids': shard_manager.index_files(owner)}), 200
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.json or {}
+    shard_manager.index_update(owner, add=data.get('add', []), remove=data.get('remove', []))
+    return jsonify({'status': 'updated'}), 200
+
+@app.route('/shard/import', methods=['POST'])
+def shard_import():
+    """Records and owner index entries sent by a shard that is splitting"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    shard_manager.import_batch(file_metadata, request.json or {})
+    return jsonify({'status': 'imported'}), 200
+
+@app.route('/shard/map', methods=['PUT'])
+def put_shard_map():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    adopted = shard_manager.update_map(request.json)
+    return jsonify({'status': 'adopted' if adopted else 'ignored', 'epoch': shard_manager.shard_map()['epoch']}), 200
+
+@app.route('/admin/shards/split', methods=['POST'])
+def split_shard():
+    """Move the upper half of this shard's range to a new, empty coordinator"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.json or {}
+    if not data.get('shard_id') or not data.get('url'):
+        return jsonify({'error': 'Missing shard_id or url'}), 400
+    try:
+        migration = shard_manager.split(file_metadata, data['shard_id'], data['url'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(migration), 202
+
+@app.route('/admin/shards/status', methods=['GET'])
+def shard_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'shard_id': SHARD_ID, 'shard_map': shard_manager.shard_map(),
+                    'migration': shard_manager.migration}), 200
 
 @app.route('/storage_agreements', methods=['GET'])
 def storage_agreements():
-    """List all storage agreements"""
-    if not contract:
+    """List storage agreements from the local index, optionally by user or node"""
+    refresh_contract()
+    if not agreement_indexer:
         return jsonify({'error': 'Smart contract not available'}), 500
     
-    # Load agreements from local storage
-    with open(AGREEMENTS_FILE, 'r') as f:
-        agreements = json.load(f)
+    user = request.args.get('user')
+    node_id = request.args.get('node_id')
     
-    return jsonify(list(agreements.values())), 200
+    etag = f"agreements-{agreements_generation}-{agreement_indexer.version}"
+    return json_with_etag(agreement_indexer.agreements(user=user, node_id=node_id), etag)
 
 @app.route('/sync_agreements', methods=['POST'])
 def sync_agreements():
-    """Sync blockchain agreements with local storage"""
-    if not contract:
+    """Bring the agreement index up to date with the chain"""
+    refresh_contract()
+    if not agreement_indexer:
         return jsonify({'error': 'Smart contract not available'}), 500
     
-    # For each node, get provider agreements from blockchain
-    updated_agreements = {}
-    
-    for node_id, node in nodes.items():
-        if 'wallet_address' in node and node['wallet_address']:
-            try:
-                # Convert wallet address to checksum format
-                wallet_address = Web3.to_checksum_address(node['wallet_address'])
-                
-                # Get provider agreements
-                provider_agreements = contract.functions.getProviderAgreements(node_id).call({
-                    'from': wallet_address
-                })
-                
-                for agreement in provider_agreements:
-                    agreement_id = f"{agreement[1]}-{agreement[2]}"  # node_id-sizeInMB
-                    updated_agreements[agreement_id] = {
-                        'agreement_id': agreement_id,
-                        'user': agreement[0],
-                        'node_id': agreement[1],
-                        'size_mb': agreement[2],
-                        'duration_days': agreement[3],
-                        'total_price': agreement[4],
-                        'start_time': agreement[5],
-                        'active': agreement[6]
-                    }
-            except Exception as e:
-                print(f"Error getting agreements for {node_id}: {e}")
-    
-    # Save updated agreements
-    with open(AGREEMENTS_FILE, 'w') as f:
-        json.dump(updated_agreements, f)
+    try:
+        with timed_chain_call('agreement_index_sync'):
+            applied = agreement_indexer.sync()
+    except Exception as e:
+        return jsonify({'error': f'Error syncing agreements: {str(e)}'}), 500
     
     return jsonify({
         'status': 'synced',
-        'agreements_count': len(updated_agreements)
+        'events_applied': applied,
+        'last_block': agreement_indexer.last_block,
+        'agreements_count': len(agreement_indexer.agreements())
     }), 200
 
 @app.route('/save_contract_abi', methods=['POST'])
@@ -271,10 +661,23 @@ def save_contract_abi():
     os.environ['CONTRACT_ADDRESS'] = contract_address
     
     # Initialize contract
-    global contract
-    contract = web3.eth.contract(address=contract_address, abi=contract_abi)
+    global contract_config_version
+    chain.set_contract(contract_address, contract_abi)
+    if state_backend:
+        contract_config_version = state_backend.put('config', 'contract', {'address': contract_address, 'abi': contract_abi})
+    start_agreement_indexer()
     
     return jsonify({'status': 'success'}), 200
 
+@app.route('/chain_status', methods=['GET'])
+def chain_status():
+    """Chain connection state from the background checks, without touching the chain"""
+    status = chain.status()
+    status['agreement_index_last_block'] = agreement_indexer.last_block if agreement_indexer else None
+    return jsonify(status), 200
+
+startup.mark('routes')
+startup.report()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,182 @@
+import os
+import json
+import uuid
+import threading
+
+
+class FileMetadataStore:
+    """In-process cache of the file metadata JSON file.
+
+    The file is parsed once and kept in memory; writes go to memory first and
+    are then persisted atomically. If the file is changed by another process
+    (detected through its mtime/size) it is reloaded on the next access.
+
+    Every record carries a version so that handlers can hand out ETags and
+    answer conditional requests with 304 Not Modified.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._records = {}
+        self._versions = {}
+        self._version = 0
+        self._generation = ''
+        self._stamp = None
+        if not os.path.exists(self.path):
+            self._persist()
+        self._load()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self._records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading metadata from {self.path}: {e}")
+            self._records = {}
+        # A new generation invalidates every ETag handed out before the reload
+        self._generation = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._versions = {file_id: 0 for file_id in self._records}
+        self._stamp = self._file_stamp()
+
+    def _refresh(self):
+        if self._file_stamp() != self._stamp:
+            self._load()
+
+    def _persist(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._records, f)
+        os.replace(tmp_path, self.path)
+        self._stamp = self._file_stamp()
+
+    def get(self, file_id):
+        with self._lock:
+            self._refresh()
+            return self._records.get(file_id)
+
+    def values(self):
+        with self._lock:
+            self._refresh()
+            return list(self._records.values())
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    def put(self, file_id, record):
+        with self._lock:
+            self._refresh()
+            self._records[file_id] = record
+            self._version += 1
+            self._versions[file_id] = self._version
+            self._persist()
+
+    def put_many(self, records):
+        with self._lock:
+            self._refresh()
+            self._version += 1
+            for file_id, record in records.items():
+                self._records[file_id] = record
+                self._versions[file_id] = self._version
+            self._persist()
+
+    def delete(self, file_id):
+        with self._lock:
+            self._refresh()
+            if file_id not in self._records:
+                return False
+            del self._records[file_id]
+            self._versions.pop(file_id, None)
+            self._version += 1
+            self._persist()
+            return True
+
+    def delete_many(self, file_ids):
+        with self._lock:
+            self._refresh()
+            for file_id in file_ids:
+                self._records.pop(file_id, None)
+                self._versions.pop(file_id, None)
+            self._version += 1
+            self._persist()
+
+    def etag(self, file_id=None):
+        """ETag for one record, or for the whole collection if no file_id"""
+        with self._lock:
+            self._refresh()
+            if file_id is None:
+                return f"files-{self._generation}-{self._version}"
+            return f"file-{self._generation}-{self._versions.get(file_id, 0)}"
+
+
+class SharedMetadataStore:
+    """File metadata kept in a shared state backend.
+
+    Exposes the same interface as FileMetadataStore so several coordinator
+    workers can serve the same files. Listings are cached per process and
+    reused until the namespace version moves. A legacy JSON file is
+    imported on first use when the backend is still empty.
+    """
+
+    def __init__(self, backend, namespace='files', legacy_path=None):
+        self.backend = backend
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._listing = None
+        self._listing_version = None
+        if legacy_path and os.path.exists(legacy_path) and backend.count(namespace) == 0:
+            self._import(legacy_path)
+
+    def _import(self, legacy_path):
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading metadata from {legacy_path}: {e}")
+            return
+        if records:
+            self.backend.put_many(self.namespace, records)
+            print(f"Imported {len(records)} file records from {legacy_path}")
+
+    def get(self, file_id):
+        return self.backend.get(self.namespace, file_id)
+
+    def values(self):
+        version = self.backend.version(self.namespace)
+        with self._lock:
+            if self._listing_version != version:
+                self._listing = list(self.backend.items(self.namespace).values())
+                self._listing_version = version
+            return self._listing
+
+    def __len__(self):
+        return self.backend.count(self.namespace)
+
+    def put(self, file_id, record):
+        self.backend.put(self.namespace, file_id, record)
+
+    def put_many(self, records):
+        self.backend.put_many(self.namespace, records)
+
+    def delete(self, file_id):
+        return self.backend.delete(self.namespace, file_id)
+
+    def delete_many(self, file_ids):
+        for file_id in file_ids:
+            self.backend.delete(self.namespace, file_id)
+
+    def etag(self, file_id=None):
+        """ETag for one record, or for the whole collection if no file_id"""
+        if file_id is None:
+            return f"files-{self.backend.version(self.namespace)}"
+        return f"file-{self.backend.get(self.namespace, file_id, with_version=True)[1]}"
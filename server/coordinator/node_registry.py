@@ -0,0 +1,298 @@
+import time
+import threading
+from collections import deque
+
+import requests
+
+from state_backend import MemoryBackend
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+# Outcomes needed before the error rate alone can degrade a node
+MIN_SAMPLES = 5
+
+# Backend namespaces: node records only change when placement-relevant
+# fields or the health state change, so their version doubles as the ETag
+# of node listings; heartbeats and rolling stats are written on every
+# observation
+NODES = 'nodes'
+HEALTH = 'node_health'
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+class NodeStats:
+    """Rolling health statistics for one storage node"""
+
+    def __init__(self, window):
+        self.probe_latencies = deque(maxlen=window)
+        self.transfer_latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.latency_ewma = None
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+
+    @classmethod
+    def from_state(cls, state, window):
+        stats = cls(window)
+        if state:
+            stats.probe_latencies.extend(state['probe_latencies'])
+            stats.transfer_latencies.extend(state['transfer_latencies'])
+            stats.outcomes.extend(state['outcomes'])
+            stats.latency_ewma = state['latency_ewma']
+            stats.consecutive_failures = state['consecutive_failures']
+            stats.last_success = state['last_success']
+            stats.last_failure = state['last_failure']
+            stats.last_error = state['last_error']
+        return stats
+
+    def to_state(self):
+        return {
+            'probe_latencies': list(self.probe_latencies),
+            'transfer_latencies': list(self.transfer_latencies),
+            'outcomes': list(self.outcomes),
+            'latency_ewma': self.latency_ewma,
+            'consecutive_failures': self.consecutive_failures,
+            'last_success': self.last_success,
+            'last_failure': self.last_failure,
+            'last_error': self.last_error
+        }
+
+    def record(self, ok, latency, source, error=None, now=None):
+        now = now or time.time()
+        self.outcomes.append(bool(ok))
+        if ok:
+            self.consecutive_failures = 0
+            self.last_success = now
+            if latency is not None:
+                (self.probe_latencies if source == 'probe' else self.transfer_latencies).append(latency)
+                if source == 'probe':
+                    self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.consecutive_failures += 1
+            self.last_failure = now
+            self.last_error = error
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def to_dict(self):
+        return {
+            'latency_ewma_ms': round(self.latency_ewma * 1000, 2) if self.latency_ewma is not None else None,
+            'probe_p99_ms': round(_percentile(self.probe_latencies, 99) * 1000, 2) if self.probe_latencies else None,
+            'transfer_p50_ms': round(_percentile(self.transfer_latencies, 50) * 1000, 2) if self.transfer_latencies else None,
+            'transfer_p99_ms': round(_percentile(self.transfer_latencies, 99) * 1000, 2) if self.transfer_latencies else None,
+            'error_rate': round(self.error_rate, 4),
+            'samples': len(self.outcomes),
+            'consecutive_failures': self.consecutive_failures,
+            'last_success': self.last_success,
+            'last_failure': self.last_failure,
+            'last_error': self.last_error
+        }
+
+    def suggested_timeouts(self):
+        """(connect, read) timeouts in seconds a client should use for this node"""
+        probe_p99 = _percentile(self.probe_latencies, 99)
+        transfer_p99 = _percentile(self.transfer_latencies, 99)
+        connect = min(5.0, max(0.5, 3 * probe_p99)) if probe_p99 is not None else 3.0
+        read = min(120.0, max(5.0, 4 * (transfer_p99 or probe_p99 or 0)))
+        return round(connect, 3), round(read, 3)
+
+
+class NodeRegistry:
+    """Registry of storage nodes with heartbeats, probes and health states.
+
+    Nodes move between healthy, degraded and down based on heartbeats
+    (`/register` calls), active `/status` probes and transfer outcomes
+    reported by clients. Down nodes are hidden from placement and evicted
+    once they have been silent for `evict_after` seconds.
+
+    State lives in a StateBackend so every coordinator worker sees the same
+    registry; without one it is kept in memory and snapshotted to
+    `state_file` so a restart keeps its view of the cluster.
+    """
+
+    def __init__(self, state_file=None, backend=None, heartbeat_timeout=60.0, evict_after=600.0,
+                 failure_threshold=3, degraded_error_rate=0.2, window=50, save_interval=10.0):
+        self.backend = backend or MemoryBackend(state_file, save_interval=save_interval)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.evict_after = evict_after
+        self.failure_threshold = failure_threshold
+        self.degraded_error_rate = degraded_error_rate
+        self.window = window
+        self._thread = None
+
+    @property
+    def version(self):
+        return self.backend.version(NODES)
+
+    def etag(self):
+        return f"nodes-{self.version}"
+
+    def _lock(self, node_id):
+        return self.backend.lock(f'node:{node_id}', ttl=10.0)
+
+    def _state(self, stats, last_heartbeat, now):
+        if stats.consecutive_failures >= self.failure_threshold:
+            return DOWN
+        if (len(stats.outcomes) >= MIN_SAMPLES and stats.error_rate > self.degraded_error_rate) \
+                or now - last_heartbeat > self.heartbeat_timeout:
+            return DEGRADED
+        return HEALTHY
+
+    def _store(self, node_id, previous, record, health, stats):
+        if record != previous:
+            if previous and record['state'] != previous['state']:
+                print(f"Node {node_id} is now {record['state']}")
+            self.backend.put(NODES, node_id, record)
+        health['stats'] = stats.to_state()
+        self.backend.put(HEALTH, node_id, health)
+
+    def register(self, node):
+        """Add or refresh a node; every call counts as a heartbeat"""
+        now = time.time()
+        node_id = node['node_id']
+        with self._lock(node_id):
+            previous = self.backend.get(NODES, node_id)
+            health = self.backend.get(HEALTH, node_id) or {}
+            stats = NodeStats.from_state(health.get('stats'), self.window)
+            health['last_heartbeat'] = now
+            record = dict(node)
+            record['registered_at'] = previous['registered_at'] if previous else now
+            record['state'] = self._state(stats, now, now)
+            self._store(node_id, previous, record, health, stats)
+            return record
+
+    def deregister(self, node_id):
+        with self._lock(node_id):
+            self.backend.delete(HEALTH, node_id)
+            return self.backend.delete(NODES, node_id)
+
+    def get(self, node_id):
+        return self.backend.get(NODES, node_id)
+
+    def __len__(self):
+        return self.backend.count(NODES)
+
+    def all(self):
+        return list(self.backend.items(NODES).values())
+
+    def available(self, tier=None):
+        """Nodes with space to offer, healthy ones only unless none are healthy.
+
+        With a tier, nodes reporting free space on that tier come first,
+        most free space first.
+        """
+        candidates = [
+            node for node in self.all()
+            if node['state'] != DOWN and (
+                node.get('used_mb', 0) < node.get('limit_mb', 0) or node.get('locked_mb', 0) > 0)
+        ]
+        healthy = [node for node in candidates if node['state'] == HEALTHY]
+        nodes = healthy or candidates
+        if tier:
+            def tier_free(node):
+                free = ((node.get('tiers') or {}).get(tier) or {}).get('free_mb')
+                return free if free is not None else 0
+            nodes = sorted(nodes, key=tier_free, reverse=True)
+        return nodes
+
+    def record(self, node_id, ok, latency=None, source='client', error=None):
+        """Record the outcome of a probe or a client transfer against a node"""
+        now = time.time()
+        with self._lock(node_id):
+            previous = self.backend.get(NODES, node_id)
+            if previous is None:
+                return
+            health = self.backend.get(HEALTH, node_id) or {'last_heartbeat': 0}
+            stats = NodeStats.from_state(health.get('stats'), self.window)
+            stats.record(ok, latency, source, error, now)
+            record = dict(previous, state=self._state(stats, health['last_heartbeat'], now))
+            self._store(node_id, previous, record, health, stats)
+
+    def evaluate(self):
+        """Re-evaluate every node and evict the ones that stayed down too long"""
+        now = time.time()
+        for node_id in list(self.backend.items(NODES)):
+            with self._lock(node_id):
+                previous = self.backend.get(NODES, node_id)
+                if previous is None:
+                    continue
+                health = self.backend.get(HEALTH, node_id) or {'last_heartbeat': 0}
+                stats = NodeStats.from_state(health.get('stats'), self.window)
+                record = dict(previous, state=self._state(stats, health['last_heartbeat'], now))
+                last_seen = max(health['last_heartbeat'], stats.last_success or 0)
+                if record['state'] == DOWN and now - last_seen > self.evict_after:
+                    print(f"Evicting node {node_id}, silent for {int(now - last_seen)}s")
+                    self.deregister(node_id)
+                elif record != previous:
+                    self._store(node_id, previous, record, health, stats)
+        if isinstance(self.backend, MemoryBackend):
+            self.backend.flush()
+
+    def stats(self):
+        now = time.time()
+        health_by_node = self.backend.items(HEALTH)
+        result = []
+        for node_id, node in self.backend.items(NODES).items():
+            health = health_by_node.get(node_id, {'last_heartbeat': 0})
+            stats = NodeStats.from_state(health.get('stats'), self.window)
+            connect_timeout, read_timeout = stats.suggested_timeouts()
+            entry = stats.to_dict()
+            entry.update({
+                'node_id': node_id,
+                'url': node['url'],
+                'state': node['state'],
+                'heartbeat_age_s': round(now - health['last_heartbeat'], 1),
+                'connect_timeout_s': connect_timeout,
+                'read_timeout_s': read_timeout
+            })
+            result.append(entry)
+        return result
+
+    def probe(self, timeout):
+        """Call /status on every node and record the result"""
+        for node in self.all():
+            start = time.perf_counter()
+            try:
+                response = requests.get(f"{node['url']}/status", timeout=timeout)
+                ok = response.status_code == 200
+                error = None if ok else f'HTTP {response.status_code}'
+            except Exception as e:
+                ok, error = False, str(e)
+            self.record(node['node_id'], ok, time.perf_counter() - start, source='probe', error=error)
+
+    def start(self, probe_interval, probe_timeout, lease=None):
+        """Probe nodes and re-evaluate health from a background thread.
+
+        With a LeaderLease only the worker holding it probes, so a node is
+        not probed once per worker.
+        """
+        if probe_interval <= 0 or self._thread:
+            return
+
+        def run():
+            while True:
+                time.sleep(probe_interval)
+                if lease and not lease.held():
+                    continue
+                try:
+                    self.probe(probe_timeout)
+                    self.evaluate()
+                except Exception as e:
+                    print(f"Node health check failed: {e}")
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
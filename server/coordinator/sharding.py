@@ -0,0 +1,374 @@
+import bisect
+import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+import requests
+
+# File ids and owners are placed on a 32-bit ring split into contiguous ranges
+HASH_SPACE = 2 ** 32
+
+# Backend namespaces
+CONFIG = 'config'
+SHARD_MAP_KEY = 'shard_map'
+MIGRATION_KEY = 'shard_migration'
+OWNERS = 'owners'
+# Extra references to chunks shared by clones or identical uploads, keyed by chunk_id
+CHUNK_REFS = 'chunk_refs'
+IMPORT_BATCH = 500
+
+
+def shard_hash(key):
+    return int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def owner_namespace(owner):
+    return f'owner:{owner}'
+
+
+class WrongShard(Exception):
+    """Raised when another shard answered that it does not own a key"""
+
+    def __init__(self, shard_map):
+        super().__init__('wrong shard')
+        self.shard_map = shard_map
+
+
+class ShardManager:
+    """This coordinator's slice of the file metadata and of the owner index.
+
+    File metadata is placed by the hash of `file_id` and the owner index
+    (owner -> file ids) by the hash of the owner, both on the same ranges.
+    Reference counts of chunks shared by cloned files are placed by the
+    hash of `chunk_id`, so a file and its clones agree on them wherever
+    their records live. The shard map carries an epoch; a shard that
+    receives a key it does not own answers 421 with its map so callers can
+    catch up. A shard splits online by copying the upper half of its range
+    to a new shard while forwarding writes to it, then publishing a map
+    with a higher epoch.
+    """
+
+    def __init__(self, backend, shard_id, shard_url=None, admin_token=''):
+        self.backend = backend
+        self.shard_id = shard_id
+        self.shard_url = shard_url
+        self.admin_token = admin_token
+        self._lock = threading.Lock()
+        self._map = None
+        self._migration = None
+        self._config_version = None
+        self._starts = []
+        if self.backend.get(CONFIG, SHARD_MAP_KEY) is None:
+            self.backend.put(CONFIG, SHARD_MAP_KEY, {
+                'epoch': 0,
+                'shards': [{'shard_id': shard_id, 'url': shard_url, 'start': 0, 'end': HASH_SPACE}]
+            })
+
+    def _load_config(self):
+        # The map and the split in progress are shared by every worker of this shard
+        version = self.backend.version(CONFIG)
+        with self._lock:
+            if version != self._config_version:
+                self._map = self.backend.get(CONFIG, SHARD_MAP_KEY)
+                self._map['shards'].sort(key=lambda shard: shard['start'])
+                self._starts = [shard['start'] for shard in self._map['shards']]
+                self._migration = self.backend.get(CONFIG, MIGRATION_KEY)
+                self._config_version = version
+
+    def shard_map(self):
+        self._load_config()
+        return self._map
+
+    @property
+    def migration(self):
+        """{'start', 'end', 'target', 'shard_id', 'state', 'copied', 'error'} of the last split"""
+        self._load_config()
+        return self._migration
+
+    def _save_migration(self, migration):
+        self.backend.put(CONFIG, MIGRATION_KEY, migration)
+
+    def shard_for(self, key):
+        shard_map = self.shard_map()
+        return shard_map['shards'][bisect.bisect_right(self._starts, shard_hash(key)) - 1]
+
+    def owns(self, key):
+        return self.shard_for(key)['shard_id'] == self.shard_id
+
+    def update_map(self, shard_map):
+        """Adopt a map with a newer epoch, return whether it was adopted"""
+        if shard_map['epoch'] <= self.shard_map()['epoch']:
+            return False
+        self.backend.put(CONFIG, SHARD_MAP_KEY, shard_map)
+        if hasattr(self.backend, 'flush'):
+            self.backend.flush(force=True)
+        print(f"Adopted shard map epoch {shard_map['epoch']}")
+        return True
+
+    def _headers(self):
+        return {'X-Admin-Token': self.admin_token}
+
+    def file_lock(self, file_id, ttl=10.0):
+        """Serializes changes to a file's record, with clones of it and with a split copying it"""
+        return self.backend.lock(f'file:{file_id}', ttl=ttl)
+
+    def owner_lock(self, owner, ttl=10.0):
+        return self.backend.lock(f'owner:{owner}', ttl=ttl)
+
+    def _migrating(self, key):
+        # Writes that passed an ownership check just before the cutover are
+        # still forwarded while the moved range is cleaned up
+        migration = self.migration
+        if migration and migration['state'] in ('copying', 'cleanup'):
+            if migration['start'] <= shard_hash(key) < migration['end']:
+                return migration['target']
+        return None
+
+    # Owner index
+
+    def index_files(self, owner):
+        return sorted(self.backend.items(owner_namespace(owner)))
+
+    def index_update(self, owner, add=(), remove=()):
+        """Apply owner index changes that belong to this shard"""
+        # Forwarded under the lock, so a split copying this owner sends it before or after
+        with self.owner_lock(owner):
+            if add:
+                if self.backend.get(OWNERS, owner) is None:
+                    self.backend.put(OWNERS, owner, True)
+                self.backend.put_many(owner_namespace(owner), {file_id: True for file_id in add})
+            for file_id in remove:
+                self.backend.delete(owner_namespace(owner), file_id)
+            target = self._migrating(owner)
+            if target:
+                self._post(target, '/shard/import',
+                           {'owners': {owner: list(add)}, 'owners_removed': {owner: list(remove)}})
+
+    def record_owner(self, owner, add=(), remove=()):
+        """Update the owner index entry, on this shard or on the one owning the owner"""
+        if not owner:
+            return
+        for _ in range(2):
+            shard = self.shard_for(owner)
+            if shard['shard_id'] == self.shard_id:
+                self.index_update(owner, add, remove)
+                return
+            try:
+                self._post(shard['url'], f'/owner_index/{owner}', {'add': list(add), 'remove': list(remove)})
+                return
+            except WrongShard as e:
+                self.update_map(e.shard_map)
+        print(f"Owner index update for {owner} failed, shard map did not converge")
+
+    # Shared chunk references
+
+    def ref_update(self, add=(), remove=(), claim=()):
+        """Apply reference changes to chunks placed on this shard, return the chunk ids released.
+
+        An entry holds the references beyond the first. Encrypted chunks are
+        unique to the upload that made them, so one without an entry has
+        exactly one reference and only clones cost an entry. Unencrypted
+        chunk ids are content hashes that another upload may share, so a
+        file that starts using one `claim`s it: a chunk nobody claimed yet
+        gets an entry of 0, a known one another reference. Ids may repeat,
+        once per reference added or removed. Removing the last reference
+        releases the chunk for deletion from its node.
+        """
+        added, removed, claimed = Counter(add), Counter(remove), Counter(claim)
+        released, changed = [], {}
+        with self.backend.lock(CHUNK_REFS, ttl=10.0):
+            for chunk_id in set(added) | set(removed) | set(claimed):
+                extra = self.backend.get(CHUNK_REFS, chunk_id)
+                if extra is not None:
+                    references = extra + 1
+                else:
+                    references = 0 if claimed[chunk_id] else 1
+                references += claimed[chunk_id] + added[chunk_id] - removed[chunk_id]
+                if references <= 0:
+                    released.append(chunk_id)
+                    remaining = None
+                elif extra is None and references == 1 and not claimed[chunk_id]:
+                    continue
+                else:
+                    # Kept at 0 once known, so the next upload of the same content counts
+                    remaining = references - 1
+                if remaining == extra:
+                    continue
+                changed[chunk_id] = remaining
+                if remaining is not None:
+                    self.backend.put(CHUNK_REFS, chunk_id, remaining)
+                else:
+                    self.backend.delete(CHUNK_REFS, chunk_id)
+            if changed:
+                # A lost decrement leaks a chunk, a lost increment deletes one still in use
+                if hasattr(self.backend, 'flush'):
+                    self.backend.flush(force=True)
+                # Forwarded under the lock, so a split copying the counts cannot send older ones after
+                moving = {chunk_id: extra for chunk_id, extra in changed.items() if self._migrating(chunk_id)}
+                if moving:
+                    self._post(self.migration['target'], '/shard/import', {'refs': moving})
+        return released
+
+    def chunk_refs(self, add=(), remove=(), claim=(), attempts=2):
+        """Update chunk references on the shards owning them, return the chunk ids released"""
+        by_shard = {}
+        for position, chunk_ids in enumerate((add, remove, claim)):
+            for chunk_id in chunk_ids:
+                shard = self.shard_for(chunk_id)
+                by_shard.setdefault((shard['shard_id'], shard['url']), ([], [], []))[position].append(chunk_id)
+        released = []
+        for (shard_id, url), (shard_add, shard_remove, shard_claim) in by_shard.items():
+            if shard_id == self.shard_id:
+                released.extend(self.ref_update(shard_add, shard_remove, shard_claim))
+                continue
+            try:
+                result = self._post(url, '/chunk_refs', {'add': shard_add, 'remove': shard_remove, 'claim': shard_claim})
+            except WrongShard as e:
+                if attempts <= 1:
+                    raise RuntimeError('Chunk reference update failed, shard map did not converge')
+                self.update_map(e.shard_map)
+                released.extend(self.chunk_refs(shard_add, shard_remove, shard_claim, attempts - 1))
+                continue
+            released.extend(result['released'])
+        return released
+
+    # Replication of writes while a split is copying
+
+    def forward_put(self, file_id, record):
+        target = self._migrating(file_id)
+        if target:
+            self._post(target, '/shard/import', {'files': {file_id: record}})
+
+    def forward_delete(self, file_id):
+        target = self._migrating(file_id)
+        if target:
+            self._post(target, '/shard/import', {'deleted': [file_id]})
+
+    def import_batch(self, file_metadata, data):
+        """Apply a batch sent by a splitting shard, ownership is not checked"""
+        if data.get('files'):
+            file_metadata.put_many(data['files'])
+        for file_id in data.get('deleted', []):
+            file_metadata.delete(file_id)
+        for owner, file_ids in data.get('owners', {}).items():
+            if file_ids:
+                self.index_update(owner, add=file_ids)
+        for owner, file_ids in data.get('owners_removed', {}).items():
+            if file_ids:
+                self.index_update(owner, remove=file_ids)
+        # Reference counts arrive as absolute values, so a replayed batch is harmless
+        for chunk_id, extra in data.get('refs', {}).items():
+            if extra is not None:
+                self.backend.put(CHUNK_REFS, chunk_id, extra)
+            else:
+                self.backend.delete(CHUNK_REFS, chunk_id)
+
+    def _post(self, url, path, payload):
+        response = requests.post(f'{url}{path}', json=payload, headers=self._headers(), timeout=30)
+        if response.status_code == 421:
+            raise WrongShard(response.json()['shard_map'])
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} on {url} failed: HTTP {response.status_code} {response.text}')
+        return response.json()
+
+    # Online split
+
+    def split(self, file_metadata, new_shard_id, new_url):
+        """Start moving the upper half of this shard's range to a new shard"""
+        if not self.shard_url:
+            raise ValueError('SHARD_URL must be set before splitting')
+        if self.migration and self.migration['state'] in ('copying', 'cleanup'):
+            raise ValueError('A split is already in progress')
+        own = [shard for shard in self.shard_map()['shards'] if shard['shard_id'] == self.shard_id]
+        if not own:
+            raise ValueError('This coordinator owns no range')
+        shard = own[0]
+        if any(s['shard_id'] == new_shard_id for s in self.shard_map()['shards']):
+            raise ValueError(f'Shard {new_shard_id} already exists')
+        migration = {
+            'start': (shard['start'] + shard['end']) // 2,
+            'end': shard['end'],
+            'target': new_url,
+            'shard_id': new_shard_id,
+            'state': 'copying',
+            'copied': 0,
+            'started_at': time.time(),
+            'error': None
+        }
+        self._save_migration(migration)
+        threading.Thread(target=self._run_split, args=(file_metadata, migration), daemon=True).start()
+        return migration
+
+    def _run_split(self, file_metadata, migration):
+        def in_range(key):
+            return migration['start'] <= shard_hash(key) < migration['end']
+
+        try:
+            # Each batch is read again under the locks that writers forward
+            # under, so a forwarded put or delete is never overtaken by an
+            # older copy of the same key
+            ids = [record['file_id'] for record in file_metadata.values() if in_range(record['file_id'])]
+            for i in range(0, len(ids), IMPORT_BATCH):
+                batch = sorted(ids[i:i + IMPORT_BATCH])
+                with ExitStack() as locks:
+                    for file_id in batch:
+                        locks.enter_context(self.file_lock(file_id, ttl=60.0))
+                    records = {file_id: file_metadata.get(file_id) for file_id in batch}
+                    self._post(migration['target'], '/shard/import', {
+                        'files': {file_id: record for file_id, record in records.items() if record is not None},
+                        'deleted': [file_id for file_id, record in records.items() if record is None]
+                    })
+                migration['copied'] += len(batch)
+                self._save_migration(migration)
+
+            owners = [owner for owner in self.backend.items(OWNERS) if in_range(owner)]
+            for owner in owners:
+                with self.owner_lock(owner, ttl=60.0):
+                    self._post(migration['target'], '/shard/import', {'owners': {owner: self.index_files(owner)}})
+
+            ref_ids = [chunk_id for chunk_id in self.backend.items(CHUNK_REFS) if in_range(chunk_id)]
+            for i in range(0, len(ref_ids), IMPORT_BATCH):
+                with self.backend.lock(CHUNK_REFS, ttl=60.0):
+                    refs = {chunk_id: self.backend.get(CHUNK_REFS, chunk_id) for chunk_id in ref_ids[i:i + IMPORT_BATCH]}
+                    self._post(migration['target'], '/shard/import', {'refs': refs})
+
+            # Publish the new map, first on the new shard so it accepts its range
+            old_map = self.shard_map()
+            shards = []
+            for shard in old_map['shards']:
+                if shard['shard_id'] == self.shard_id:
+                    shards.append(dict(shard, url=self.shard_url, end=migration['start']))
+                    shards.append({'shard_id': migration['shard_id'], 'url': migration['target'],
+                                   'start': migration['start'], 'end': migration['end']})
+                else:
+                    shards.append(shard)
+            new_map = {'epoch': old_map['epoch'] + 1, 'shards': shards}
+            requests.put(f"{migration['target']}/shard/map", json=new_map,
+                         headers=self._headers(), timeout=30).raise_for_status()
+            # Adopt the map before leaving the copying state, so moved keys are
+            # answered with 421 from here on and never written here unforwarded
+            self.update_map(new_map)
+            migration['state'] = 'cleanup'
+            self._save_migration(migration)
+
+            # Keys written in the range while copying were forwarded, drop them too
+            ids = [record['file_id'] for record in file_metadata.values() if in_range(record['file_id'])]
+            owners = [owner for owner in self.backend.items(OWNERS) if in_range(owner)]
+            ref_ids = [chunk_id for chunk_id in self.backend.items(CHUNK_REFS) if in_range(chunk_id)]
+            file_metadata.delete_many(ids)
+            for owner in owners:
+                for file_id in self.index_files(owner):
+                    self.backend.delete(owner_namespace(owner), file_id)
+                self.backend.delete(OWNERS, owner)
+            for chunk_id in ref_ids:
+                self.backend.delete(CHUNK_REFS, chunk_id)
+            migration['state'] = 'done'
+            self._save_migration(migration)
+            print(f"Split to {migration['shard_id']} done, moved {len(ids)} files, {len(owners)} owners "
+                  f"and {len(ref_ids)} chunk references")
+        except Exception as e:
+            migration['state'] = 'failed'
+            migration['error'] = str(e)
+            self._save_migration(migration)
+            print(f"Shard split failed: {e}")
@@ -0,0 +1,386 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+_HOLDER_SUFFIX = uuid.uuid4().hex[:6]
+
+
+def holder_id():
+    """Identity of this worker for leases; recomputed after a fork"""
+    return f"{socket.gethostname()}-{os.getpid()}-{_HOLDER_SUFFIX}"
+
+
+class StateBackend:
+    """Namespaced key/value store shared by coordinator workers.
+
+    Values are JSON documents. Every write bumps a per-namespace version that
+    is also stored with the written key, so ETags built from versions agree
+    between workers. Leases provide leader election and cross-process locks.
+    """
+
+    def __init__(self):
+        self._held = threading.local()
+
+    @contextmanager
+    def lock(self, name, ttl=30.0, poll=0.005):
+        """Cross-process mutex built on a lease, re-entrant within a thread"""
+        depths = getattr(self._held, 'depths', None)
+        if depths is None:
+            depths = self._held.depths = {}
+        if depths.get(name):
+            depths[name] += 1
+            try:
+                yield
+            finally:
+                depths[name] -= 1
+            return
+
+        lease_name = f'lock:{name}'
+        token = f'{holder_id()}-{threading.get_ident()}'
+        while not self.acquire_lease(lease_name, token, ttl):
+            time.sleep(poll)
+        depths[name] = 1
+        try:
+            yield
+        finally:
+            depths[name] = 0
+            self.release_lease(lease_name, token)
+
+
+class MemoryBackend(StateBackend):
+    """Single-process backend, optionally snapshotted to a JSON file"""
+
+    def __init__(self, path=None, save_interval=10.0):
+        super().__init__()
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.RLock()
+        # ns -> key -> (version, json text)
+        self._data = {}
+        self._versions = {}
+        self._leases = {}
+        self._dirty = False
+        self._last_save = 0.0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    snapshot = json.load(f)
+                self._versions = snapshot.get('versions', {})
+                self._data = {
+                    ns: {key: (entry[0], json.dumps(entry[1])) for key, entry in entries.items()}
+                    for ns, entries in snapshot.get('data', {}).items()
+                }
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Error loading state from {path}: {e}")
+
+    def flush(self, force=False):
+        """Write the snapshot file if it is dirty and the save interval has passed"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            if not force and time.time() - self._last_save < self.save_interval:
+                return
+            snapshot = {
+                'versions': self._versions,
+                'data': {
+                    ns: {key: [version, json.loads(text)] for key, (version, text) in entries.items()}
+                    for ns, entries in self._data.items()
+                }
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.time()
+
+    def _bump(self, ns):
+        self._versions[ns] = self._versions.get(ns, 0) + 1
+        self._dirty = True
+        return self._versions[ns]
+
+    def get(self, ns, key, with_version=False):
+        with self._lock:
+            entry = self._data.get(ns, {}).get(key)
+        if entry is None:
+            return (None, 0) if with_version else None
+        value = json.loads(entry[1])
+        return (value, entry[0]) if with_version else value
+
+    def items(self, ns):
+        with self._lock:
+            entries = dict(self._data.get(ns, {}))
+        return {key: json.loads(text) for key, (version, text) in entries.items()}
+
+    def put(self, ns, key, value):
+        text = json.dumps(value)
+        with self._lock:
+            version = self._bump(ns)
+            self._data.setdefault(ns, {})[key] = (version, text)
+        self.flush()
+        return version
+
+    def put_many(self, ns, mapping):
+        encoded = {key: json.dumps(value) for key, value in mapping.items()}
+        with self._lock:
+            version = self._bump(ns)
+            entries = self._data.setdefault(ns, {})
+            for key, text in encoded.items():
+                entries[key] = (version, text)
+        self.flush()
+        return version
+
+    def delete(self, ns, key):
+        with self._lock:
+            if self._data.get(ns, {}).pop(key, None) is None:
+                return False
+            self._bump(ns)
+        self.flush()
+        return True
+
+    def count(self, ns):
+        with self._lock:
+            return len(self._data.get(ns, {}))
+
+    def version(self, ns):
+        with self._lock:
+            return self._versions.get(ns, 0)
+
+    def acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(name)
+            if current and current[0] != holder and current[1] > now:
+                return False
+            self._leases[name] = (holder, now + ttl)
+            return True
+
+    def release_lease(self, name, holder):
+        with self._lock:
+            if self._leases.get(name, (None,))[0] == holder:
+                del self._leases[name]
+
+
+class SQLiteBackend(StateBackend):
+    """Shared state in a SQLite database, for several workers on one host"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                ns TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL, value TEXT NOT NULL,
+                PRIMARY KEY (ns, key));
+            CREATE TABLE IF NOT EXISTS versions (ns TEXT PRIMARY KEY, version INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL);
+        ''')
+
+    def _conn(self):
+        # One connection per thread (and per process, workers connect after forking)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _bump(conn, ns):
+        conn.execute(
+            'INSERT INTO versions (ns, version) VALUES (?, 1) '
+            'ON CONFLICT(ns) DO UPDATE SET version = version + 1', (ns,))
+        return conn.execute('SELECT version FROM versions WHERE ns = ?', (ns,)).fetchone()[0]
+
+    def get(self, ns, key, with_version=False):
+        row = self._conn().execute(
+            'SELECT version, value FROM entries WHERE ns = ? AND key = ?', (ns, key)).fetchone()
+        if row is None:
+            return (None, 0) if with_version else None
+        value = json.loads(row[1])
+        return (value, row[0]) if with_version else value
+
+    def items(self, ns):
+        rows = self._conn().execute('SELECT key, value FROM entries WHERE ns = ?', (ns,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def put(self, ns, key, value):
+        return self.put_many(ns, {key: value})
+
+    def put_many(self, ns, mapping):
+        rows = [(key, json.dumps(value)) for key, value in mapping.items()]
+        with self._write() as conn:
+            version = self._bump(conn, ns)
+            conn.executemany(
+                'INSERT OR REPLACE INTO entries (ns, key, version, value) VALUES (?, ?, ?, ?)',
+                [(ns, key, version, text) for key, text in rows])
+        return version
+
+    def delete(self, ns, key):
+        with self._write() as conn:
+            deleted = conn.execute('DELETE FROM entries WHERE ns = ? AND key = ?', (ns, key)).rowcount
+            if deleted:
+                self._bump(conn, ns)
+        return bool(deleted)
+
+    def count(self, ns):
+        return self._conn().execute('SELECT COUNT(*) FROM entries WHERE ns = ?', (ns,)).fetchone()[0]
+
+    def version(self, ns):
+        row = self._conn().execute('SELECT version FROM versions WHERE ns = ?', (ns,)).fetchone()
+        return row[0] if row else 0
+
+    def acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute('SELECT holder, expires FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO leases (name, holder, expires) VALUES (?, ?, ?)',
+                         (name, holder, now + ttl))
+        return True
+
+    def release_lease(self, name, holder):
+        with self._write() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+
+# Entries are stored as "[version, value]" so a read returns both at once
+_REDIS_PUT = """
+local version = redis.call('incr', KEYS[2])
+for i = 1, #ARGV, 2 do
+    redis.call('hset', KEYS[1], ARGV[i], '[' .. version .. ',' .. ARGV[i + 1] .. ']')
+end
+return version
+"""
+
+_REDIS_DELETE = """
+if redis.call('hdel', KEYS[1], ARGV[1]) == 1 then
+    redis.call('incr', KEYS[2])
+    return 1
+end
+return 0
+"""
+
+_REDIS_ACQUIRE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+_REDIS_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend(StateBackend):
+    """Shared state in a Redis-compatible server, for coordinators on several hosts"""
+
+    def __init__(self, url, prefix='dstore'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('STATE_BACKEND points to Redis but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._put = self.client.register_script(_REDIS_PUT)
+        self._delete = self.client.register_script(_REDIS_DELETE)
+        self._acquire = self.client.register_script(_REDIS_ACQUIRE)
+        self._release = self.client.register_script(_REDIS_RELEASE)
+
+    def _keys(self, ns):
+        return [f'{self.prefix}:{ns}', f'{self.prefix}:version:{ns}']
+
+    def get(self, ns, key, with_version=False):
+        raw = self.client.hget(self._keys(ns)[0], key)
+        if raw is None:
+            return (None, 0) if with_version else None
+        version, value = json.loads(raw)
+        return (value, version) if with_version else value
+
+    def items(self, ns):
+        return {
+            key.decode('utf-8'): json.loads(raw)[1]
+            for key, raw in self.client.hgetall(self._keys(ns)[0]).items()
+        }
+
+    def put(self, ns, key, value):
+        return self.put_many(ns, {key: value})
+
+    def put_many(self, ns, mapping):
+        args = []
+        for key, value in mapping.items():
+            args.extend([key, json.dumps(value)])
+        return int(self._put(keys=self._keys(ns), args=args))
+
+    def delete(self, ns, key):
+        return bool(self._delete(keys=self._keys(ns), args=[key]))
+
+    def count(self, ns):
+        return self.client.hlen(self._keys(ns)[0])
+
+    def version(self, ns):
+        return int(self.client.get(self._keys(ns)[1]) or 0)
+
+    def acquire_lease(self, name, holder, ttl):
+        return bool(self._acquire(keys=[f'{self.prefix}:lease:{name}'], args=[holder, int(ttl * 1000)]))
+
+    def release_lease(self, name, holder):
+        self._release(keys=[f'{self.prefix}:lease:{name}'], args=[holder])
+
+
+def open_backend(url):
+    """Backend for a STATE_BACKEND url: sqlite:///<path> or redis://host:port/db"""
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
+
+
+class LeaderLease:
+    """Elects a single worker to run a background loop.
+
+    `held()` renews the lease for the current holder or takes it over once
+    the previous holder stopped renewing for `ttl` seconds.
+    """
+
+    def __init__(self, backend, name, ttl=30.0):
+        self.backend = backend
+        self.name = f'leader:{name}'
+        self.ttl = ttl
+
+    def held(self):
+        try:
+            return self.backend.acquire_lease(self.name, holder_id(), self.ttl)
+        except Exception as e:
+            print(f"Failed to renew lease {self.name}: {e}")
+            return False
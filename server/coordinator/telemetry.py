@@ -0,0 +1,656 @@
+"""Metrics and tracing for the Flask services.
+
+Metrics are plain in-process counters and histograms rendered in the
+Prometheus text exposition format on `/metrics`. Recording a sample is a
+dict lookup, a bisect and an addition under a lock, so it is cheap enough
+for the per-chunk paths.
+
+Traces follow the W3C trace context: the `traceparent` header is read on
+every request and added to outgoing calls with `inject_headers()`. Finished
+spans go to a JSON-lines file (TRACE_EXPORT_FILE) and/or an OTLP/HTTP
+collector (OTLP_ENDPOINT); with neither configured no spans are recorded.
+
+`install_profiling()` adds admin endpoints that run a sampling profiler for
+a bounded window and return collapsed stacks (flamegraph.pl / speedscope
+input), and lets single requests be profiled with cProfile by sending an
+`X-Profile: 1` header. Admin access needs ADMIN_TOKEN (sent back as the
+`X-Admin-Token` header); without it the endpoints are disabled.
+
+`StartupTimer` logs how long each step of a service's startup took.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import pstats
+import cProfile
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+
+import requests
+from flask import request, g, jsonify
+
+# Latency buckets in seconds, from sub-millisecond chunk operations to slow chain calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, child in children:
+            lines.extend(child.render(self.name, self.labelnames, labelvalues))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, labelvalues):
+        return [f'{name}{_format_labels(labelnames, labelvalues)} {self.value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, labelvalues):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, labelvalues, ("le", bound))} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{_format_labels(labelnames, labelvalues, ("le", "+Inf"))} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, labelvalues)} {total}')
+        lines.append(f'{name}_count{_format_labels(labelnames, labelvalues)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, name, documentation, callback, labelnames=()):
+        """Gauge computed at scrape time; callback returns {labelvalues_tuple: value}"""
+        self._collectors.append((name, documentation, labelnames, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, labelnames, callback in self._collectors:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            try:
+                values = callback()
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for labelvalues, value in values.items():
+                lines.append(f'{name}{_format_labels(labelnames, labelvalues)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests handled, by route, method and status', ('route', 'method', 'status'))
+http_latency = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('route', 'method'))
+http_bytes_in = REGISTRY.counter(
+    'http_request_bytes_total', 'Request body bytes received, by route', ('route',))
+http_bytes_out = REGISTRY.counter(
+    'http_response_bytes_total', 'Response body bytes sent, by route', ('route',))
+chain_latency = REGISTRY.histogram(
+    'chain_call_duration_seconds', 'Latency of blockchain calls', ('call',))
+
+
+def timed_chain_call(call):
+    """Time a blockchain call: `with timed_chain_call('getEncryptionKey'): ...`"""
+    return chain_latency.labels(call).time()
+
+
+def _process_age():
+    """Seconds since this process started, from /proc where available"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Wall time of each step of a service's startup.
+
+    Created right after the imports, whose time is taken from the process
+    start when /proc allows it. `mark(step)` closes the step running since
+    the previous mark; `report()` logs the breakdown and exports it as the
+    `service_startup_seconds` gauge.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.steps = []
+        self._last = time.perf_counter()
+        imports = _process_age()
+        if imports is not None:
+            self.steps.append(('imports', imports))
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = sum(seconds for _, seconds in self.steps)
+        breakdown = ', '.join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in self.steps)
+        print(f"{self.service} started in {total:.3f}s ({breakdown})")
+        steps = list(self.steps)
+        REGISTRY.gauge_callback('service_startup_seconds', 'Time spent in each startup step',
+                                lambda: {(step,): round(seconds, 6) for step, seconds in steps}, ('step',))
+
+
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE', '')
+OTLP_ENDPOINT = os.getenv('OTLP_ENDPOINT', '').rstrip('/')
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', '1.0'))
+TRACING_ENABLED = bool(TRACE_EXPORT_FILE or OTLP_ENDPOINT)
+
+_trace_state = threading.local()
+_service_name = 'unknown'
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    def __init__(self, name, trace_id, parent_id, sampled, kind='internal', attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = 'error'
+        self.attributes['error.message'] = str(message)
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            'service': _service_name,
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'kind': self.kind,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+def _span_stack():
+    stack = getattr(_trace_state, 'stack', None)
+    if stack is None:
+        stack = _trace_state.stack = []
+    return stack
+
+
+def current_span():
+    stack = _span_stack()
+    return stack[-1] if stack else None
+
+
+def _parse_traceparent(header):
+    parts = (header or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == '01'
+
+
+def _begin_span(name, kind='internal', attributes=None, traceparent=None):
+    parent = current_span()
+    if traceparent is not None:
+        parsed = _parse_traceparent(traceparent)
+    else:
+        parsed = (parent.trace_id, parent.span_id, parent.sampled) if parent else None
+    if parsed:
+        trace_id, parent_id, sampled = parsed
+    else:
+        trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        sampled = random.random() < TRACE_SAMPLE_RATIO
+    span = Span(name, trace_id, parent_id, sampled, kind, attributes)
+    _span_stack().append(span)
+    return span
+
+
+def _end_span(span):
+    span.end_ns = time.time_ns()
+    stack = _span_stack()
+    if stack and stack[-1] is span:
+        stack.pop()
+    elif span in stack:
+        stack.remove(span)
+    if span.sampled and _exporter:
+        _exporter.export(span)
+
+
+@contextmanager
+def start_span(name, kind='internal', **attributes):
+    """Record a child span of the current span: `with start_span('chunk.store', node_id=...)`"""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    span = _begin_span(name, kind, attributes)
+    try:
+        yield span
+    except Exception as e:
+        span.set_error(e)
+        raise
+    finally:
+        _end_span(span)
+
+
+def inject_headers(headers=None):
+    """Add the trace context of the current span to outgoing request headers"""
+    headers = dict(headers or {})
+    span = current_span()
+    if span is not None:
+        headers['traceparent'] = span.traceparent
+    return headers
+
+
+class _SpanExporter:
+    """Batches finished spans and writes them from a background thread"""
+
+    def __init__(self, file_path, otlp_endpoint, max_queue=10000, batch_size=512, interval=1.0):
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        if self.file_path:
+            try:
+                with open(self.file_path, 'a') as f:
+                    for span in batch:
+                        f.write(json.dumps(span.to_dict()) + '\n')
+            except OSError as e:
+                print(f"Failed to write spans to {self.file_path}: {e}")
+        if self.otlp_endpoint:
+            try:
+                requests.post(f'{self.otlp_endpoint}/v1/traces', json=_otlp_payload(batch), timeout=5)
+            except Exception as e:
+                print(f"Failed to export spans to {self.otlp_endpoint}: {e}")
+
+
+_OTLP_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_payload(spans):
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': _service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'dstorage.telemetry'},
+            'spans': [{
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id or '',
+                'name': span.name,
+                'kind': _OTLP_KINDS.get(span.kind, 1),
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+                'status': {'code': 2 if span.status == 'error' else 1}
+            } for span in spans]
+        }]
+    }]}
+
+
+_exporter = _SpanExporter(TRACE_EXPORT_FILE, OTLP_ENDPOINT) if TRACING_ENABLED else None
+
+
+def instrument_app(app, service):
+    """Record per-route request metrics and traces, and expose metrics on /metrics"""
+    global _service_name
+    _service_name = service
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        if TRACING_ENABLED:
+            # Drop anything a previous request on this thread left behind
+            _span_stack().clear()
+            g._trace_span = _begin_span(
+                f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+                kind='server',
+                attributes={'http.method': request.method, 'http.target': request.path},
+                traceparent=request.headers.get('traceparent', '')
+            )
+
+    @app.after_request
+    def _record(response):
+        start = getattr(g, '_metrics_start', None)
+        if start is None:
+            return response
+        span = g.pop('_trace_span', None)
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+            _end_span(span)
+            response.headers['traceparent'] = span.traceparent
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_latency.labels(route, request.method).observe(time.perf_counter() - start)
+        http_requests.labels(route, request.method, str(response.status_code)).inc()
+        if request.content_length:
+            http_bytes_in.labels(route).inc(request.content_length)
+        if response.content_length:
+            http_bytes_out.labels(route).inc(response.content_length)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    REGISTRY.gauge_callback('service_info', 'Service identity', lambda: {(service,): 1}, ('service',))
+
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval.
+
+    Only one frame walk per thread per tick is done from a separate thread,
+    so the profiled code runs unmodified; at the default 10 ms interval the
+    overhead stays around a percent of one core.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = {}
+        self.samples = 0
+        self.started_at = None
+        self.interval = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.01, max_seconds=60.0):
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = {}
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval, max_seconds), daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, interval, max_seconds):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.time() + max_seconds
+        while not self._stop.wait(interval) and time.time() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                parts.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(parts))
+                with self._lock:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        return self.collapsed()
+
+    def collapsed(self):
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'samples': self.samples,
+                'started_at': self.started_at,
+                'interval_ms': self.interval * 1000 if self.interval else None
+            }
+
+
+profiler = SamplingProfiler()
+
+# Recent per-request cProfile reports, newest last
+_request_profiles = {}
+_request_profiles_lock = threading.Lock()
+MAX_REQUEST_PROFILES = 50
+
+
+def _admin_authorized():
+    return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+def install_profiling(app):
+    """Admin endpoints for the sampling profiler and per-request cProfile"""
+
+    @app.before_request
+    def _start_request_profile():
+        if request.headers.get('X-Profile') == '1' and _admin_authorized():
+            g._request_profile = cProfile.Profile()
+            g._request_profile.enable()
+
+    @app.after_request
+    def _finish_request_profile(response):
+        profile = g.pop('_request_profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(60)
+        profile_id = uuid.uuid4().hex[:12]
+        with _request_profiles_lock:
+            _request_profiles[profile_id] = {
+                'route': request.url_rule.rule if request.url_rule else request.path,
+                'method': request.method,
+                'created_at': time.time(),
+                'report': out.getvalue()
+            }
+            while len(_request_profiles) > MAX_REQUEST_PROFILES:
+                del _request_profiles[next(iter(_request_profiles))]
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.route('/admin/profile/start', methods=['POST'])
+    def profile_start():
+        if not _admin_authorized():
+            return jsonify({'error': 'Not authorized'}), 403
+        interval_ms = float(request.args.get('interval_ms', 10))
+        max_seconds = float(request.args.get('max_seconds', 60))
+        if not profiler.start(interval=max(interval_ms, 1) / 1000.0, max_seconds=min(max_seconds, 600)):
+            return jsonify({'error': 'Profiler already running'}), 409
+        return jsonify(profiler.status()), 200
+
+    @app.route('/admin/profile/stop', methods=['POST'])
+    def profile_stop():
+        if not _admin_authorized():
+            return jsonify({'error': 'Not authorized'}), 403
+        return app.response_class(profiler.stop(), mimetype='text/plain')
+
+    @app.route('/admin/profile/status', methods=['GET'])
+    def profile_status():
+        if not _admin_authorized():
+            return jsonify({'error': 'Not authorized'}), 403
+        status = profiler.status()
+        with _request_profiles_lock:
+            status['request_profiles'] = [
+                {'id': profile_id, 'route': p['route'], 'method': p['method'], 'created_at': p['created_at']}
+                for profile_id, p in _request_profiles.items()
+            ]
+        return jsonify(status), 200
+
+    @app.route('/admin/profile/requests/<profile_id>', methods=['GET'])
+    def request_profile(profile_id):
+        if not _admin_authorized():
+            return jsonify({'error': 'Not authorized'}), 403
+        with _request_profiles_lock:
+            profile = _request_profiles.get(profile_id)
+        if profile is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        return app.response_class(profile['report'], mimetype='text/plain')
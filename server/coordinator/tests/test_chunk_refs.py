@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from sharding import ShardManager
+from state_backend import MemoryBackend
+
+
+@pytest.fixture
+def shards():
+    return ShardManager(MemoryBackend(), 'shard-0', shard_url='http://shard-0')
+
+
+def test_identical_uploads_keep_shared_chunk(shards):
+    # Two unencrypted files with the same content store the same chunk id
+    assert shards.chunk_refs(claim=['a' * 64]) == []
+    assert shards.chunk_refs(claim=['a' * 64]) == []
+    assert shards.chunk_refs(remove=['a' * 64]) == []
+    assert shards.chunk_refs(remove=['a' * 64]) == ['a' * 64]
+
+
+def test_clone_of_claimed_chunk(shards):
+    shards.chunk_refs(claim=['b' * 64])
+    shards.chunk_refs(add=['b' * 64])
+    assert shards.chunk_refs(remove=['b' * 64]) == []
+    # The entry stays known, so another identical upload still counts
+    shards.chunk_refs(claim=['b' * 64])
+    assert shards.chunk_refs(remove=['b' * 64]) == []
+    assert shards.chunk_refs(remove=['b' * 64]) == ['b' * 64]
+
+
+def test_unclaimed_chunk_has_one_reference(shards):
+    assert shards.chunk_refs(remove=['c' * 64]) == ['c' * 64]
+    shards.chunk_refs(add=['d' * 64])
+    assert shards.chunk_refs(remove=['d' * 64]) == []
+    assert shards.chunk_refs(remove=['d' * 64]) == ['d' * 64]
@@ -0,0 +1,109 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import sharding
+from sharding import HASH_SPACE, ShardManager, shard_hash
+from state_backend import MemoryBackend
+
+TARGET = 'http://shard-1'
+
+
+def key_in(lower_half):
+    for i in range(1000):
+        key = f'file-{i}'
+        if (shard_hash(key) < HASH_SPACE // 2) == lower_half:
+            return key
+
+
+class Records(dict):
+    def values(self):
+        return list(super().values())
+
+    def put_many(self, records):
+        self.update(records)
+
+    def delete(self, file_id):
+        self.pop(file_id, None)
+
+    def delete_many(self, file_ids):
+        for file_id in file_ids:
+            self.pop(file_id, None)
+
+
+class Response:
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def cutover(monkeypatch):
+    """A shard mid-split, with every call it makes to the new shard recorded"""
+    shards = ShardManager(MemoryBackend(), 'shard-0', shard_url='http://shard-0')
+    posted = []
+    monkeypatch.setattr(shards, '_post', lambda url, path, payload: posted.append((url, path, payload)) or {})
+    monkeypatch.setattr(sharding.requests, 'put', lambda *args, **kwargs: Response())
+    return shards, posted
+
+
+def test_write_during_cleanup_is_forwarded(cutover):
+    shards, posted = cutover
+    moved, kept = key_in(lower_half=False), key_in(lower_half=True)
+    records = Records({moved: {'file_id': moved}, kept: {'file_id': kept}})
+    states = []
+    original_save = shards._save_migration
+
+    def save_migration(migration):
+        original_save(migration)
+        states.append((migration['state'], shards.owns(moved)))
+        if migration['state'] == 'cleanup':
+            # A write that passed its ownership check just before the cutover
+            shards.forward_put(moved, {'file_id': moved, 'filename': 'late'})
+
+    shards._save_migration = save_migration
+    migration = {'start': HASH_SPACE // 2, 'end': HASH_SPACE, 'target': TARGET, 'shard_id': 'shard-1',
+                 'state': 'copying', 'copied': 0, 'error': None}
+    original_save(migration)
+    shards._run_split(records, migration)
+
+    assert migration['state'] == 'done', migration['error']
+    # The new map is in force before the copying state ends
+    assert ('cleanup', False) in states
+    assert (TARGET, '/shard/import', {'files': {moved: {'file_id': moved, 'filename': 'late'}}}) in posted
+    assert list(records) == [kept]
+    assert not shards.owns(moved) and shards.owns(kept)
+    # Nothing is forwarded once the split is done
+    posted.clear()
+    shards.forward_put(moved, {'file_id': moved})
+    assert posted == []
+
+
+def test_forwarded_writes_not_overtaken_by_copy(cutover):
+    shards, posted = cutover
+    moved = [key for key in (f'file-{i}' for i in range(1000)) if shard_hash(key) >= HASH_SPACE // 2][:2]
+    updated, deleted = moved
+
+    class Listing(Records):
+        def values(self):
+            listing = super().values()
+            if not posted:
+                # Writers forward while the copy is between listing and sending the range
+                self[updated] = {'file_id': updated, 'filename': 'v2'}
+                shards.forward_put(updated, self[updated])
+                self.pop(deleted)
+                shards.forward_delete(deleted)
+            return listing
+
+    records = Listing({updated: {'file_id': updated, 'filename': 'v1'}, deleted: {'file_id': deleted}})
+    migration = {'start': HASH_SPACE // 2, 'end': HASH_SPACE, 'target': TARGET, 'shard_id': 'shard-1',
+                 'state': 'copying', 'copied': 0, 'error': None}
+    shards._save_migration(migration)
+    shards._run_split(records, migration)
+    assert migration['state'] == 'done', migration['error']
+
+    # Replay what the new shard received, in order
+    target = Records()
+    for _, path, payload in posted:
+        if path == '/shard/import':
+            shards.import_batch(target, {key: payload.get(key) for key in ('files', 'deleted') if key in payload})
+    assert target == {updated: {'file_id': updated, 'filename': 'v2'}}
@@ -37,8 +37,13 @@ function App() {
   const [activeTab, setActiveTab] = useState('files');
   const [agreements, setAgreements] = useState([]);
   const [providers, setProviders] = useState([]);
+  const [clientConfig, setClientConfig] = useState(null);
 
   // Fetch files when component mounts or wallet changes
+  useEffect(() => {
+    fetchClientConfig();
+  }, []);
+
   useEffect(() => {
     fetchFiles();
     fetchNodes();
@@ -48,6 +53,17 @@ function App() {
     }
   }, [wallet]);
 
+  const fetchClientConfig = async () => {
+    try {
+      const response = await fetch(`${API_URL}/client_config`);
+      if (response.ok) {
+        setClientConfig(await response.json());
+      }
+    } catch (error) {
+      console.error('Error fetching client config:', error);
+    }
+  };
+
   const fetchFiles = async () => {
     try {
       let url = `${API_URL}/list_files`;
@@ -116,9 +132,18 @@ function App() {
       if (agreementId) {
         formData.append('agreement_id', agreementId);
       }
+      // Admission limits read the owner and agreement from headers, before the body arrives
+      const headers = {};
+      if (wallet || owner) {
+        headers['X-Owner'] = wallet ? wallet.address : owner;
+      }
+      if (agreementId) {
+        headers['X-Agreement-Id'] = agreementId;
+      }
       console.log('Uploading file:', file);
       const response = await fetch(`${API_URL}/upload`, {
         method: 'POST',
+        headers: headers,
         body: formData,
       });
 
@@ -135,6 +160,60 @@ function App() {
     }
   };
 
+  const sha256Hex = async (data) => {
+    const digest = await crypto.subtle.digest('SHA-256', data);
+    return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+  };
+
+  // Sends the chunks straight to the storage nodes; the client API only signs tokens and records the file
+  const handleDirectUpload = async (file) => {
+    const headers = { 'Content-Type': 'application/json' };
+    if (wallet) {
+      headers['X-Owner'] = wallet.address;
+    }
+    const chunkSize = clientConfig.chunk_size;
+    const chunks = [];
+    for (let index = 0; index * chunkSize < file.size; index++) {
+      const data = await file.slice(index * chunkSize, (index + 1) * chunkSize).arrayBuffer();
+      chunks.push({ index, chunk_id: await sha256Hex(data) });
+    }
+
+    let response = await fetch(`${API_URL}/direct/upload`, {
+      method: 'POST',
+      headers: headers,
+      body: JSON.stringify({ filename: file.name, size: file.size, chunks }),
+    });
+    const grants = await response.json();
+    if (!response.ok) {
+      throw new Error(grants.error || 'Upload failed');
+    }
+
+    const receipts = await Promise.all(grants.chunks.map(async (grant) => {
+      const nodeResponse = await fetch(grant.url, {
+        method: 'POST',
+        headers: grant.headers,
+        body: file.slice(grant.index * chunkSize, (grant.index + 1) * chunkSize),
+      });
+      const result = await nodeResponse.json();
+      if (!nodeResponse.ok) {
+        throw new Error(result.error || `Chunk ${grant.index} upload failed`);
+      }
+      return result.receipt;
+    }));
+
+    response = await fetch(`${API_URL}/direct/upload/${grants.file_id}/complete`, {
+      method: 'POST',
+      headers: headers,
+      body: JSON.stringify({ filename: file.name, size: file.size, receipts }),
+    });
+    const result = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error || 'Upload failed');
+    }
+    fetchFiles();
+    return result;
+  };
+
   const handleFileDelete = async (fileId) => {
     try {
       const headers = {};
@@ -165,7 +244,9 @@ function App() {
     if (wallet) {
       headers['X-Owner'] = wallet.address;
     }
-    window.open(`${API_URL}/download/${fileId}`, '_blank');
+    // A new window cannot send headers, so the owner rides in the query string
+    const query = wallet ? `?owner=${encodeURIComponent(wallet.address)}` : '';
+    window.open(`${API_URL}/download/${fileId}${query}`, '_blank');
   };
 
   const handleLockStorage = async (sizeMB) => {
@@ -206,6 +287,25 @@ function App() {
     }
   };
 
+  const waitForTxJob = async (jobId, timeoutMs = 300000) => {
+    const deadline = Date.now() + timeoutMs;
+    while (Date.now() < deadline) {
+      const response = await fetch(`${API_URL}/tx_jobs/${jobId}`);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.error || 'Failed to check transaction status');
+      }
+      if (job.status === 'confirmed') {
+        return job;
+      }
+      if (job.status === 'failed') {
+        throw new Error(`Transaction failed: ${job.error || 'unknown error'}`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+    throw new Error(`Transaction ${jobId} is still pending, check back later`);
+  };
+
   const handleRentStorage = async (nodeId, sizeMB, durationDays) => {
     console.log('Renting storage:', nodeId, sizeMB, durationDays);
     try {
@@ -228,6 +328,11 @@ function App() {
 
       if (response.ok) {
         const result = await response.json();
+        // The agreement is created by a background transaction; wait for it before refreshing
+        if (result.job_id && result.status === 'pending') {
+          await waitForTxJob(result.job_id);
+          result.status = 'success';
+        }
         fetchUserAgreements();
         return result;
       } else {
@@ -306,6 +411,7 @@ function App() {
             {activeTab === 'upload' && (
               <FileUpload 
                 onUpload={handleFileUpload} 
+                onDirectUpload={clientConfig && clientConfig.direct_transfers ? handleDirectUpload : null}
                 wallet={wallet} 
                 agreements={agreements}
               />
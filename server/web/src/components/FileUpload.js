@@ -10,16 +10,19 @@ import {
   InputLabel,
   Select,
   MenuItem,
-  FormHelperText
+  FormHelperText,
+  FormControlLabel,
+  Checkbox
 } from '@mui/material';
 import CloudUploadIcon from '@mui/icons-material/CloudUpload';
 
-const FileUpload = ({ onUpload, wallet, agreements }) => {
+const FileUpload = ({ onUpload, onDirectUpload, wallet, agreements }) => {
   const [selectedFile, setSelectedFile] = useState(null);
   const [uploading, setUploading] = useState(false);
   const [uploadSuccess, setUploadSuccess] = useState(false);
   const [uploadError, setUploadError] = useState(null);
   const [selectedAgreement, setSelectedAgreement] = useState('');
+  const [direct, setDirect] = useState(false);
 
   const handleFileChange = (event) => {
     const file = event.target.files[0];
@@ -41,7 +44,11 @@ const FileUpload = ({ onUpload, wallet, agreements }) => {
     setUploadSuccess(false);
 
     try {
-      await onUpload(selectedFile, null, selectedAgreement || null);
+      if (direct && onDirectUpload && !selectedAgreement) {
+        await onDirectUpload(selectedFile);
+      } else {
+        await onUpload(selectedFile, null, selectedAgreement || null);
+      }
       setUploadSuccess(true);
       setSelectedFile(null);
       // Reset the file input
@@ -121,6 +128,18 @@ const FileUpload = ({ onUpload, wallet, agreements }) => {
         </FormControl>
       )}
 
+      {onDirectUpload && !selectedAgreement && (
+        <FormControl fullWidth sx={{ mb: 2 }}>
+          <FormControlLabel
+            control={<Checkbox checked={direct} onChange={(e) => setDirect(e.target.checked)} />}
+            label="Send straight to the storage nodes"
+          />
+          <FormHelperText>
+            Faster for large files, but the file is stored unencrypted
+          </FormHelperText>
+        </FormControl>
+      )}
+
       {uploading && (
         <Box sx={{ width: '100%', mb: 2 }}>
           <LinearProgress />